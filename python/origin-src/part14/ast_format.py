@@ -0,0 +1,393 @@
+###############################################################################
+#  Compact binary AST format.                                                 #
+#                                                                             #
+#  A parsed program is written as:                                            #
+#                                                                             #
+#      MAGIC  FORMAT_VERSION                                                  #
+#      string table    count, then (byte length, UTF-8 bytes) per string      #
+#      constant table  count, then (tag, payload) per constant                #
+#      node stream     count, then one record per node, in post-order         #
+#                                                                             #
+#  All integers are unsigned LEB128 varints; signed ones are zigzag encoded.  #
+#  Each distinct identifier or name is stored once in the string table, and   #
+#  each distinct token or name once in the constant table. A node record is   #
+#  its kind code (one byte, see flat_ast.KINDS), the constant index plus one  #
+#  for node kinds that carry one (0 when it is missing, as for the names the  #
+#  error recovery could not read), the child count for the kinds that have a  #
+#  variable number of children, then its source span. Children are not        #
+#  referenced explicitly: in post-order they are the last nodes read, so      #
+#  loading needs only a stack.                                                #
+#                                                                             #
+#  Each span offset is stored as the zigzag encoded difference from a guess,  #
+#  plus one; 0 stands for a missing offset. A node with children is guessed   #
+#  to start where its first child starts and to end where its last child,     #
+#  the previous node, ends; a leaf to start where the previous node ends and  #
+#  to end where it starts. Most differences then fit in a single byte. The    #
+#  span of a node with children is a single byte, 1, when it is exactly the   #
+#  guessed one, as for BinOp, Assign and the other nodes that take their      #
+#  span from their children; its start differences are then stored plus 2.    #
+#                                                                             #
+#  Loading decodes straight out of a memoryview over the data (or over an     #
+#  mmap of the file), without slicing copies.                                 #
+#                                                                             #
+###############################################################################
+import gc
+import mmap
+import struct
+
+from flat_ast import FlatAST, KINDS, KIND_CODES, NO_POSITION, from_ast, make_node
+from spi import (
+    BinOp, UnaryOp, Compound, Assign, Var, Num, Program, Block, VarDecl,
+    Type, Param, ProcedureDecl, Token, TOKEN_TYPES, TOKEN_CODES, SHARED_TOKENS,
+)
+
+
+MAGIC = b'SPIA'
+# Bump whenever the layout, flat_ast.KINDS or spi.TOKEN_TYPES change
+FORMAT_VERSION = 4
+
+# constant table tags
+NAME, TOKEN_STR, TOKEN_INT, TOKEN_REAL = range(4)
+
+# the start field of a node with children whose span is exactly the
+# guessed one (see dumps()); its end field is left out
+_GUESSED_SPAN = 1
+
+_DOUBLE = struct.Struct('<d')
+
+# node kind codes that carry a constant, and the number of children of
+# every kind (None: a child count follows in the node record)
+_VALUED = frozenset(
+    KIND_CODES[cls]
+    for cls in (BinOp, UnaryOp, Assign, Num, Var, Type, Program, ProcedureDecl)
+)
+_ARITY = {
+    BinOp: 2, Assign: 2, UnaryOp: 1, VarDecl: 2, Param: 2, Program: 1,
+    Compound: None, Block: None, ProcedureDecl: None,
+}
+_ARITIES = tuple(_ARITY.get(cls, 0) for cls in KINDS)
+
+
+def _builder(cls):
+    # the common node types skip the dispatch in make_node()
+    if cls in (BinOp, Assign):
+        return lambda value, kids: cls(kids[0], value, kids[1])
+    if cls in (Num, Var, Type):
+        return lambda value, kids: cls(value)
+    return lambda value, kids: make_node(cls, value, kids)
+
+
+# kind code -> function(value, children) returning the node
+_BUILDERS = tuple(_builder(cls) for cls in KINDS)
+
+
+class ASTFormatError(Exception):
+    pass
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_offset(out, offset, guess, base=1):
+    """Write an offset (or NO_POSITION, as 0) relative to its guess; the
+    values from 1 up to base are left for the caller."""
+    if offset == NO_POSITION:
+        out.append(0)
+        return
+    delta = offset - guess
+    value = (delta << 1 if delta >= 0 else (-delta << 1) - 1) + base
+    if value < 0x80:
+        out.append(value)
+    else:
+        _write_varint(out, value)
+
+
+def _write_string(out, string):
+    data = string.encode('utf-8')
+    _write_varint(out, len(data))
+    out += data
+
+
+def dumps(tree):
+    """Return the binary form of an AST (or of a FlatAST) as bytes."""
+    flat = tree if isinstance(tree, FlatAST) else from_ast(tree)
+    out = bytearray(MAGIC)
+    _write_varint(out, FORMAT_VERSION)
+
+    strings = {}
+    for constant in flat.constants:
+        value = constant if isinstance(constant, str) else constant.value
+        if isinstance(value, str):
+            strings.setdefault(value, len(strings))
+    _write_varint(out, len(strings))
+    for string in strings:
+        _write_string(out, string)
+
+    _write_varint(out, len(flat.constants))
+    for constant in flat.constants:
+        if isinstance(constant, str):
+            _write_varint(out, NAME)
+            _write_varint(out, strings[constant])
+            continue
+        value = constant.value
+        if isinstance(value, str):
+            _write_varint(out, TOKEN_STR)
+            _write_varint(out, TOKEN_CODES[constant.type])
+            _write_varint(out, strings[value])
+        elif isinstance(value, int):
+            _write_varint(out, TOKEN_INT)
+            _write_varint(out, TOKEN_CODES[constant.type])
+            _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+        else:
+            _write_varint(out, TOKEN_REAL)
+            _write_varint(out, TOKEN_CODES[constant.type])
+            out += _DOUBLE.pack(value)
+
+    kinds = flat.kinds
+    values = flat.values
+    child_start = flat.child_start
+    starts = flat.starts
+    ends = flat.ends
+    children = flat.children
+    _write_varint(out, len(kinds))
+    append = out.append
+    valued = _VALUED
+    arities = _ARITIES
+    # the end of the last node with one, which the offsets of the next
+    # node are guessed from
+    position = 0
+    nodes = zip(kinds, values, child_start, child_start[1:], starts, ends)
+    for kind, value, first, last, start, end in nodes:
+        append(kind)
+        if kind in valued:
+            # plus one, so that NO_VALUE (a missing name) is written as 0
+            value += 1
+            if value < 0x80:
+                append(value)
+            else:
+                _write_varint(out, value)
+        count = last - first
+        if arities[kind] is None:
+            _write_varint(out, count)
+        if count:
+            guess = starts[children[first]]
+            if guess == NO_POSITION:
+                guess = position
+            if start == guess and end == position:
+                append(_GUESSED_SPAN)
+                continue
+            _write_offset(out, start, guess, 2)
+            _write_offset(out, end, position)
+        elif start == NO_POSITION:
+            append(0)
+            _write_offset(out, end, position)
+        else:
+            # inline the common single-byte case of _write_offset()
+            delta = start - position
+            value = (delta << 1 if delta >= 0 else (-delta << 1) - 1) + 1
+            if value < 0x80:
+                append(value)
+            else:
+                _write_varint(out, value)
+            delta = end - start
+            if end == NO_POSITION:
+                append(0)
+            elif 0 <= delta < 0x3f:
+                append((delta << 1) + 1)
+            else:
+                _write_offset(out, end, start)
+        if end != NO_POSITION:
+            position = end
+    return bytes(out)
+
+
+def dump(tree, f):
+    """Write the binary form of an AST to the binary file f."""
+    f.write(dumps(tree))
+
+
+class _Reader(object):
+    """Decodes varints and strings out of a memoryview."""
+    def __init__(self, data):
+        self.buf = memoryview(data).cast('B')
+        self.pos = 0
+
+    def varint(self):
+        buf = self.buf
+        pos = self.pos
+        byte = buf[pos]
+        value = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            pos += 1
+            byte = buf[pos]
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        self.pos = pos + 1
+        return value
+
+    def string(self):
+        length = self.varint()
+        start = self.pos
+        self.pos = start + length
+        if self.pos > len(self.buf):
+            raise IndexError(start)
+        return str(self.buf[start:self.pos], 'utf-8')
+
+
+def loads(data):
+    """Return the AST stored in data (bytes, bytearray or an mmap)."""
+    reader = _Reader(data)
+    # Like unpickling, loading creates nothing but new nodes: pause the
+    # cyclic GC so that it does not traverse the growing tree over and over
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load(reader)
+    except (IndexError, KeyError, UnicodeDecodeError, struct.error):
+        raise ASTFormatError('Truncated or corrupt AST data at offset %d' % reader.pos)
+    finally:
+        reader.buf.release()
+        if gc_enabled:
+            gc.enable()
+
+
+def _load(reader):
+    if bytes(reader.buf[:len(MAGIC)]) != MAGIC:
+        raise ASTFormatError('Not an AST file')
+    reader.pos = len(MAGIC)
+    version = reader.varint()
+    if version != FORMAT_VERSION:
+        raise ASTFormatError('Unsupported AST format version %d' % version)
+
+    varint = reader.varint
+    strings = [reader.string() for _ in range(varint())]
+    constants = []
+    for _ in range(varint()):
+        tag = varint()
+        if tag == NAME:
+            constants.append(strings[varint()])
+            continue
+        code = varint()
+        shared = SHARED_TOKENS[code]
+        if tag == TOKEN_STR:
+            value = strings[varint()]
+        elif tag == TOKEN_INT:
+            value = varint()
+            value = value >> 1 if not value & 1 else -((value + 1) >> 1)
+        elif tag == TOKEN_REAL:
+            value = _DOUBLE.unpack_from(reader.buf, reader.pos)[0]
+            reader.pos += _DOUBLE.size
+        else:
+            raise ASTFormatError('Unknown constant tag %d' % tag)
+        if shared is not None and shared.value == value:
+            constants.append(shared)
+        else:
+            constants.append(Token(TOKEN_TYPES[code], value))
+
+    count = varint()
+    buf = reader.buf
+    valued = _VALUED
+    arities = _ARITIES
+    builders = _BUILDERS
+    stack = []
+    push = stack.append
+    pos = reader.pos
+    position = 0  # the end of the last node with one
+    for _ in range(count):
+        kind = buf[pos]
+        pos += 1
+        value = None
+        if kind in valued:
+            # single-byte varints inline, the rest through the reader
+            value = buf[pos]
+            if value < 0x80:
+                pos += 1
+            else:
+                reader.pos = pos
+                value = varint()
+                pos = reader.pos
+            value = constants[value - 1] if value else None
+        arity = arities[kind]
+        if arity is None:
+            reader.pos = pos
+            arity = varint()
+            pos = reader.pos
+        if arity == 0:
+            node = builders[kind](value, [])
+        elif arity > len(stack):
+            raise ASTFormatError('Malformed node stream')
+        else:
+            if arity == 2:
+                right = stack.pop()
+                kids = [stack.pop(), right]
+            else:
+                kids = stack[-arity:]
+                del stack[-arity:]
+            node = builders[kind](value, kids)
+
+        # the span offsets, relative to their guesses (see dumps())
+        start = buf[pos]
+        if start < 0x80:
+            pos += 1
+        else:
+            reader.pos = pos
+            start = varint()
+            pos = reader.pos
+        if arity:
+            guess = kids[0].start
+            if guess is None:
+                guess = position
+            if start == _GUESSED_SPAN:
+                node.start = guess
+                node.end = position
+                push(node)
+                continue
+            if start:
+                start -= 1
+        else:
+            guess = position
+        if start:
+            start -= 1
+            start = guess + (start >> 1 if not start & 1 else -((start + 1) >> 1))
+        else:
+            start = None
+        node.start = start
+        end = buf[pos]
+        if end < 0x80:
+            pos += 1
+        else:
+            reader.pos = pos
+            end = varint()
+            pos = reader.pos
+        if end:
+            guess = position if arity or start is None else start
+            end -= 1
+            position = guess + (end >> 1 if not end & 1 else -((end + 1) >> 1))
+            node.end = position
+        else:
+            node.end = None
+        push(node)
+    reader.pos = pos
+
+    if len(stack) != 1 or pos != len(buf):
+        raise ASTFormatError('Malformed node stream')
+    return stack[0]
+
+
+def load(f):
+    """Return the AST stored in the binary file f.
+
+    Regular files are mapped into memory rather than read.
+    """
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        # not backed by a file descriptor, or an empty file
+        return loads(f.read())
+    with data:
+        return loads(data)
@@ -0,0 +1,718 @@
+###############################################################################
+#  Benchmarks for the part 14 interpreter front end.                          #
+#                                                                             #
+#  $ python bench.py                 # run every benchmark                    #
+#  $ python bench.py lexer           # run only the named benchmarks          #
+#                                                                             #
+###############################################################################
+import argparse
+import gc
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from spi import (
+    Lexer, BytesLexer, NodeVisitor, Parser, StreamLexer, Token, TokenCursor,
+    NODE_CHILDREN,
+    EOF, ID, RESERVED_KEYWORDS, KEYWORD_SPELLINGS,
+)
+
+
+def generate_program(procedures=1000, statements=20):
+    """Return the text of a large, valid, machine-generated program."""
+    lines = [
+        'PROGRAM Generated;',
+        'VAR',
+        '   number, a, b : INTEGER;',
+        '   y            : REAL;',
+        '',
+    ]
+    for i in range(procedures):
+        lines.append('PROCEDURE Proc%d(x%d : INTEGER; r : REAL);' % (i, i))
+        lines.append('   VAR k, counter%d : INTEGER;' % i)
+        lines.append('BEGIN { Proc%d }' % i)
+        for j in range(statements):
+            lines.append(
+                '   k := 10 * x%d + 10 * counter%d DIV 4 - (%d + k) * 3;'
+                % (i, i, j)
+            )
+            lines.append('   r := r / 7 + 3.14 * (-%d.5 + k);' % j)
+        lines.append('   BEGIN END')
+        lines.append('END;  { Proc%d }' % i)
+        lines.append('')
+    lines.extend([
+        'BEGIN { Generated }',
+        '   number := 2;',
+        '   a := number;',
+        '   b := 10 * a + 10 * number DIV 4;',
+        '   y := 20 / 7 + 3.14',
+        'END.  { Generated }',
+        '',
+    ])
+    return '\n'.join(lines)
+
+
+def random_expression(rng, operands):
+    """Return a random expression over a, b and literals."""
+    if operands <= 1:
+        operand = rng.choice(['a', 'b', '7', '2.5', '(a)'])
+        return rng.choice(['', '', '', '-', '+', '- -']) + operand
+    left = rng.randint(1, operands - 1)
+    op = rng.choice(['+', '-', '*', 'DIV', '/'])
+    expression = '%s %s %s' % (
+        random_expression(rng, left), op, random_expression(rng, operands - left))
+    return '(%s)' % expression if rng.random() < 0.3 else expression
+
+
+def generate_expression_program(statements=1000, operands=30, seed=14):
+    """Return a program made of long assignment expressions."""
+    rng = random.Random(seed)
+    lines = ['PROGRAM Expressions;', 'VAR a, b : REAL;', 'BEGIN']
+    lines.extend(
+        '   a := %s;' % random_expression(rng, operands)
+        for _ in range(statements)
+    )
+    lines.append('   b := a')
+    lines.append('END.')
+    return '\n'.join(lines)
+
+
+def timeit(func, repeat=3):
+    """Return the best wall time of `repeat` calls to func."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def timeit_together(funcs, repeat=15):
+    """Return the best wall time of each function in funcs, called in
+    turns with the cyclic GC paused, so that a slow spell of the machine
+    or a collection does not hit one of them only."""
+    best = [None] * len(funcs)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for i, func in enumerate(funcs):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                if best[i] is None or elapsed < best[i]:
+                    best[i] = elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def time_pairs(base, func, repeat=15):
+    """Time func against base in adjacent pairs, with the cyclic GC paused.
+
+    Return the best time of each and the median ratio of func's time to
+    base's over the pairs. The two take turns going first, and a slow
+    spell of the machine that outlasts a pair cancels out of its ratio,
+    so the ratio is steadier than one of the best times over the other.
+    """
+    best = [None, None]
+    ratios = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for turn in range(repeat):
+            elapsed = [None, None]
+            for i in ((0, 1) if turn % 2 == 0 else (1, 0)):
+                start = time.perf_counter()
+                (base, func)[i]()
+                elapsed[i] = time.perf_counter() - start
+                if best[i] is None or elapsed[i] < best[i]:
+                    best[i] = elapsed[i]
+            ratios.append(elapsed[1] / elapsed[0])
+    finally:
+        if gc_enabled:
+            gc.enable()
+    ratios.sort()
+    return best[0], best[1], ratios[len(ratios) // 2]
+
+
+def count_tokens(lexer):
+    count = 0
+    while lexer.get_next_token().type != EOF:
+        count += 1
+    return count
+
+
+def bench_lexer(text):
+    """Tokens per second for the char-by-char, regex and DFA engines."""
+    print('source size: %d chars' % len(text))
+    for name, engine in (
+        ('char', {}), ('regex', {'use_regex': True}), ('dfa', {'use_dfa': True}),
+    ):
+        ntokens = count_tokens(Lexer(text, **engine))
+        elapsed = timeit(lambda: count_tokens(Lexer(text, **engine)))
+        print('%-8s %10d tokens %8.3fs %12.0f tokens/s' % (
+            name, ntokens, elapsed, ntokens / elapsed))
+
+
+def collect_tokens(lexer):
+    tokens = []
+    token = lexer.get_next_token()
+    while token.type != EOF:
+        tokens.append(token)
+        token = lexer.get_next_token()
+    return tokens
+
+
+def measure_allocations(func):
+    """Return (result, bytes still allocated, allocated blocks) of func()."""
+    tracemalloc.start()
+    try:
+        before_size, _ = tracemalloc.get_traced_memory()
+        before_blocks = sum(
+            stat.count for stat in tracemalloc.take_snapshot().statistics('filename')
+        )
+        result = func()
+        after_size, _ = tracemalloc.get_traced_memory()
+        after_blocks = sum(
+            stat.count for stat in tracemalloc.take_snapshot().statistics('filename')
+        )
+    finally:
+        tracemalloc.stop()
+    return result, after_size - before_size, after_blocks - before_blocks
+
+
+def bench_bytes(text):
+    """Tokens per second for the str and bytes lexers."""
+    data = text.encode('ascii')
+    for name, make_lexer in (
+        ('str', lambda: Lexer(text)),
+        ('bytes', lambda: BytesLexer(data)),
+        ('memview', lambda: BytesLexer(memoryview(data))),
+    ):
+        ntokens = count_tokens(make_lexer())
+        elapsed = timeit(lambda: count_tokens(make_lexer()))
+        print('%-8s %10d tokens %8.3fs %12.0f tokens/s' % (
+            name, ntokens, elapsed, ntokens / elapsed))
+
+
+def bench_parallel(text):
+    """Sequential tokenize_all() vs. parallel_tokenize()."""
+    from parallel_lexer import parallel_tokenize
+    print('source size: %d chars' % len(text))
+    print('%-12s %8.3fs' % (
+        'sequential', timeit(lambda: Lexer(text).tokenize_all(), repeat=1)))
+    for workers in (2, 4, os.cpu_count() or 1):
+        elapsed = timeit(
+            lambda: parallel_tokenize(text, workers, min_chunk_size=1),
+            repeat=1,
+        )
+        print('%-12s %8.3fs' % ('%d workers' % workers, elapsed))
+
+
+def bench_incremental(text):
+    """Re-lexing the whole source vs. relex() after a one-character edit."""
+    from incremental_lexer import relex
+    tokens = Lexer(text).tokenize_all()
+    offset = text.index('Proc%d(' % (text.count('PROCEDURE') // 2)) + 4
+    print('%-12s %8.3fs' % (
+        'full', timeit(lambda: Lexer(text[:offset] + 'x' + text[offset:]).tokenize_all())))
+    print('%-12s %8.3fs' % (
+        'incremental', timeit(lambda: relex(text, tokens, offset, 0, 'x'))))
+
+
+def bench_expressions(text):
+    """expr/term/factor recursion vs. precedence climbing."""
+    text = generate_expression_program(max(1, text.count('PROCEDURE') * 2))
+    tokens = Lexer(text).tokenize_all()
+    print('%d tokens' % len(tokens))
+    for name, climbing in (('recursive', False), ('climbing', True)):
+        elapsed = timeit(
+            lambda: Parser(TokenCursor(tokens), precedence_climbing=climbing).parse()
+        )
+        print('%-10s %8.3fs %12.0f tokens/s' % (name, elapsed, len(tokens) / elapsed))
+
+
+def bench_lazy(text):
+    """Eager parsing vs. lazily parsed procedure bodies, from tokens;
+    then spi.py's startup from source text, with and without --lazy."""
+    tokens = Lexer(text).tokenize_all()
+    print('%-10s %8.3fs' % (
+        'eager', timeit(lambda: Parser(TokenCursor(tokens)).parse())))
+    print('%-10s %8.3fs' % (
+        'lazy', timeit(
+            lambda: Parser(TokenCursor(tokens), lazy_procedures=True).parse())))
+
+    def lazy_all():
+        tree = Parser(TokenCursor(tokens), lazy_procedures=True).parse()
+        for declaration in tree.block.declarations:
+            getattr(declaration, 'block_node', None)
+
+    print('%-10s %8.3fs' % ('lazy, all', timeit(lazy_all)))
+
+    # what spi.py does before it can report on a program: read, parse
+    # and check it, eagerly or with --lazy; the check reaches every body
+    from spi import SemanticAnalyzer
+
+    def startup(lazy):
+        tree = Parser(StreamLexer(io.StringIO(text)), lazy_procedures=lazy).parse()
+        SemanticAnalyzer().visit(tree)
+
+    for name, lazy in (('startup', False), ('  --lazy', True)):
+        print('%-10s %8.3fs' % (name, timeit(lambda: startup(lazy))))
+
+
+def ast_nodes(node):
+    """Yield every node of an AST, depth first."""
+    from spi import AST
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        for cls in type(node).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                value = getattr(node, name.lstrip('_'))
+                if isinstance(value, AST):
+                    stack.append(value)
+                elif isinstance(value, list):
+                    stack.extend(value)
+
+
+class DictNode(object):
+    """A node with an instance __dict__, like the AST classes had."""
+
+
+def dict_tree(node):
+    """Copy an AST into DictNodes with the pre-__slots__ attributes.
+
+    BinOp, UnaryOp and Assign get both `token` and `op`, and Num, Var
+    and Type both `token` and `value`, as the classes used to set.
+    """
+    from spi import AST
+    copy = DictNode()
+    for cls in type(node).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            name = name.lstrip('_')
+            value = getattr(node, name)
+            if isinstance(value, AST):
+                value = dict_tree(value)
+            elif isinstance(value, list):
+                value = [dict_tree(child) for child in value]
+            setattr(copy, name, value)
+    for alias in ('token', 'value'):
+        if hasattr(node, alias):
+            setattr(copy, alias, getattr(node, alias))
+    return copy
+
+
+def bench_nodes(text):
+    """AST memory per node, with __slots__ vs. an instance __dict__.
+
+    The slots figure includes the Num and Var tokens built while parsing.
+    """
+    # 1000 procedures -> about a million nodes
+    text = generate_expression_program(max(1, text.count('PROCEDURE') * 12))
+    tokens = Lexer(text).tokenize_all()
+    tree, size, _ = measure_allocations(lambda: Parser(TokenCursor(tokens)).parse())
+    nodes = sum(1 for _ in ast_nodes(tree))
+    print('%d nodes' % nodes)
+    print('%-10s %10.1f bytes/node' % ('slots', size / nodes))
+    # the copy shares the tokens of the tree: only the nodes are counted
+    _, size, _ = measure_allocations(lambda: dict_tree(tree))
+    print('%-10s %10.1f bytes/node' % ('dict', size / nodes))
+
+
+class TreeWalker(NodeVisitor):
+    """Visits every node of a tree through NodeVisitor.visit()."""
+    def __init__(self):
+        self.count = 0
+
+    def generic_visit(self, node):
+        self.count += 1
+        # FlatAST views have the same class names as the AST classes
+        children = NODE_CHILDREN[type(node).__name__]
+        if children is not None:
+            for child in children(node):
+                self.visit(child)
+
+
+class GetattrVisit(object):
+    """NodeVisitor.visit() as it was before the dispatch tables: builds
+    the method name and looks it up on every visit."""
+    def visit(self, node):
+        method_name = 'visit_' + type(node).__name__
+        visitor = getattr(self, method_name, self.generic_visit)
+        return visitor(node)
+
+
+def generate_statement_program(statements=1000):
+    """Return a program whose main block runs `statements` assignments."""
+    lines = ['PROGRAM Statements;', 'VAR a, b : INTEGER; y : REAL;', 'BEGIN',
+             '   a := 2;', '   b := 3;', '   y := 1.5;']
+    for i in range(statements):
+        lines.append('   a := (b + %d) DIV 4 * 3 - a DIV 2;' % i)
+        lines.append('   b := -a + b DIV 2;')
+        lines.append('   y := y / 7 + 3.14 * (-%d.5 + a);' % i)
+    lines.append('END.')
+    return '\n'.join(lines)
+
+
+def bench_visitors(text):
+    """Nodes per second through the Interpreter and the SemanticAnalyzer:
+    their default recursive visit() with the cached dispatch tables, the
+    same with a getattr() per visit (as before the tables), and their
+    explicit-stack NodeWalker versions. Then a bare walk: NodeWalker vs.
+    recursive NodeVisitor.visit() calls.
+
+    Then a whole front end, as nodes per second of the program: the
+    SemanticAnalyzer and the Interpreter walking the tree one after the
+    other, against the single walk of the CodeGenerator and running its
+    code. These two are timed in turns, with the GC paused.
+
+    The analyzer runs without a tracer, except for 'traced', which
+    prints the trace to os.devnull.
+    """
+    from spi import (
+        CodeGenerator, Interpreter, NodeWalker, PrintTracer, SemanticAnalyzer,
+        StackInterpreter, StackSemanticAnalyzer,
+    )
+    text = generate_statement_program(max(1, text.count('PROCEDURE') * 10))
+    tree = Parser(Lexer(text)).parse()
+    nodes = sum(1 for _ in ast_nodes(tree))
+    print('%d nodes' % nodes)
+
+    def analyze(analyzer=SemanticAnalyzer):
+        return analyzer().visit(tree)
+
+    def traced():
+        with open(os.devnull, 'w') as devnull:
+            SemanticAnalyzer(PrintTracer(devnull)).visit(tree)
+
+    def separate():
+        analyze()
+        Interpreter(tree).interpret()
+
+    def fused():
+        Interpreter(tree).execute(analyze(CodeGenerator))
+
+    getattr_interpreter = type('Interpreter', (GetattrVisit, Interpreter), {})
+    getattr_analyzer = type('SemanticAnalyzer', (GetattrVisit, SemanticAnalyzer), {})
+    getattr_walker = type('TreeWalker', (GetattrVisit, TreeWalker), {})
+    for name, run in (
+        ('interpreter', lambda: Interpreter(tree).interpret()),
+        ('  getattr', lambda: getattr_interpreter(tree).interpret()),
+        ('  stack', lambda: StackInterpreter(tree).interpret()),
+        ('analyzer', analyze),
+        ('  getattr', lambda: analyze(getattr_analyzer)),
+        ('  stack', lambda: analyze(StackSemanticAnalyzer)),
+        ('  traced', traced),
+        ('walker', lambda: NodeWalker().visit(tree)),
+        ('recursive', lambda: TreeWalker().visit(tree)),
+        ('  getattr', lambda: getattr_walker().visit(tree)),
+    ):
+        elapsed = timeit(run)
+        print('%-12s %8.3fs %12.0f nodes/s' % (name, elapsed, nodes / elapsed))
+    separate_time, fused_time = timeit_together([separate, fused])
+    for name, elapsed in (('separate', separate_time), ('fused', fused_time)):
+        print('%-12s %8.3fs %12.0f nodes/s' % (name, elapsed, nodes / elapsed))
+    print('%-12s %+7.1f%%' % ('  fused', (fused_time / separate_time - 1) * 100))
+
+
+def bench_flat(text):
+    """Object AST vs. FlatAST: memory per node and a full NodeVisitor walk."""
+    from flat_ast import from_ast
+    text = generate_expression_program(max(1, text.count('PROCEDURE') * 4))
+    tokens = Lexer(text).tokenize_all()
+    tree, tree_size, _ = measure_allocations(
+        lambda: Parser(TokenCursor(tokens)).parse())
+    # the parse tree is dropped: the flat form is measured on its own
+    flat, flat_size, _ = measure_allocations(
+        lambda: from_ast(Parser(TokenCursor(tokens)).parse()))
+    nodes = len(flat)
+    print('%d nodes' % nodes)
+    for name, size, root in (
+        ('objects', tree_size, tree), ('flat', flat_size, flat.tree())
+    ):
+        elapsed = timeit(lambda: TreeWalker().visit(root))
+        print('%-10s %8.1f bytes/node %8.3fs walk' % (name, size / nodes, elapsed))
+
+
+def bench_format(text):
+    """Saving and loading the binary AST format vs. pickle, and re-parsing."""
+    import pickle
+    from ast_format import dumps, loads
+    tree = Parser(Lexer(text)).parse()
+    data = dumps(tree)
+    pickled = pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+
+    def unpickle():
+        # with the GC paused, as loads() and the parse cache do
+        gc.disable()
+        try:
+            pickle.loads(pickled)
+        finally:
+            gc.enable()
+
+    print('%-10s %10d bytes %8.3fs' % (
+        're-parse', len(text), timeit(lambda: Parser(Lexer(text)).parse())))
+    for name, size, save, load in (
+        ('pickle', len(pickled),
+         lambda: pickle.dumps(tree, pickle.HIGHEST_PROTOCOL), unpickle),
+        ('binary', len(data), lambda: dumps(tree), lambda: loads(data)),
+    ):
+        print('%-10s %10d bytes %8.3fs load %8.3fs save' % (
+            name, size, timeit(load), timeit(save)))
+
+
+def bench_dag(text):
+    """Expression trees vs. hash-consed expression DAGs."""
+    from spi import HashConsingNodeFactory
+    tokens = Lexer(text).tokenize_all()
+    for name, make_factory in (
+        ('tree', lambda: None), ('dag', HashConsingNodeFactory),
+    ):
+        def parse():
+            return Parser(TokenCursor(tokens, spans=False),
+                          node_factory=make_factory(), spans=False).parse()
+
+        _, size, blocks = measure_allocations(parse)
+        print('%-10s %8.3fs %12d bytes %10d blocks' % (
+            name, timeit(parse), size, blocks))
+
+
+# Most that recording source spans may add to lexing and parsing
+SPANS_BUDGET = 0.05
+
+
+def bench_spans(text):
+    """Parsing with and without source spans, and line/column lookups."""
+    from spi import LineIndex
+    tokens = Lexer(text).tokenize_all()
+    print('%-10s %8.3fs' % ('lex', timeit(lambda: Lexer(text).tokenize_all())))
+    # many short pairs give a steadier ratio than a few long ones
+    sample = generate_program(max(1, text.count('PROCEDURE') // 50))
+    sample_tokens = Lexer(sample).tokenize_all()
+    for name, parse in (
+        # from a ready TokenArray: the parser alone
+        ('parse', lambda spans: Parser(
+            TokenCursor(sample_tokens, spans), spans=spans).parse()),
+        ('tokens', lambda spans: Parser(
+            TokenCursor(Lexer(sample).tokenize_all(), spans), spans=spans).parse()),
+        ('regex', lambda spans: Parser(
+            Lexer(sample, use_regex=True), spans=spans).parse()),
+        ('stream', lambda spans: Parser(
+            StreamLexer(io.StringIO(sample)), spans=spans).parse()),
+    ):
+        plain, spanned, ratio = time_pairs(
+            lambda: parse(False), lambda: parse(True), repeat=101)
+        cost = ratio - 1
+        print('%-10s %8.3fs %8.3fs with spans (%+.1f%%, %s the %d%% budget)' % (
+            name, plain, spanned, cost * 100,
+            'within' if cost < SPANS_BUDGET else 'over', SPANS_BUDGET * 100))
+
+    print('%-10s %8.3fs' % ('index', timeit(lambda: LineIndex(text))))
+    lines = LineIndex(text)
+    starts = [node.start for node in ast_nodes(Parser(TokenCursor(tokens)).parse())]
+    elapsed = timeit(lambda: [lines.line_col(start) for start in starts])
+    print('%-10s %8.3fs %12.0f lookups/s' % (
+        'line_col', elapsed, len(starts) / elapsed))
+
+
+def bench_cache(text):
+    """Parsing a file vs. loading its AST from the parse cache."""
+    import shutil
+    from parse_cache import ParseCache
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'program.pas')
+        with open(path, 'w') as f:
+            f.write(text)
+        cache = ParseCache(os.path.join(directory, 'cache'))
+        cache.parse_file(path)
+
+        def parse():
+            with open(path) as source:
+                Parser(StreamLexer(source)).parse()
+
+        print('%-10s %8.3fs' % ('parse', timeit(parse)))
+        print('%-10s %8.3fs' % ('cache hit', timeit(lambda: cache.parse_file(path))))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_tokens(text):
+    """Token memory with flyweight tokens vs. one fresh Token per lexeme."""
+    def fresh_tokens():
+        # what the lexer used to do: a new Token for every lexeme
+        return [
+            Token(token.type, token.value)
+            for token in collect_tokens(Lexer(text))
+        ]
+
+    for name, func in (
+        ('fresh', fresh_tokens),
+        ('shared', lambda: collect_tokens(Lexer(text))),
+    ):
+        tokens, size, blocks = measure_allocations(func)
+        print('%-8s %10d tokens %8d distinct %10d blocks %12d bytes' % (
+            name, len(tokens), len(set(map(id, tokens))), blocks, size))
+
+
+def bench_stream(text):
+    """Peak memory of lexing a file read whole vs. streamed in chunks."""
+    fd, path = tempfile.mkstemp(suffix='.pas')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+
+        def read_whole():
+            with open(path) as f:
+                return count_tokens(Lexer(f.read()))
+
+        def streamed():
+            with open(path) as f:
+                return count_tokens(StreamLexer(f))
+
+        for name, func in (('whole', read_whole), ('stream', streamed)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            ntokens = func()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('%-8s %10d tokens %8.3fs %12d bytes peak' % (
+                name, ntokens, elapsed, peak))
+    finally:
+        os.remove(path)
+
+
+def bench_tokenize_all(text):
+    """Lazy get_next_token() vs. bulk tokenize_all() plus a TokenCursor.
+
+    Lexing in bulk is the faster of the two; parsing from the TokenArray
+    is not, since the cursor builds the same identifier and literal
+    tokens the lazy lexer does, and pays a call per token on top.
+    """
+    # timed in pairs, on a smaller program: see bench_spans
+    sample = generate_program(max(1, text.count('PROCEDURE') // 50))
+    lex_lazy, lex_bulk, lex_ratio = time_pairs(
+        lambda: count_tokens(Lexer(sample, use_regex=True)),
+        lambda: Lexer(sample).tokenize_all(),
+        repeat=101)
+    parse_lazy, parse_bulk, parse_ratio = time_pairs(
+        lambda: Parser(Lexer(sample, use_regex=True)).parse(),
+        lambda: Parser(TokenCursor(Lexer(sample).tokenize_all())).parse(),
+        repeat=101)
+    print('%-14s %8.4fs lex %18.4fs lex+parse' % (
+        'get_next_token', lex_lazy, parse_lazy))
+    print('%-14s %8.4fs lex (%+6.1f%%) %8.4fs lex+parse (%+.1f%%)' % (
+        'tokenize_all', lex_bulk, (lex_ratio - 1) * 100,
+        parse_bulk, (parse_ratio - 1) * 100))
+
+
+class CharCommentLexer(Lexer):
+    """Lexer with the original one-char-at-a-time comment skipping."""
+    def skip_comment(self, closing='}'):
+        self.advance()
+        while self.current_char != '}':
+            self.advance()
+        self.advance()  # the closing curly brace
+
+
+def generate_commented_program(procedures, comment_size=2000):
+    """Return generate_program(procedures) with a long comment per line."""
+    comment = '{ %s }' % ('lorem ipsum ' * (comment_size // 12))
+    return '\n'.join(
+        line + ' ' + comment
+        for line in generate_program(procedures, 2).splitlines()
+    )
+
+
+def bench_comments(text):
+    """Lexing speed on comment-heavy sources."""
+    text = generate_commented_program(max(1, text.count('PROCEDURE') // 10))
+    print('source size: %d chars' % len(text))
+    for name, func in (
+        ('per-char', lambda: count_tokens(CharCommentLexer(text))),
+        ('find', lambda: count_tokens(Lexer(text))),
+        ('regex', lambda: count_tokens(Lexer(text, use_regex=True))),
+    ):
+        print('%-8s %8.3fs' % (name, timeit(func)))
+
+
+def bench_keywords(text):
+    """Keyword recognition: upper() + lookup vs. the case-spelling table."""
+    lexer = Lexer(text)
+    words = []
+    token = lexer.get_next_token()
+    while token.type != EOF:
+        if token.type == ID or token.value in RESERVED_KEYWORDS:
+            # the spelling used in the source
+            words.append(text[lexer.pos - len(token.value):lexer.pos])
+        token = lexer.get_next_token()
+
+    def upper_lookup():
+        get = RESERVED_KEYWORDS.get
+        for word in words:
+            get(word.upper())
+
+    def spelling_lookup():
+        get = KEYWORD_SPELLINGS.get
+        for word in words:
+            get(word)
+
+    print('%d identifiers and keywords' % len(words))
+    for name, func in (('upper', upper_lookup), ('spellings', spelling_lookup)):
+        print('%-10s %8.3fs' % (name, timeit(func)))
+
+
+BENCHMARKS = [
+    ('lexer', bench_lexer),
+    ('tokens', bench_tokens),
+    ('stream', bench_stream),
+    ('tokenize_all', bench_tokenize_all),
+    ('comments', bench_comments),
+    ('keywords', bench_keywords),
+    ('bytes', bench_bytes),
+    ('parallel', bench_parallel),
+    ('incremental', bench_incremental),
+    ('expressions', bench_expressions),
+    ('cache', bench_cache),
+    ('lazy', bench_lazy),
+    ('nodes', bench_nodes),
+    ('flat', bench_flat),
+    ('format', bench_format),
+    ('dag', bench_dag),
+    ('visitors', bench_visitors),
+    ('spans', bench_spans),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the part 14 interpreter front end"
+    )
+    parser.add_argument('names', nargs='*', help='benchmarks to run')
+    parser.add_argument(
+        '--procedures', type=int, default=1000,
+        help='number of generated procedures (default: 1000)',
+    )
+    args = parser.parse_args()
+
+    text = generate_program(args.procedures)
+    for name, func in BENCHMARKS:
+        if args.names and name not in args.names:
+            continue
+        print('== %s ==' % name)
+        func(text)
+        print('')
+
+
+if __name__ == '__main__':
+    main()
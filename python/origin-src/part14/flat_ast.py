@@ -0,0 +1,297 @@
+###############################################################################
+#  Flat, array-backed AST.                                                    #
+#                                                                             #
+#  A FlatAST holds a whole tree as a table of nodes in parallel arrays        #
+#  instead of one Python object per node. Nodes are numbered in post-order,   #
+#  so children always come before their parent and the root is the last       #
+#  node. Each node has a kind code, the index of its value in a pool of       #
+#  constants (tokens and names, each stored once) and a run of child node     #
+#  indices.                                                                   #
+#                                                                             #
+#  FlatAST.tree() returns a view of the root whose class names and            #
+#  attributes match the AST classes of spi.py, so every NodeVisitor (the      #
+#  SemanticAnalyzer, the Interpreter, ...) can walk the flat form directly.   #
+#                                                                             #
+###############################################################################
+from array import array
+
+from spi import (
+    BinOp, Num, UnaryOp, Compound, Assign, Var, NoOp, Program, Block,
+    VarDecl, Type, Param, ProcedureDecl, NODE_CHILDREN,
+)
+
+
+# Kind code -> AST class. A new node type is a new entry at the end.
+KINDS = (
+    Program, Block, VarDecl, Type, Param, ProcedureDecl, Compound,
+    Assign, Var, NoOp, BinOp, UnaryOp, Num,
+)
+KIND_CODES = {cls: code for code, cls in enumerate(KINDS)}
+
+# value index of a node without a value
+NO_VALUE = -1
+# start or end of a node without a source span
+NO_POSITION = -1
+
+
+def node_value(node):
+    """Return the constant a node carries (a token or a name), or None."""
+    if isinstance(node, (BinOp, UnaryOp, Assign)):
+        return node.op
+    if isinstance(node, (Num, Var, Type)):
+        return node.token
+    if isinstance(node, Program):
+        return node.name
+    if isinstance(node, ProcedureDecl):
+        return node.proc_name
+    return None
+
+
+def node_children(node):
+    """Return the child nodes of an AST node, in field order."""
+    children = NODE_CHILDREN[type(node).__name__]
+    return children(node) if children is not None else ()
+
+
+class FlatAST(object):
+    """A whole AST stored as a struct of arrays.
+
+    kinds[i]       the KINDS code of node i
+    values[i]      the index in constants of its value, or NO_VALUE
+    child_start[i] where its child indices start in children; they run
+                   up to child_start[i + 1]
+    starts[i]      its AST start offset, or NO_POSITION
+    ends[i]        its AST end offset, or NO_POSITION
+    constants      the tokens and names of the tree, each stored once
+
+    Index arrays are 32-bit: a tree is limited to 2**31 nodes.
+    """
+    __slots__ = ('kinds', 'values', 'child_start', 'children', 'starts',
+                 'ends', 'constants')
+
+    def __init__(self, kinds=None, values=None, child_start=None,
+                 children=None, constants=None, starts=None, ends=None):
+        self.kinds = kinds if kinds is not None else array('B')
+        self.values = values if values is not None else array('i')
+        self.child_start = (
+            child_start if child_start is not None else array('i', [0])
+        )
+        self.children = children if children is not None else array('i')
+        self.starts = starts if starts is not None else array('q')
+        self.ends = ends if ends is not None else array('q')
+        self.constants = constants if constants is not None else []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def root(self):
+        """Index of the root node, the last one in post-order."""
+        return len(self.kinds) - 1
+
+    def kind(self, index):
+        """Return the AST class of node index."""
+        return KINDS[self.kinds[index]]
+
+    def value(self, index):
+        """Return the constant of node index, or None."""
+        value = self.values[index]
+        return None if value == NO_VALUE else self.constants[value]
+
+    def span(self, index):
+        """Return the (start, end) offsets of node index; either may be None."""
+        start = self.starts[index]
+        end = self.ends[index]
+        return (None if start == NO_POSITION else start,
+                None if end == NO_POSITION else end)
+
+    def child_indices(self, index):
+        """Return the indices of the children of node index."""
+        return self.children[self.child_start[index]:self.child_start[index + 1]]
+
+    def node(self, index):
+        """Return a NodeVisitor-compatible view of node index."""
+        return VIEWS[self.kinds[index]](self, index)
+
+    def tree(self):
+        """Return a view of the root node."""
+        return self.node(self.root)
+
+
+def from_ast(tree):
+    """Convert an object AST into a FlatAST.
+
+    Lazily parsed procedure bodies are parsed on the way. The tree is
+    walked with an explicit stack, so it may be arbitrarily deep.
+    """
+    flat = FlatAST()
+    kinds = flat.kinds
+    values = flat.values
+    child_start = flat.child_start
+    children = flat.children
+    starts = flat.starts
+    ends = flat.ends
+    constants = flat.constants
+    pool = {}
+    # for every node of the tree, in post-order, its children have
+    # already been assigned an index when it is emitted
+    indices = []
+    # (node, None) until its children are pushed, then (node, child count)
+    stack = [(tree, None)]
+    while stack:
+        node, child_count = stack.pop()
+        if child_count is None:
+            kids = node_children(node)
+            stack.append((node, len(kids)))
+            # reversed, so the children are emitted in field order
+            for child in reversed(kids):
+                stack.append((child, None))
+            continue
+
+        if child_count:
+            children.extend(indices[-child_count:])
+            del indices[-child_count:]
+        value = node_value(node)
+        if value is None:
+            values.append(NO_VALUE)
+        else:
+            # tokens are pooled by content, names by themselves
+            key = (value.type, value.value) if not isinstance(value, str) else value
+            if key not in pool:
+                pool[key] = len(constants)
+                constants.append(value)
+            values.append(pool[key])
+        kinds.append(KIND_CODES[type(node)])
+        child_start.append(len(children))
+        start = node.start
+        starts.append(NO_POSITION if start is None else start)
+        end = node.end
+        ends.append(NO_POSITION if end is None else end)
+        indices.append(len(kinds) - 1)
+    return flat
+
+
+def make_node(cls, value, kids):
+    """Build an AST node of class cls from its constant and children,
+    as returned by node_value() and node_children()."""
+    if cls in (BinOp, Assign):
+        return cls(kids[0], value, kids[1])
+    if cls is UnaryOp:
+        return UnaryOp(value, kids[0])
+    if cls in (Num, Var, Type):
+        return cls(value)
+    if cls is Compound:
+        node = Compound()
+        node.children = kids
+        return node
+    if cls in (VarDecl, Param):
+        return cls(kids[0], kids[1])
+    if cls is Block:
+        return Block(kids[:-1], kids[-1])
+    if cls is ProcedureDecl:
+        return ProcedureDecl(value, kids[:-1], kids[-1])
+    if cls is Program:
+        return Program(value, kids[0])
+    return cls()
+
+
+def to_ast(flat):
+    """Convert a FlatAST back into an object AST."""
+    nodes = []
+    for index in range(len(flat)):
+        kids = [nodes[child] for child in flat.child_indices(index)]
+        node = make_node(flat.kind(index), flat.value(index), kids)
+        node.start, node.end = flat.span(index)
+        nodes.append(node)
+    return nodes[-1] if nodes else None
+
+
+###############################################################################
+#                                                                             #
+#  NODE VIEWS                                                                 #
+#                                                                             #
+###############################################################################
+
+class FlatNode(object):
+    """A view of one node of a FlatAST.
+
+    Views are created on access and hold only the table and the node
+    index; each subclass is named after the AST class it stands for, so
+    NodeVisitor.visit() dispatches on it to the same visit_ methods.
+    """
+    __slots__ = ('flat', 'index')
+
+    def __init__(self, flat, index):
+        self.flat = flat
+        self.index = index
+
+    def _value(self):
+        return self.flat.value(self.index)
+
+    def _child(self, position):
+        """Return the child at position; negative positions count from
+        the last child."""
+        flat = self.flat
+        if position < 0:
+            start = flat.child_start[self.index + 1]
+        else:
+            start = flat.child_start[self.index]
+        return flat.node(flat.children[start + position])
+
+    def _children(self, start=0, stop=None):
+        flat = self.flat
+        indices = flat.child_indices(self.index)[start:stop]
+        return [flat.node(index) for index in indices]
+
+
+def _views():
+    """Build the view class of every node kind."""
+    def value(self):
+        return self._value()
+
+    def token_value(self):
+        return self._value().value
+
+    def child(position):
+        return property(lambda self: self._child(position))
+
+    common = {
+        'start': property(lambda self: self.flat.span(self.index)[0]),
+        'end': property(lambda self: self.flat.span(self.index)[1]),
+    }
+
+    fields = {
+        Program: {'name': property(value), 'block': child(0)},
+        Block: {
+            'declarations': property(lambda self: self._children(0, -1)),
+            'compound_statement': child(-1),
+        },
+        VarDecl: {'var_node': child(0), 'type_node': child(1)},
+        Param: {'var_node': child(0), 'type_node': child(1)},
+        Type: {'token': property(value), 'value': property(token_value)},
+        ProcedureDecl: {
+            'proc_name': property(value),
+            'params': property(lambda self: self._children(0, -1)),
+            'block_node': child(-1),
+        },
+        Compound: {'children': property(lambda self: self._children())},
+        Assign: {'left': child(0), 'op': property(value),
+                 'token': property(value), 'right': child(1)},
+        Var: {'token': property(value), 'value': property(token_value)},
+        NoOp: {},
+        BinOp: {'left': child(0), 'op': property(value),
+                'token': property(value), 'right': child(1)},
+        UnaryOp: {'op': property(value), 'token': property(value),
+                  'expr': child(0)},
+        Num: {'token': property(value), 'value': property(token_value)},
+    }
+    views = []
+    for cls in KINDS:
+        namespace = dict(common, **fields[cls])
+        namespace['__slots__'] = ()
+        views.append(type(cls.__name__, (FlatNode,), namespace))
+    return tuple(views)
+
+
+# Kind code -> view class
+VIEWS = _views()
@@ -7,13 +7,15 @@
 import argparse
 import textwrap
 
-from spi import Lexer, Parser, NodeVisitor
+from spi import Lexer, Parser, NodeWalker
 
 
-class ASTVisualizer(NodeVisitor):
+class ASTVisualizer(NodeWalker):
     def __init__(self, parser):
         self.parser = parser
         self.ncount = 1
+        # dot node number of each AST node (nodes have no room for it)
+        self.nums = {}
         self.dot_header = [textwrap.dedent("""\
         digraph astgraph {
           node [shape=circle, fontsize=12, fontname="Courier", height=.1];
@@ -24,154 +26,62 @@ class ASTVisualizer(NodeVisitor):
         self.dot_body = []
         self.dot_footer = ['}']
 
-    def visit_Program(self, node):
-        s = '  node{} [label="Program"]\n'.format(self.ncount)
+    def add_node(self, node, label):
+        s = '  node{} [label="{}"]\n'.format(self.ncount, label)
         self.dot_body.append(s)
-        node._num = self.ncount
+        self.nums[node] = self.ncount
         self.ncount += 1
 
-        self.visit(node.block)
-
-        s = '  node{} -> node{}\n'.format(node._num, node.block._num)
-        self.dot_body.append(s)
-
-    def visit_Block(self, node):
-        s = '  node{} [label="Block"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        for declaration in node.declarations:
-            self.visit(declaration)
-        self.visit(node.compound_statement)
-
-        for decl_node in node.declarations:
-            s = '  node{} -> node{}\n'.format(node._num, decl_node._num)
+    def add_edges(self, node, child_nums):
+        """Leave hook of every node: link it to its children, whose
+        results are their dot node numbers, and return its own."""
+        for child_num in child_nums:
+            s = '  node{} -> node{}\n'.format(self.nums[node], child_num)
             self.dot_body.append(s)
+        return self.nums[node]
 
-        s = '  node{} -> node{}\n'.format(
-            node._num,
-            node.compound_statement._num
-        )
-        self.dot_body.append(s)
+    def enter_Program(self, node):
+        self.add_node(node, 'Program')
 
-    def visit_VarDecl(self, node):
-        s = '  node{} [label="VarDecl"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+    def enter_Block(self, node):
+        self.add_node(node, 'Block')
 
-        self.visit(node.var_node)
-        s = '  node{} -> node{}\n'.format(node._num, node.var_node._num)
-        self.dot_body.append(s)
+    def enter_VarDecl(self, node):
+        self.add_node(node, 'VarDecl')
 
-        self.visit(node.type_node)
-        s = '  node{} -> node{}\n'.format(node._num, node.type_node._num)
-        self.dot_body.append(s)
+    def enter_ProcedureDecl(self, node):
+        self.add_node(node, 'ProcDecl:{}'.format(node.proc_name))
 
-    def visit_ProcedureDecl(self, node):
-        s = '  node{} [label="ProcDecl:{}"]\n'.format(
-            self.ncount,
-            node.proc_name
-        )
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+    def enter_Param(self, node):
+        self.add_node(node, 'Param')
 
-        for param_node in node.params:
-            self.visit(param_node)
-            s = '  node{} -> node{}\n'.format(node._num, param_node._num)
-            self.dot_body.append(s)
+    def enter_Type(self, node):
+        self.add_node(node, node.token.value)
 
-        self.visit(node.block_node)
-        s = '  node{} -> node{}\n'.format(node._num, node.block_node._num)
-        self.dot_body.append(s)
+    def enter_Num(self, node):
+        self.add_node(node, node.token.value)
 
-    def visit_Param(self, node):
-        s = '  node{} [label="Param"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+    def enter_BinOp(self, node):
+        self.add_node(node, node.op.value)
 
-        self.visit(node.var_node)
-        s = '  node{} -> node{}\n'.format(node._num, node.var_node._num)
-        self.dot_body.append(s)
+    def enter_UnaryOp(self, node):
+        self.add_node(node, 'unary {}'.format(node.op.value))
 
-        self.visit(node.type_node)
-        s = '  node{} -> node{}\n'.format(node._num, node.type_node._num)
-        self.dot_body.append(s)
+    def enter_Compound(self, node):
+        self.add_node(node, 'Compound')
 
+    def enter_Assign(self, node):
+        self.add_node(node, node.op.value)
 
-    def visit_Type(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.token.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+    def enter_Var(self, node):
+        self.add_node(node, node.value)
 
-    def visit_Num(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.token.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+    def enter_NoOp(self, node):
+        self.add_node(node, 'NoOp')
 
-    def visit_BinOp(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.op.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        self.visit(node.left)
-        self.visit(node.right)
-
-        for child_node in (node.left, node.right):
-            s = '  node{} -> node{}\n'.format(node._num, child_node._num)
-            self.dot_body.append(s)
-
-    def visit_UnaryOp(self, node):
-        s = '  node{} [label="unary {}"]\n'.format(self.ncount, node.op.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        self.visit(node.expr)
-        s = '  node{} -> node{}\n'.format(node._num, node.expr._num)
-        self.dot_body.append(s)
-
-    def visit_Compound(self, node):
-        s = '  node{} [label="Compound"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        for child in node.children:
-            self.visit(child)
-            s = '  node{} -> node{}\n'.format(node._num, child._num)
-            self.dot_body.append(s)
-
-    def visit_Assign(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.op.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-        self.visit(node.left)
-        self.visit(node.right)
-
-        for child_node in (node.left, node.right):
-            s = '  node{} -> node{}\n'.format(node._num, child_node._num)
-            self.dot_body.append(s)
-
-    def visit_Var(self, node):
-        s = '  node{} [label="{}"]\n'.format(self.ncount, node.value)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
-
-    def visit_NoOp(self, node):
-        s = '  node{} [label="NoOp"]\n'.format(self.ncount)
-        self.dot_body.append(s)
-        node._num = self.ncount
-        self.ncount += 1
+    leave_Program = leave_Block = leave_VarDecl = leave_ProcedureDecl = \
+        leave_Param = leave_Type = leave_Num = leave_BinOp = leave_UnaryOp = \
+        leave_Compound = leave_Assign = leave_Var = leave_NoOp = add_edges
 
     def gendot(self):
         tree = self.parser.parse()
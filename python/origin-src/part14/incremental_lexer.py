@@ -0,0 +1,73 @@
+###############################################################################
+#  Incremental re-lexing after small edits.                                   #
+#                                                                             #
+#  The lexer carries no state from one token to the next: the token found at  #
+#  a token start depends only on the text from there on. So after an edit,    #
+#  once re-lexing reaches a token that starts where an old token started in   #
+#  the unchanged tail of the text, all remaining tokens are the old ones,     #
+#  shifted by the change in length.                                           #
+#                                                                             #
+###############################################################################
+import bisect
+
+from spi import Lexer, TokenArray, TOKEN_CODES, EOF
+
+
+def relex(text, tokens, offset, deleted, inserted):
+    """Apply an edit to text and update its TokenArray.
+
+    `tokens` is the TokenArray of text (as returned by tokenize_all()).
+    The edit replaces the `deleted` characters at `offset` with the
+    string `inserted`. Only the tokens around the edit are re-lexed.
+
+    Return (new_text, new_tokens, (first, old_stop, new_stop)): old
+    tokens [first:old_stop] were replaced by new tokens
+    [first:new_stop], and all others are unchanged apart from the
+    shifted offsets of the tokens after them.
+    """
+    new_text = text[:offset] + inserted + text[offset + deleted:]
+    delta = len(inserted) - deleted
+    old_starts = tokens.starts
+
+    # Restart at the last token that starts before the edit: the edit
+    # may extend it (an identifier gaining characters, ':' becoming ':=')
+    first = bisect.bisect_left(old_starts, offset) - 1
+    if first < 0:
+        first = 0
+        restart = 0
+    else:
+        restart = old_starts[first]
+
+    lexer = Lexer(new_text, use_regex=True)
+    lexer.pos = restart
+    edit_end = offset + len(inserted)
+    codes = TOKEN_CODES
+    changed = TokenArray()
+    old_stop = first
+    old_count = len(tokens)
+    while True:
+        token = lexer.get_next_token()
+        start = lexer.token_start
+        if start >= edit_end:
+            old_start = start - delta
+            while old_stop < old_count and old_starts[old_stop] < old_start:
+                old_stop += 1
+            if old_stop < old_count and old_starts[old_stop] == old_start:
+                break  # re-synchronised with the old token stream
+        changed.types.append(codes[token.type])
+        changed.values.append(token.value)
+        changed.starts.append(start)
+        changed.ends.append(lexer.token_end)
+        if token.type == EOF:
+            old_stop = old_count
+            break
+
+    new_tokens = TokenArray(
+        tokens.types[:first] + changed.types + tokens.types[old_stop:],
+        tokens.values[:first] + changed.values + tokens.values[old_stop:],
+        old_starts[:first] + changed.starts
+        + [start + delta for start in old_starts[old_stop:]],
+        tokens.ends[:first] + changed.ends
+        + [end + delta for end in tokens.ends[old_stop:]],
+    )
+    return new_text, new_tokens, (first, old_stop, first + len(changed))
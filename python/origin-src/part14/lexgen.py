@@ -0,0 +1,435 @@
+###############################################################################
+#  Lexer generator - builds DFA scanner tables from a declarative table of   #
+#  (token name, pattern) pairs.                                               #
+#                                                                             #
+#  Patterns use a small regular expression language:                          #
+#                                                                             #
+#      abc       literal characters       a|b       alternation               #
+#      [abc]     one of the characters    (...)     grouping                  #
+#      [^abc]    none of the characters   * + ?     repetition                #
+#      \d \a \w \s   a char with isdigit(), isalpha(), isalnum(), isspace()   #
+#      \x        the literal character x, for any other x                     #
+#                                                                             #
+#  The scanner finds the longest match at the current position; when two     #
+#  patterns match the same length, the one listed first wins.                 #
+#                                                                             #
+###############################################################################
+import re
+
+
+class LexgenError(Exception):
+    pass
+
+
+###############################################################################
+#                                                                             #
+#  CHARACTER CLASSES                                                          #
+#                                                                             #
+###############################################################################
+
+# Non-ASCII characters can only be matched through the named classes and
+# negated sets, so they are told apart by category alone.
+SPACE, ALPHA, DIGIT, NUMERIC, OTHER = range(5)
+CATEGORIES = (SPACE, ALPHA, DIGIT, NUMERIC, OTHER)
+
+
+def category(char):
+    if char.isspace():
+        return SPACE
+    if char.isalpha():
+        return ALPHA
+    if char.isdigit():
+        return DIGIT
+    if char.isalnum():
+        return NUMERIC
+    return OTHER
+
+
+ASCII = frozenset(chr(code) for code in range(128))
+
+# escape: (ASCII members, non-ASCII categories)
+NAMED_CLASSES = {
+    'd': (frozenset(c for c in ASCII if c.isdigit()), frozenset([DIGIT])),
+    'a': (frozenset(c for c in ASCII if c.isalpha()), frozenset([ALPHA])),
+    'w': (frozenset(c for c in ASCII if c.isalnum()),
+          frozenset([ALPHA, DIGIT, NUMERIC])),
+    's': (frozenset(c for c in ASCII if c.isspace()), frozenset([SPACE])),
+}
+
+
+class CharSet(object):
+    """A set of characters: some ASCII characters plus whole categories
+    of non-ASCII characters."""
+    def __init__(self, chars, categories=frozenset()):
+        self.chars = frozenset(chars)
+        self.categories = frozenset(categories)
+
+    def negated(self):
+        return CharSet(ASCII - self.chars, frozenset(CATEGORIES) - self.categories)
+
+    def union(self, other):
+        return CharSet(self.chars | other.chars, self.categories | other.categories)
+
+
+###############################################################################
+#                                                                             #
+#  PATTERN PARSER                                                             #
+#                                                                             #
+###############################################################################
+
+class PatternParser(object):
+    """Parses a pattern into a tree of tuples:
+
+        ('set', CharSet) | ('cat', [nodes]) | ('alt', [nodes])
+        | ('star', node) | ('plus', node) | ('opt', node)
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.pos = 0
+
+    def error(self, message):
+        raise LexgenError('%s at position %d in pattern %r' % (
+            message, self.pos, self.pattern))
+
+    def peek(self):
+        if self.pos < len(self.pattern):
+            return self.pattern[self.pos]
+        return None
+
+    def next_char(self):
+        char = self.peek()
+        if char is None:
+            self.error('Unexpected end of pattern')
+        self.pos += 1
+        return char
+
+    def parse(self):
+        node = self.alternation()
+        if self.peek() is not None:
+            self.error('Unexpected %r' % self.peek())
+        return node
+
+    def alternation(self):
+        """alternation : concatenation (| concatenation)*"""
+        nodes = [self.concatenation()]
+        while self.peek() == '|':
+            self.pos += 1
+            nodes.append(self.concatenation())
+        return nodes[0] if len(nodes) == 1 else ('alt', nodes)
+
+    def concatenation(self):
+        """concatenation : repetition*"""
+        nodes = []
+        while self.peek() is not None and self.peek() not in '|)':
+            nodes.append(self.repetition())
+        return ('cat', nodes)
+
+    def repetition(self):
+        """repetition : atom (* | + | ?)*"""
+        node = self.atom()
+        while self.peek() is not None and self.peek() in '*+?':
+            node = ({'*': 'star', '+': 'plus', '?': 'opt'}[self.next_char()], node)
+        return node
+
+    def atom(self):
+        """atom : ( alternation ) | [ set ] | escape | char"""
+        char = self.next_char()
+        if char == '(':
+            node = self.alternation()
+            if self.next_char() != ')':
+                self.error('Expected )')
+            return node
+        if char == '[':
+            return ('set', self.char_set())
+        if char == '\\':
+            return ('set', self.escape())
+        if char in '*+?|)':
+            self.error('Unexpected %r' % char)
+        return ('set', self.literal(char))
+
+    def char_set(self):
+        negate = self.peek() == '^'
+        if negate:
+            self.pos += 1
+        chars = CharSet(())
+        while True:
+            char = self.next_char()
+            if char == ']':
+                break
+            if char == '\\':
+                chars = chars.union(self.escape())
+            else:
+                chars = chars.union(self.literal(char))
+        return chars.negated() if negate else chars
+
+    def escape(self):
+        char = self.next_char()
+        if char in NAMED_CLASSES:
+            return CharSet(*NAMED_CLASSES[char])
+        return self.literal(char)
+
+    def literal(self, char):
+        if char not in ASCII:
+            self.error('Non-ASCII literal %r' % char)
+        return CharSet((char,))
+
+
+###############################################################################
+#                                                                             #
+#  PATTERN TRANSLATION                                                        #
+#                                                                             #
+###############################################################################
+
+# The named classes in Python re syntax. \d stands for the Unicode decimal
+# digits, a subset of the characters with isdigit(); \a and \w exclude
+# the digits and '_' that re's \w includes.
+REGEX_CLASSES = {'d': r'\d', 'a': r'[^\W\d_]', 'w': r'[^\W_]', 's': r'\s'}
+# the same inside a character set, where only some can be written
+REGEX_SET_CLASSES = {'d': r'\d', 's': r'\s'}
+
+
+def regex(pattern):
+    """Return the Python regular expression for a pattern.
+
+    Groups become non-capturing groups. Note that alternation in re
+    takes the first alternative that matches rather than the longest.
+    """
+    PatternParser(pattern).parse()
+    parts = []
+    chars = iter(pattern)
+    in_set = False
+    for char in chars:
+        if char == '\\':
+            char = next(chars)
+            classes = REGEX_SET_CLASSES if in_set else REGEX_CLASSES
+            if char in classes:
+                parts.append(classes[char])
+            elif char in NAMED_CLASSES:
+                raise LexgenError(
+                    'Cannot translate \\%s in a set in pattern %r' % (char, pattern))
+            else:
+                parts.append(re.escape(char))
+        elif in_set:
+            if char == ']':
+                in_set = False
+                parts.append(char)
+            elif char == '^' and parts[-1] == '[':
+                parts.append(char)
+            else:
+                parts.append(re.escape(char))
+        elif char == '[':
+            in_set = True
+            parts.append(char)
+        elif char == '(':
+            parts.append('(?:')
+        elif char in ')|*+?':
+            parts.append(char)
+        else:
+            parts.append(re.escape(char))
+    return ''.join(parts)
+
+
+def literal(pattern):
+    """Return the one string a pattern matches, or None if it matches
+    several (or none)."""
+    node = PatternParser(pattern).parse()
+    if node[0] != 'cat':
+        return None
+    chars = []
+    for child in node[1]:
+        if child[0] != 'set' or child[1].categories or len(child[1].chars) != 1:
+            return None
+        chars.extend(child[1].chars)
+    return ''.join(chars) or None
+
+
+###############################################################################
+#                                                                             #
+#  NFA AND DFA CONSTRUCTION                                                   #
+#                                                                             #
+###############################################################################
+
+class NFA(object):
+    """Thompson NFA. Edges are (CharSet or None for epsilon, target)."""
+    def __init__(self):
+        self.edges = []
+
+    def new_state(self):
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def build(self, node):
+        """Add the fragment for a pattern tree; return (start, end)."""
+        kind = node[0]
+        if kind == 'set':
+            start, end = self.new_state(), self.new_state()
+            self.edges[start].append((node[1], end))
+            return start, end
+        if kind == 'cat':
+            start = end = self.new_state()
+            for child in node[1]:
+                child_start, child_end = self.build(child)
+                self.edges[end].append((None, child_start))
+                end = child_end
+            return start, end
+        if kind == 'alt':
+            start, end = self.new_state(), self.new_state()
+            for child in node[1]:
+                child_start, child_end = self.build(child)
+                self.edges[start].append((None, child_start))
+                self.edges[child_end].append((None, end))
+            return start, end
+        # star, plus, opt
+        start, end = self.new_state(), self.new_state()
+        child_start, child_end = self.build(node[1])
+        self.edges[start].append((None, child_start))
+        self.edges[child_end].append((None, end))
+        if kind != 'plus':
+            self.edges[start].append((None, end))
+        if kind != 'opt':
+            self.edges[child_end].append((None, child_start))
+        return start, end
+
+    def closure(self, states):
+        stack = list(states)
+        result = set(states)
+        while stack:
+            for label, target in self.edges[stack.pop()]:
+                if label is None and target not in result:
+                    result.add(target)
+                    stack.append(target)
+        return frozenset(result)
+
+
+class ScannerTables(object):
+    """DFA tables generated from a token table.
+
+    char_classes  maps each ASCII character to its symbol class
+    category_classes  maps each non-ASCII CATEGORY to its symbol class
+    transitions   transitions[state][symbol class] -> state, or -1
+    accepts       accepts[state] -> token name, or None
+    first         first[symbol class] -> the token name when the first
+                  character alone forms a complete token that cannot
+                  be extended (dispatch on the first character), or None
+
+    State 0 is the start state.
+    """
+    def __init__(self, char_classes, category_classes, transitions, accepts, first):
+        self.char_classes = char_classes
+        self.category_classes = category_classes
+        self.transitions = transitions
+        self.accepts = accepts
+        self.first = first
+
+    def char_class(self, char):
+        """Return the symbol class of any character."""
+        char_class = self.char_classes.get(char)
+        if char_class is None:
+            char_class = self.category_classes[category(char)]
+        return char_class
+
+    def match(self, text, pos):
+        """Return (token name, end) of the longest match at pos.
+
+        The token name is None if nothing matches.
+        """
+        transitions = self.transitions
+        accepts = self.accepts
+        state = 0
+        name, end = None, pos
+        while pos < len(text):
+            state = transitions[state][self.char_class(text[pos])]
+            if state < 0:
+                break
+            pos += 1
+            if accepts[state] is not None:
+                name, end = accepts[state], pos
+        return name, end
+
+
+def generate(token_table):
+    """Build ScannerTables for a sequence of (token name, pattern)."""
+    trees = [PatternParser(pattern).parse() for _, pattern in token_table]
+
+    # Split the alphabet into symbol classes: characters that every
+    # CharSet in the patterns either contains or excludes together.
+    sets = []
+
+    def collect(node):
+        if node[0] == 'set':
+            sets.append(node[1])
+        elif node[0] in ('cat', 'alt'):
+            for child in node[1]:
+                collect(child)
+        else:
+            collect(node[1])
+
+    for tree in trees:
+        collect(tree)
+
+    signatures = {}
+    char_classes = {}
+    for char in sorted(ASCII):
+        signature = tuple(char in charset.chars for charset in sets)
+        char_classes[char] = signatures.setdefault(signature, len(signatures))
+    category_classes = {}
+    for cat in CATEGORIES:
+        signature = tuple(cat in charset.categories for charset in sets)
+        category_classes[cat] = signatures.setdefault(signature, len(signatures))
+    nclasses = len(signatures)
+
+    # symbol classes of each CharSet
+    members = {}
+    for charset in sets:
+        members[id(charset)] = frozenset(
+            [char_classes[char] for char in charset.chars] +
+            [category_classes[cat] for cat in charset.categories]
+        )
+
+    # one NFA for all patterns, with a shared start state
+    nfa = NFA()
+    nfa_start = nfa.new_state()
+    finals = {}
+    for index, tree in enumerate(trees):
+        start, end = nfa.build(tree)
+        nfa.edges[nfa_start].append((None, start))
+        finals[end] = index
+
+    # subset construction
+    start = nfa.closure([nfa_start])
+    dfa_states = {start: 0}
+    worklist = [start]
+    transitions = []
+    accepts = []
+    while worklist:
+        states = worklist.pop(0)
+        row = [-1] * nclasses
+        for symbol in range(nclasses):
+            targets = set()
+            for state in states:
+                for label, target in nfa.edges[state]:
+                    if label is not None and symbol in members[id(label)]:
+                        targets.add(target)
+            if not targets:
+                continue
+            targets = nfa.closure(targets)
+            if targets not in dfa_states:
+                dfa_states[targets] = len(dfa_states)
+                worklist.append(targets)
+            row[symbol] = dfa_states[targets]
+        transitions.append(row)
+        matched = [finals[state] for state in states if state in finals]
+        accepts.append(token_table[min(matched)][0] if matched else None)
+
+    first = []
+    for symbol in range(nclasses):
+        state = transitions[0][symbol]
+        if state >= 0 and accepts[state] is not None and max(transitions[state]) < 0:
+            first.append(accepts[state])
+        else:
+            first.append(None)
+
+    return ScannerTables(
+        char_classes, category_classes,
+        [tuple(row) for row in transitions], accepts, first,
+    )
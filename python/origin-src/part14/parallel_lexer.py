@@ -0,0 +1,127 @@
+###############################################################################
+#  Parallel lexing of huge sources.                                           #
+#                                                                             #
+#  The source is cut into chunks at whitespace that lies outside every        #
+#  comment: no token can contain whitespace, so each chunk lexes to exactly   #
+#  the tokens the whole source has in that range. Chunks are lexed in a       #
+#  process pool and the resulting TokenArrays are stitched together.          #
+#                                                                             #
+###############################################################################
+import bisect
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from spi import Lexer, TokenArray
+
+
+# A complete comment, or an opener whose comment is never closed
+_COMMENT_RE = re.compile(
+    r'\{[^}]*\}|\(\*[^*]*\*+(?:[^*)][^*]*\*+)*\)|(?P<unterminated>\{|\(\*)'
+)
+_WHITESPACE_RE = re.compile(r'\s')
+
+
+def comment_spans(text):
+    """Return the (starts, ends) offsets of all comments in text.
+
+    Return None if a comment is never closed.
+    """
+    starts = []
+    ends = []
+    for match in _COMMENT_RE.finditer(text):
+        if match.lastgroup == 'unterminated':
+            return None
+        start, end = match.span()
+        starts.append(start)
+        ends.append(end)
+    return starts, ends
+
+
+def split_points(text, parts):
+    """Return the offsets at which text can be cut into `parts` chunks.
+
+    Each offset is a whitespace character outside every comment, so it
+    cannot lie inside a token. Fewer offsets are returned when there
+    are not enough safe positions, and none at all when text has an
+    unterminated comment.
+    """
+    spans = comment_spans(text)
+    if spans is None:
+        return []
+    starts, ends = spans
+    points = []
+    for part in range(1, parts):
+        pos = max(len(text) * part // parts, points[-1] + 1 if points else 0)
+        while True:
+            match = _WHITESPACE_RE.search(text, pos)
+            if match is None:
+                return points
+            pos = match.start()
+            # the last comment starting at or before pos
+            index = bisect.bisect_right(starts, pos) - 1
+            if index >= 0 and pos < ends[index]:
+                pos = ends[index]
+                continue
+            break
+        points.append(pos)
+    return points
+
+
+def tokenize_chunk(args):
+    """Lex one chunk and shift its token offsets by the chunk offset.
+
+    Runs in a worker process. The trailing EOF token is dropped from
+    every chunk but the last one.
+    """
+    chunk, offset, last = args
+    tokens = Lexer(chunk).tokenize_all()
+    if not last:
+        del tokens.types[-1]
+        del tokens.values[-1]
+        del tokens.starts[-1]
+        del tokens.ends[-1]
+    if offset:
+        tokens.starts = [start + offset for start in tokens.starts]
+        tokens.ends = [end + offset for end in tokens.ends]
+    return tokens.types, tokens.values, tokens.starts, tokens.ends
+
+
+def parallel_tokenize(text, workers=None, min_chunk_size=1 << 20):
+    """Lex text in a pool of `workers` processes and return a TokenArray.
+
+    The result is the same as Lexer(text).tokenize_all() and can be fed
+    to Parser through a TokenCursor. Sources shorter than
+    min_chunk_size per worker are lexed with fewer processes, down to
+    lexing in the calling process. A lexing error in any chunk is
+    re-raised by lexing the whole text, so that it reports the same
+    position as the sequential lexer.
+
+    Identifier values come back from the workers as equal but separate
+    string objects; they are not interned in the calling process.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    parts = max(1, min(workers, len(text) // max(1, min_chunk_size)))
+    points = split_points(text, parts) if parts > 1 else []
+    if not points:
+        return Lexer(text).tokenize_all()
+
+    bounds = [0] + points + [len(text)]
+    chunks = [
+        (text[start:end], start, end == len(text))
+        for start, end in zip(bounds, bounds[1:])
+    ]
+    try:
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            results = list(executor.map(tokenize_chunk, chunks))
+    except Exception:
+        return Lexer(text).tokenize_all()
+
+    tokens = TokenArray()
+    for types, values, starts, ends in results:
+        tokens.types.extend(types)
+        tokens.values.extend(values)
+        tokens.starts.extend(starts)
+        tokens.ends.extend(ends)
+    return tokens
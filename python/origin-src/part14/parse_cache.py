@@ -0,0 +1,129 @@
+###############################################################################
+#  On-disk parse cache.                                                       #
+#                                                                             #
+#  Parsed programs are stored in a cache directory under a key made of the    #
+#  SHA-256 of the source and spi.PARSER_VERSION, so a hit skips lexing and    #
+#  parsing altogether. The directory is kept under a size bound by evicting   #
+#  the least recently used entries.                                           #
+#                                                                             #
+#  Entries are stored in the binary AST format of ast_format, which builds    #
+#  nothing but AST nodes on loading, rather than pickled: a pickle in a       #
+#  shared or planted cache directory could run arbitrary code. The directory  #
+#  is created private to the current user, and entries owned by someone else  #
+#  are ignored.                                                               #
+#                                                                             #
+###############################################################################
+import hashlib
+import io
+import os
+import tempfile
+
+from ast_format import ASTFormatError, dump, load
+from spi import Parser, StreamLexer, PARSER_VERSION
+
+
+class ParseCache(object):
+    SUFFIX = '.ast'
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        # upper bound on the total size of the cache entries, in bytes
+        self.max_size = max_size
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def _digest():
+        return hashlib.sha256(('spi-%d\n' % PARSER_VERSION).encode('ascii'))
+
+    @classmethod
+    def file_key(cls, path, chunk_size=1 << 16):
+        """Return the cache key of the source file at path."""
+        digest = cls._digest()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def source_key(cls, data):
+        """Return the cache key of a source, given as bytes."""
+        digest = cls._digest()
+        digest.update(data)
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        """Return the cached tree for key, or None on a miss."""
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                if not self.trusted(f):
+                    return None
+                tree = load(f)
+        except (OSError, ASTFormatError):
+            # missing, damaged, or written by another version
+            return None
+        # entries are ordered for eviction by their modification time
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return tree
+
+    @staticmethod
+    def trusted(f):
+        """Return whether the open entry file f was written by the
+        current user."""
+        if not hasattr(os, 'getuid'):
+            # no file ownership to go by (Windows)
+            return True
+        return os.fstat(f.fileno()).st_uid == os.getuid()
+
+    def put(self, key, tree):
+        """Store tree under key and evict entries over the size bound."""
+        # mkstemp() creates the file readable by the current user only
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                dump(tree, f)
+            os.replace(tmp_path, self.entry_path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until within max_size."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+                total += stat.st_size
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def parse_file(self, path):
+        """Return the AST of the source file at path, parsing on a miss."""
+        # The file is read once: the tree is parsed from the very bytes
+        # that were hashed, even if the file changes in the meantime.
+        with open(path, 'rb') as f:
+            data = f.read()
+        key = self.source_key(data)
+        tree = self.get(key)
+        if tree is None:
+            # decoded as open(path, 'r') would
+            source = io.TextIOWrapper(io.BytesIO(data))
+            tree = Parser(StreamLexer(source)).parse()
+            self.put(key, tree)
+        return tree
@@ -1,6 +1,16 @@
 """ SPI - Simple Pascal Interpreter. Part 14."""
 
-from collections import OrderedDict
+import bisect
+import codecs
+import re
+import sys
+from array import array
+from collections import OrderedDict, namedtuple
+from itertools import product
+from operator import add, attrgetter, floordiv, mul, sub
+from types import MappingProxyType
+
+import lexgen
 
 ###############################################################################
 #                                                                             #
@@ -38,9 +48,19 @@ EOF           = 'EOF'
 
 
 class Token(object):
+    """A token; immutable, since the lexer shares one instance of each
+    fixed lexeme (see FIXED_TOKENS) between all its uses."""
+    __slots__ = ('type', 'value')
+
     def __init__(self, type, value):
-        self.type = type
-        self.value = value
+        _set_token_type(self, type)
+        _set_token_value(self, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Token is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Token is immutable')
 
     def __str__(self):
         """String representation of the class instance.
@@ -58,6 +78,15 @@ class Token(object):
     def __repr__(self):
         return self.__str__()
 
+    def __reduce__(self):
+        # pickle as a plain constructor call rather than slot state
+        return Token, (self.type, self.value)
+
+
+# the slot setters, for Token.__init__ only
+_set_token_type = Token.type.__set__
+_set_token_value = Token.value.__set__
+
 
 RESERVED_KEYWORDS = {
     'PROGRAM': Token('PROGRAM', 'PROGRAM'),
@@ -70,17 +99,167 @@ RESERVED_KEYWORDS = {
     'PROCEDURE': Token('PROCEDURE', 'PROCEDURE'),
 }
 
+# Every upper/lower case spelling of every reserved keyword, mapped to
+# its token (under a thousand entries). Identifiers are looked up as
+# they appear in the source instead of allocating an uppercase copy
+# of each one first.
+KEYWORD_SPELLINGS = dict(
+    (spelling, token)
+    for keyword, token in RESERVED_KEYWORDS.items()
+    for spelling in map(''.join, product(*zip(keyword.lower(), keyword.upper())))
+)
+
+# Declarative token table: the one definition of the lexemes, in the
+# pattern language of lexgen. The DFA engine is generated from it, the
+# regex engine's master pattern is translated from it and the fixed
+# lexemes are taken from it. SKIP lexemes are dropped, and an
+# UNTERMINATED_COMMENT match is only ever the longest one when the
+# comment is never closed. The regex engine takes the first token
+# pattern that matches, so longer lexemes come first.
+TOKEN_TABLE = (
+    ('SKIP',                 r'\s+'),
+    ('SKIP',                 r'\{[^}]*\}'),
+    ('SKIP',                 r'\(\*([^*]|\*+[^*)])*\*+\)'),
+    ('UNTERMINATED_COMMENT', r'\{[^}]*'),
+    ('UNTERMINATED_COMMENT', r'\(\*([^*]|\*+[^*)])*\**'),
+    (REAL_CONST,             r'\d+\.\d*'),
+    (INTEGER_CONST,          r'\d+'),
+    (ID,                     r'\a\w*'),
+    (ASSIGN,                 r':='),
+    (SEMI,                   r';'),
+    (COLON,                  r':'),
+    (COMMA,                  r','),
+    (PLUS,                   r'\+'),
+    (MINUS,                  r'-'),
+    (MUL,                    r'\*'),
+    (FLOAT_DIV,              r'/'),
+    (LPAREN,                 r'\('),
+    (RPAREN,                 r'\)'),
+    (DOT,                    r'\.'),
+)
+_SKIP_KINDS = ('SKIP', 'UNTERMINATED_COMMENT')
+
+# Preallocated tokens for every fixed lexeme of TOKEN_TABLE. Tokens are
+# never modified once created, so the lexer hands out these shared
+# instances and only allocates new tokens for identifiers and number
+# literals.
+FIXED_TOKENS = MappingProxyType(dict(
+    (lexeme, Token(kind, lexeme))
+    for kind, lexeme in (
+        (kind, lexgen.literal(pattern)) for kind, pattern in TOKEN_TABLE
+        if kind not in _SKIP_KINDS
+    )
+    if lexeme is not None
+))
+
+# The fixed lexemes longer than one character, by their first character
+# and longest first, for the engines that scan character by character
+LONG_LEXEMES = {}
+for _lexeme in sorted(FIXED_TOKENS, key=len, reverse=True):
+    if len(_lexeme) > 1:
+        LONG_LEXEMES.setdefault(_lexeme[0], []).append(_lexeme)
+del _lexeme
+EOF_TOKEN = Token(EOF, None)
+
+# Small integer codes for token types, used by the compact TokenArray
+TOKEN_TYPES = (
+    INTEGER, REAL, INTEGER_CONST, REAL_CONST, PLUS, MINUS, MUL,
+    INTEGER_DIV, FLOAT_DIV, LPAREN, RPAREN, ID, ASSIGN, BEGIN, END,
+    SEMI, DOT, PROGRAM, VAR, COLON, COMMA, PROCEDURE, EOF,
+)
+TOKEN_CODES = dict((type, code) for code, type in enumerate(TOKEN_TYPES))
+
+# The shared Token instance for each code, or None for the token types
+# (identifiers and literals) that carry their own values
+SHARED_TOKENS = [None] * len(TOKEN_TYPES)
+for _token in (
+    list(FIXED_TOKENS.values()) + list(RESERVED_KEYWORDS.values()) + [EOF_TOKEN]
+):
+    SHARED_TOKENS[TOKEN_CODES[_token.type]] = _token
+del _token
+
+
+def _skip_pattern(pattern):
+    # A repeated lexeme (such as a whitespace run) is skipped one
+    # repetition of the skip group at a time: with \s+ a failed match
+    # would backtrack through every way of splitting the run.
+    node = lexgen.PatternParser(pattern).parse()
+    if node[0] == 'cat' and len(node[1]) == 1 and node[1][0][0] == 'plus':
+        pattern = pattern[:-1]
+    return lexgen.regex(pattern)
+
+
+# Master pattern used by the regex scanning engine, translated from
+# TOKEN_TABLE. SKIP lexemes are folded into the leading skip group, so
+# every successful match yields exactly one token (or EOF at end of
+# input). A token cannot start where an UNTERMINATED_COMMENT does, so an
+# unterminated comment makes the whole match fail.
+_SKIP_PATTERN = '(?:%s)*' % '|'.join(
+    _skip_pattern(pattern) for kind, pattern in TOKEN_TABLE if kind == 'SKIP'
+)
+_SKIP_RE = re.compile(_SKIP_PATTERN)
+_MASTER_RE = re.compile(
+    _SKIP_PATTERN + '(?!%s)(?:%s|(?P<%s>\\Z))' % (
+        '|'.join(
+            lexgen.regex(pattern) for kind, pattern in TOKEN_TABLE
+            if kind == 'UNTERMINATED_COMMENT'
+        ),
+        '|'.join(
+            '(?P<%s>%s)' % (kind, lexgen.regex(pattern))
+            for kind, pattern in TOKEN_TABLE if kind not in _SKIP_KINDS
+        ),
+        EOF,
+    )
+)
+_scanner_tables = None
+
+
+def scanner_tables():
+    """Return the DFA tables for TOKEN_TABLE, generating them once."""
+    global _scanner_tables
+    if _scanner_tables is None:
+        _scanner_tables = lexgen.generate(TOKEN_TABLE)
+    return _scanner_tables
+
 
 class Lexer(object):
-    def __init__(self, text):
+    def __init__(self, text, use_regex=False, use_dfa=False):
         # client string input, e.g. "4 + 2 * 3 - 6 / 2"
         self.text = text
         # self.pos is an index into self.text
         self.pos = 0
-        self.current_char = self.text[self.pos]
+        # index of the first character of the last token returned
+        self.token_start = 0
+        if use_regex:
+            # one compiled master pattern instead of the char-by-char
+            # scanner; produces exactly the same Token stream
+            # (self.pos is kept in sync, self.current_char is not)
+            self.current_char = self.text[self.pos] if self.text else None
+            self.get_next_token = self._regex_tokens().__next__
+        elif use_dfa:
+            # DFA generated by lexgen from TOKEN_TABLE; same Token stream
+            # (self.pos is kept in sync, self.current_char is not)
+            self.current_char = self.text[self.pos] if self.text else None
+            self.get_next_token = self._dfa_tokens().__next__
+        else:
+            self.current_char = self.text[self.pos]
+
+    @property
+    def token_end(self):
+        """The offset just past the last token returned."""
+        # every engine leaves pos right after the token it returns
+        return self.pos
 
-    def error(self):
-        raise Exception('Invalid character')
+    def error(self, message='Invalid character'):
+        raise Exception('%s at position %d' % (message, self.pos))
+
+    def match_error(self, text, pos):
+        """Report the input at `pos` that _MASTER_RE failed to match."""
+        pos = self.pos = _SKIP_RE.match(text, pos).end()
+        self.current_char = text[pos]
+        if text.startswith('{', pos) or text.startswith('(*', pos):
+            self.error('Unterminated comment')
+        self.error()
 
     def advance(self):
         """Advance the `pos` pointer and set the `current_char` variable."""
@@ -90,6 +269,14 @@ class Lexer(object):
         else:
             self.current_char = self.text[self.pos]
 
+    def advance_to(self, pos):
+        """Move the `pos` pointer to `pos` and update `current_char`."""
+        self.pos = pos
+        if pos > len(self.text) - 1:
+            self.current_char = None  # Indicates end of input
+        else:
+            self.current_char = self.text[pos]
+
     def peek(self):
         peek_pos = self.pos + 1
         if peek_pos > len(self.text) - 1:
@@ -101,43 +288,51 @@ class Lexer(object):
         while self.current_char is not None and self.current_char.isspace():
             self.advance()
 
-    def skip_comment(self):
-        while self.current_char != '}':
-            self.advance()
-        self.advance()  # the closing curly brace
+    def skip_comment(self, closing='}'):
+        """Skip a {...} or (*...*) comment starting at the current char.
+
+        `closing` is the comment terminator, '}' or '*)'.
+        """
+        # the opening delimiter is as long as the closing one, so this
+        # skips past it: '(*)' is not a complete comment
+        end = self.text.find(closing, self.pos + len(closing))
+        if end == -1:
+            self.error('Unterminated comment')
+        self.advance_to(end + len(closing))
 
     def number(self):
         """Return a (multidigit) integer or float consumed from the input."""
-        result = ''
-        while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
-            self.advance()
-
-        if self.current_char == '.':
-            result += self.current_char
-            self.advance()
-
-            while (
-                self.current_char is not None and
-                self.current_char.isdigit()
-            ):
-                result += self.current_char
-                self.advance()
-
-            token = Token('REAL_CONST', float(result))
+        # find the end of the lexeme first and take a single slice of
+        # the input instead of growing a string one character at a time
+        text = self.text
+        start = end = self.pos
+        length = len(text)
+        while end < length and text[end].isdigit():
+            end += 1
+
+        if end < length and text[end] == '.':
+            end += 1
+            while end < length and text[end].isdigit():
+                end += 1
+
+            token = Token('REAL_CONST', float(text[start:end]))
         else:
-            token = Token('INTEGER_CONST', int(result))
+            token = Token('INTEGER_CONST', int(text[start:end]))
 
+        self.advance_to(end)
         return token
 
     def _id(self):
         """Handle identifiers and reserved keywords"""
-        result = ''
-        while self.current_char is not None and self.current_char.isalnum():
-            result += self.current_char
-            self.advance()
-
-        token = RESERVED_KEYWORDS.get(result.upper(), Token(ID, result))
+        text = self.text
+        start = end = self.pos
+        length = len(text)
+        while end < length and text[end].isalnum():
+            end += 1
+        self.advance_to(end)
+
+        result = text[start:end]
+        token = KEYWORD_SPELLINGS.get(result) or Token(ID, sys.intern(result))
         return token
 
     def get_next_token(self):
@@ -153,64 +348,583 @@ class Lexer(object):
                 continue
 
             if self.current_char == '{':
-                self.advance()
-                self.skip_comment()
+                self.skip_comment('}')
                 continue
 
+            if self.current_char == '(' and self.peek() == '*':
+                self.skip_comment('*)')
+                continue
+
+            self.token_start = self.pos
+
             if self.current_char.isalpha():
                 return self._id()
 
             if self.current_char.isdigit():
                 return self.number()
 
-            if self.current_char == ':' and self.peek() == '=':
-                self.advance()
-                self.advance()
-                return Token(ASSIGN, ':=')
+            lexemes = LONG_LEXEMES.get(self.current_char)
+            if lexemes is not None:
+                for lexeme in lexemes:
+                    if self.text.startswith(lexeme, self.pos):
+                        self.advance_to(self.pos + len(lexeme))
+                        return FIXED_TOKENS[lexeme]
 
-            if self.current_char == ';':
+            token = FIXED_TOKENS.get(self.current_char)
+            if token is not None:
                 self.advance()
-                return Token(SEMI, ';')
+                return token
 
-            if self.current_char == ':':
-                self.advance()
-                return Token(COLON, ':')
+            self.error()
 
-            if self.current_char == ',':
-                self.advance()
-                return Token(COMMA, ',')
+        self.token_start = self.pos
+        return EOF_TOKEN
 
-            if self.current_char == '+':
-                self.advance()
-                return Token(PLUS, '+')
+    def tokenize_all(self):
+        """Lex the rest of the input in one go and return a TokenArray.
 
-            if self.current_char == '-':
-                self.advance()
-                return Token(MINUS, '-')
+        Scans with the master pattern in a single tight loop,
+        regardless of the engine selected for get_next_token.
+        """
+        text = self.text
+        match = _MASTER_RE.match
+        keywords = KEYWORD_SPELLINGS
+        intern = sys.intern
+        codes = TOKEN_CODES
+        id_code = codes[ID]
+        tokens = TokenArray()
+        add_type = tokens.types.append
+        add_value = tokens.values.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        pos = self.pos
+        while True:
+            m = match(text, pos)
+            if m is None:
+                self.match_error(text, pos)
+
+            kind = m.lastgroup
+            add_start(m.start(kind))
+            pos = m.end()
+            add_end(pos)
+            if kind == ID:
+                value = m[ID]
+                keyword = keywords.get(value)
+                if keyword is None:
+                    add_type(id_code)
+                    add_value(intern(value))
+                else:
+                    add_type(codes[keyword.type])
+                    add_value(keyword.value)
+            elif kind == INTEGER_CONST:
+                add_type(codes[kind])
+                add_value(int(m[kind]))
+            elif kind == REAL_CONST:
+                add_type(codes[kind])
+                add_value(float(m[kind]))
+            elif kind == EOF:
+                add_type(codes[kind])
+                add_value(None)
+                break
+            else:
+                add_type(codes[kind])
+                add_value(m[kind])
 
-            if self.current_char == '*':
-                self.advance()
-                return Token(MUL, '*')
+        self.pos = pos
+        self.current_char = None
+        return tokens
 
-            if self.current_char == '/':
-                self.advance()
-                return Token(FLOAT_DIV, '/')
+    def _dfa_tokens(self):
+        """DFA engine counterpart of get_next_token.
 
-            if self.current_char == '(':
-                self.advance()
-                return Token(LPAREN, '(')
+        A generator driven by the scanner_tables() transition table.
+        Tokens whose first character cannot be extended are dispatched
+        on that character without entering the DFA loop.
+        """
+        tables = scanner_tables()
+        char_classes = tables.char_classes
+        char_class_of = tables.char_class
+        transitions = tables.transitions
+        accepts = tables.accepts
+        first = tables.first
+        keywords = KEYWORD_SPELLINGS
+        intern = sys.intern
+        fixed_tokens = FIXED_TOKENS
+        text = self.text
+        length = len(text)
+        pos = self.pos
+        while True:
+            if pos >= length:
+                self.pos = self.token_start = pos
+                self.current_char = None
+                yield EOF_TOKEN
+                continue
 
-            if self.current_char == ')':
-                self.advance()
-                return Token(RPAREN, ')')
+            char = text[pos]
+            char_class = char_classes.get(char)
+            if char_class is None:
+                char_class = char_class_of(char)
+            kind = first[char_class]
+            if kind is not None:
+                end = pos + 1
+            else:
+                # longest match
+                state = transitions[0][char_class]
+                end = pos
+                index = pos
+                while state >= 0:
+                    index += 1
+                    if accepts[state] is not None:
+                        kind = accepts[state]
+                        end = index
+                    if index >= length:
+                        break
+                    char = text[index]
+                    char_class = char_classes.get(char)
+                    if char_class is None:
+                        char_class = char_class_of(char)
+                    state = transitions[state][char_class]
+
+            if kind == 'SKIP':
+                pos = end
+                continue
 
-            if self.current_char == '.':
-                self.advance()
-                return Token(DOT, '.')
+            self.token_start = pos
+            if kind is None or kind == 'UNTERMINATED_COMMENT':
+                self.pos = pos
+                self.current_char = text[pos]
+                if kind is None:
+                    self.error()
+                self.error('Unterminated comment')
+
+            value = text[pos:end]
+            pos = self.pos = end
+            if kind == ID:
+                yield keywords.get(value) or Token(ID, intern(value))
+            elif kind == INTEGER_CONST:
+                yield Token(INTEGER_CONST, int(value))
+            elif kind == REAL_CONST:
+                yield Token(REAL_CONST, float(value))
+            else:
+                yield fixed_tokens[value]
+
+    def _regex_tokens(self):
+        """Regex engine counterpart of get_next_token.
+
+        A generator that skips whitespace and comments and matches each
+        token with a single call into the compiled _MASTER_RE. Once the
+        input is exhausted it keeps yielding EOF tokens, just like
+        get_next_token keeps returning them.
+        """
+        text = self.text
+        match = _MASTER_RE.match
+        keywords = KEYWORD_SPELLINGS
+        intern = sys.intern
+        fixed_tokens = FIXED_TOKENS
+        pos = self.pos
+        while True:
+            m = match(text, pos)
+            if m is None:
+                self.match_error(text, pos)
+
+            kind = m.lastgroup
+            pos = self.pos = m.end()
+            self.token_start = m.start(kind)
+
+            if kind == ID:
+                value = m[ID]
+                yield keywords.get(value) or Token(ID, intern(value))
+            elif kind == INTEGER_CONST:
+                yield Token(INTEGER_CONST, int(m[kind]))
+            elif kind == REAL_CONST:
+                yield Token(REAL_CONST, float(m[kind]))
+            elif kind == EOF:
+                self.current_char = None
+                yield EOF_TOKEN
+            else:
+                yield fixed_tokens[m[kind]]
+
+
+class TokenArray(object):
+    """A whole token stream stored as parallel sequences.
+
+    types[i] is the TOKEN_CODES code of the i-th token, values[i] its
+    value, starts[i] the offset of its first character in the source
+    and ends[i] the offset just past its last one. The last token is
+    always EOF.
+
+    types is a compact array('B'); starts and ends are plain lists,
+    since a parser recording spans reads the offsets of every token,
+    and an array would box a new int object on each of those reads.
+    """
+    __slots__ = ('types', 'values', 'starts', 'ends')
+
+    def __init__(self, types=None, values=None, starts=None, ends=None):
+        self.types = types if types is not None else array('B')
+        self.values = values if values is not None else []
+        self.starts = starts if starts is not None else []
+        self.ends = ends if ends is not None else []
+
+    def __len__(self):
+        return len(self.types)
+
+    def token(self, index):
+        """Return the index-th token as a Token instance."""
+        code = self.types[index]
+        return SHARED_TOKENS[code] or Token(TOKEN_TYPES[code], self.values[index])
+
+
+class TokenCursor(object):
+    """Feeds a Parser from a TokenArray by walking it with an index.
+
+    Implements the get_next_token() interface of Lexer, so it can be
+    passed to Parser in place of a lexer, and allows arbitrary
+    lookahead through peek().
+
+    tokenize_all() lexes faster than get_next_token(), but a parse
+    driven through a TokenCursor is no faster than one driven by the
+    lexer itself: the cursor still builds a Token for every identifier
+    and literal, and costs a call per token. Use it to look ahead or to
+    parse parts of the stream again (see Parser.lazy_procedures).
+
+    With spans=False, for parsers that record no spans, token_start and
+    token_end are not stored for every token but looked up when read
+    (for an error message, say).
+    """
+    def __new__(cls, tokens, spans=True):
+        if cls is TokenCursor and not spans:
+            cls = _PlainTokenCursor
+        return super(TokenCursor, cls).__new__(cls)
+
+    def __init__(self, tokens, spans=True):
+        self.tokens = tokens
+        self.types = tokens.types
+        self.values = tokens.values
+        self.starts = tokens.starts
+        self.ends = tokens.ends
+        self.index = 0
+        # index of the trailing EOF token; reads past it keep seeing EOF
+        # (self.index itself keeps counting)
+        self.last = len(tokens) - 1
+
+    def peek(self, offset=0):
+        """Return the token `offset` positions after the next one."""
+        return self.tokens.token(min(self.index + offset, self.last))
+
+    def peek_type(self, offset=0):
+        """Return only the type of the token peek(offset) would return."""
+        return TOKEN_TYPES[self.tokens.types[min(self.index + offset, self.last)]]
+
+    def get_next_token(self):
+        index = self.index
+        self.index = index + 1
+        if index > self.last:
+            index = self.last
+        # the offsets of the last token returned, like Lexer.token_start;
+        # a parser reads them for most nodes it builds, so they are
+        # plain attributes rather than properties
+        self.token_start = self.starts[index]
+        self.token_end = self.ends[index]
+        # TokenArray.token() inlined, this is the parser's hot path
+        code = self.types[index]
+        return SHARED_TOKENS[code] or Token(TOKEN_TYPES[code], self.values[index])
+
+
+class _PlainTokenCursor(TokenCursor):
+    """A TokenCursor(tokens, spans=False): looks the offsets up instead."""
+    @property
+    def token_start(self):
+        return self.starts[max(0, min(self.index - 1, self.last))]
+
+    @property
+    def token_end(self):
+        return self.ends[max(0, min(self.index - 1, self.last))]
+
+    def get_next_token(self):
+        index = self.index
+        self.index = index + 1
+        if index > self.last:
+            index = self.last
+        code = self.types[index]
+        return SHARED_TOKENS[code] or Token(TOKEN_TYPES[code], self.values[index])
+
+
+def collect_tokens(lexer):
+    """Drain lexer.get_next_token() into a TokenArray.
+
+    Works with every lexer: they all record the offsets of the last
+    token returned in lexer.token_start and lexer.token_end.
+    """
+    codes = TOKEN_CODES
+    tokens = TokenArray()
+    while True:
+        token = lexer.get_next_token()
+        tokens.types.append(codes[token.type])
+        tokens.values.append(token.value)
+        tokens.starts.append(lexer.token_start)
+        tokens.ends.append(lexer.token_end)
+        if token.type == EOF:
+            return tokens
+
+
+class StreamLexer(Lexer):
+    """Lexer that reads its input from a file object or an mmap.
+
+    The source is consumed in fixed-size chunks through its read()
+    method, so the whole program never has to be held in memory:
+    self.text is only a window over the unconsumed tail of the input,
+    starting at character offset self.offset of the stream. Tokens and
+    comments that straddle a chunk boundary are handled by reading
+    more input whenever a match reaches the end of the window.
+
+    Produces the same Token stream as Lexer.
+    """
+    def __init__(self, source, chunk_size=64 * 1024, encoding='utf-8'):
+        # anything with a read(size) method: a text or binary file
+        # object, an mmap.mmap, io.StringIO, ...
+        self.source = source
+        self.chunk_size = chunk_size
+        # used to decode binary sources; multibyte characters split
+        # across chunks are buffered by the incremental decoder
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.exhausted = False
+        self.text = ''
+        self.offset = 0
+        self.pos = 0
+        self.current_char = None
+        # stream offset of the first character of the last token
+        self.token_start = 0
+        self.get_next_token = self._stream_tokens().__next__
+
+    @property
+    def token_end(self):
+        return self.offset + self.pos
+
+    def error(self, message='Invalid character'):
+        raise Exception(
+            '%s at position %d' % (message, self.offset + self.pos)
+        )
+
+    def fill(self):
+        """Append the next chunk of the source to the window.
+
+        The consumed part of the window is dropped first. Return False
+        if the source has no more input.
+        """
+        if self.exhausted:
+            return False
+        data = self.source.read(self.chunk_size)
+        if not data:
+            self.exhausted = True
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data, final=self.exhausted)
+        self.offset += self.pos
+        self.text = self.text[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def tokenize_all(self):
+        """Lex the rest of the stream and return a TokenArray.
+
+        The TokenArray holds the whole token stream anyway, so the rest
+        of the source is read in one go and scanned by the tight loop of
+        Lexer.tokenize_all().
+        """
+        data = self.source.read()
+        if isinstance(data, bytes):
+            data = self.decoder.decode(data, final=True)
+        self.exhausted = True
+        offset = self.offset = self.offset + self.pos
+        self.text = self.text[self.pos:] + data
+        self.pos = 0
+        tokens = Lexer.tokenize_all(self)
+        if offset:
+            tokens.starts = [start + offset for start in tokens.starts]
+            tokens.ends = [end + offset for end in tokens.ends]
+        return tokens
+
+    def _stream_tokens(self):
+        """Chunked counterpart of Lexer._regex_tokens."""
+        match = _MASTER_RE.match
+        keywords = KEYWORD_SPELLINGS
+        intern = sys.intern
+        fixed_tokens = FIXED_TOKENS
+        text = self.text
+        while True:
+            m = match(text, self.pos)
+            # A match that runs into the end of the window might be
+            # longer (or a different token) once more input arrives.
+            if m is None or (m.end() == len(text) and not self.exhausted):
+                if self.fill():
+                    text = self.text
+                    continue
+                self.match_error(text, self.pos)
+
+            kind = m.lastgroup
+            self.pos = m.end()
+            self.token_start = self.offset + m.start(kind)
+
+            if kind == ID:
+                value = m[ID]
+                yield keywords.get(value) or Token(ID, intern(value))
+            elif kind == INTEGER_CONST:
+                yield Token(INTEGER_CONST, int(m[kind]))
+            elif kind == REAL_CONST:
+                yield Token(REAL_CONST, float(m[kind]))
+            elif kind == EOF:
+                yield EOF_TOKEN
+            else:
+                yield fixed_tokens[m[kind]]
+
+
+# Character classes of BytesLexer, indexed by byte value. They are
+# derived from the str methods the Lexer uses, so both lexers agree on
+# ASCII input; non-ASCII bytes are invalid outside comments.
+CC_OTHER, CC_SPACE, CC_ALPHA, CC_DIGIT = range(4)
+CHAR_CLASSES = bytes(
+    CC_SPACE if chr(byte).isspace() else
+    CC_ALPHA if chr(byte).isalpha() else
+    CC_DIGIT if chr(byte).isdigit() else
+    CC_OTHER
+    for byte in range(128)
+) + bytes(128)
+
+# The shared token for each single-byte fixed lexeme, indexed by byte
+BYTE_TOKENS = [None] * 256
+for _lexeme, _token in FIXED_TOKENS.items():
+    if len(_lexeme) == 1:
+        BYTE_TOKENS[ord(_lexeme)] = _token
+del _lexeme, _token
+
+# (lexeme, shared token) of the fixed lexemes in LONG_LEXEMES, as bytes,
+# indexed by their first byte
+BYTE_LONG_LEXEMES = [None] * 256
+for _char, _lexemes in LONG_LEXEMES.items():
+    BYTE_LONG_LEXEMES[ord(_char)] = [
+        (_lexeme.encode('ascii'), FIXED_TOKENS[_lexeme]) for _lexeme in _lexemes
+    ]
+del _char, _lexemes
+
+# memoryview has no find(), so comment ends are searched for with
+# regexes, which work on any buffer
+_BRACE_COMMENT_END_RE = re.compile(rb'\}')
+_PAREN_COMMENT_END_RE = re.compile(rb'\*\)')
+
+
+class BytesLexer(Lexer):
+    """Lexer for ASCII sources held in a bytes-like object.
+
+    Scans a bytes, bytearray, memoryview or mmap directly, classifying
+    each byte through the precomputed CHAR_CLASSES table instead of
+    calling str.isalpha()/isdigit()/isspace(), and decodes only the
+    slices of identifiers and number literals. Produces the same Token
+    stream as Lexer.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.length = len(data)
+        self.pos = 0
+        self.current_char = None
+        # offset of the first byte of the last token
+        self.token_start = 0
+
+    def tokenize_all(self):
+        return collect_tokens(self)
+
+    def get_next_token(self):
+        data = self.data
+        length = self.length
+        classes = CHAR_CLASSES
+        pos = self.pos
+        while pos < length:
+            byte = data[pos]
+            char_class = classes[byte]
+
+            if char_class == CC_SPACE:
+                pos += 1
+                continue
 
+            self.token_start = pos
+
+            if char_class == CC_ALPHA:
+                end = pos + 1
+                # CC_ALPHA and CC_DIGIT: isalnum()
+                while end < length and classes[data[end]] >= CC_ALPHA:
+                    end += 1
+                self.pos = end
+                value = str(data[pos:end], 'ascii')
+                return KEYWORD_SPELLINGS.get(value) or Token(ID, sys.intern(value))
+
+            if char_class == CC_DIGIT:
+                end = pos + 1
+                while end < length and classes[data[end]] == CC_DIGIT:
+                    end += 1
+                if end < length and data[end] == 0x2E:  # '.'
+                    end += 1
+                    while end < length and classes[data[end]] == CC_DIGIT:
+                        end += 1
+                    self.pos = end
+                    return Token(REAL_CONST, float(str(data[pos:end], 'ascii')))
+                self.pos = end
+                return Token(INTEGER_CONST, int(str(data[pos:end], 'ascii')))
+
+            if byte == 0x7B:  # '{'
+                match = _BRACE_COMMENT_END_RE.search(data, pos + 1)
+                if match is None:
+                    self.pos = pos
+                    self.error('Unterminated comment')
+                pos = match.end()
+                continue
+
+            if byte == 0x28 and pos + 1 < length and data[pos + 1] == 0x2A:  # '(*'
+                match = _PAREN_COMMENT_END_RE.search(data, pos + 2)
+                if match is None:
+                    self.pos = pos
+                    self.error('Unterminated comment')
+                pos = match.end()
+                continue
+
+            lexemes = BYTE_LONG_LEXEMES[byte]
+            if lexemes is not None:
+                for lexeme, token in lexemes:
+                    end = pos + len(lexeme)
+                    if data[pos:end] == lexeme:
+                        self.pos = end
+                        return token
+
+            token = BYTE_TOKENS[byte]
+            if token is not None:
+                self.pos = pos + 1
+                return token
+
+            self.pos = pos
             self.error()
 
-        return Token(EOF, None)
+        self.pos = self.token_start = pos
+        return EOF_TOKEN
+
+
+class LineIndex(object):
+    """Maps source offsets, such as token and AST node spans, to lines.
+
+    Built once per source in a single pass over its line breaks, so the
+    lexers and parsers only ever record plain offsets; each lookup is a
+    binary search.
+    """
+    def __init__(self, text):
+        starts = array('q', [0])
+        find = text.find
+        pos = find('\n')
+        while pos >= 0:
+            starts.append(pos + 1)
+            pos = find('\n', pos + 1)
+        # offset of the first character of every line
+        self.line_starts = starts
+
+    def line_col(self, offset):
+        """Return the 1-based (line, column) of a source offset."""
+        line = bisect.bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
 
 
 ###############################################################################
@@ -219,97 +933,340 @@ class Lexer(object):
 #                                                                             #
 ###############################################################################
 class AST(object):
-    pass
+    # Every node type lists its fields in __slots__: nodes carry no
+    # instance __dict__, and each value is stored exactly once.
+    #
+    # start and end are the source offsets of the first character of a
+    # node and just past its last one (None for nodes that were not
+    # parsed from source); see LineIndex for lines and columns.
+    __slots__ = ('start', 'end')
 
 
 class BinOp(AST):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
+        self.start = left.start
+        self.end = right.end
+
+    @property
+    def token(self):
+        return self.op
 
 
 class Num(AST):
-    def __init__(self, token):
+    __slots__ = ('token',)
+
+    def __init__(self, token, start=None, end=None):
         self.token = token
-        self.value = token.value
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self):
+        return self.token.value
 
 
 class UnaryOp(AST):
-    def __init__(self, op, expr):
-        self.token = self.op = op
+    __slots__ = ('op', 'expr')
+
+    def __init__(self, op, expr, start=None):
+        self.op = op
         self.expr = expr
+        self.start = start
+        self.end = expr.end
+
+    @property
+    def token(self):
+        return self.op
 
 
 class Compound(AST):
     """Represents a 'BEGIN ... END' block"""
-    def __init__(self):
+    __slots__ = ('children',)
+
+    def __init__(self, start=None, end=None):
         self.children = []
+        self.start = start
+        self.end = end
 
 
 class Assign(AST):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
+        self.start = left.start
+        self.end = right.end
+
+    @property
+    def token(self):
+        return self.op
 
 
 class Var(AST):
     """The Var node is constructed out of ID token."""
-    def __init__(self, token):
+    __slots__ = ('token',)
+
+    def __init__(self, token, start=None, end=None):
         self.token = token
-        self.value = token.value
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self):
+        return self.token.value
 
 
 class NoOp(AST):
-    pass
+    __slots__ = ()
+
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
 
 
 class Program(AST):
-    def __init__(self, name, block):
+    __slots__ = ('name', 'block')
+
+    def __init__(self, name, block, start=None, end=None):
         self.name = name
         self.block = block
+        self.start = start
+        self.end = end
 
 
 class Block(AST):
+    __slots__ = ('declarations', 'compound_statement')
+
     def __init__(self, declarations, compound_statement):
         self.declarations = declarations
         self.compound_statement = compound_statement
+        if declarations:
+            self.start = declarations[0].start
+        else:
+            self.start = compound_statement.start
+        self.end = compound_statement.end
 
 
 class VarDecl(AST):
+    __slots__ = ('var_node', 'type_node')
+
     def __init__(self, var_node, type_node):
         self.var_node = var_node
         self.type_node = type_node
+        self.start = var_node.start
+        self.end = type_node.end
 
 
 class Type(AST):
-    def __init__(self, token):
+    __slots__ = ('token',)
+
+    def __init__(self, token, start=None, end=None):
         self.token = token
-        self.value = token.value
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self):
+        return self.token.value
 
 
 class Param(AST):
+    __slots__ = ('var_node', 'type_node')
+
     def __init__(self, var_node, type_node):
         self.var_node = var_node
         self.type_node = type_node
+        self.start = var_node.start
+        self.end = type_node.end
 
 
 class ProcedureDecl(AST):
-    def __init__(self, proc_name, params, block_node):
+    __slots__ = ('proc_name', 'params', '_block_node')
+
+    def __init__(self, proc_name, params, block_node, start=None, end=None):
         self.proc_name = proc_name
         self.params = params  # a list of Param nodes
-        self.block_node = block_node
+        # a Block, or a function that parses and returns the Block on
+        # first access (see Parser's lazy_procedures mode)
+        self._block_node = block_node
+        self.start = start
+        self.end = end
+
+    @property
+    def block_node(self):
+        block_node = self._block_node
+        if not isinstance(block_node, AST):
+            block_node = self._block_node = block_node()
+        return block_node
+
+    @block_node.setter
+    def block_node(self, block_node):
+        self._block_node = block_node
+
+    def __getstate__(self):
+        # a pickled declaration always carries its parsed body
+        return None, {
+            'proc_name': self.proc_name,
+            'params': self.params,
+            '_block_node': self.block_node,
+            'start': self.start,
+            'end': self.end,
+        }
+
+
+class NodeFactory(object):
+    """Builds the expression nodes for a Parser: a new node every time."""
+    # whether one node can stand for several places in the source
+    shares_nodes = False
+
+    def num(self, token, start=None, end=None):
+        return Num(token, start, end)
+
+    def var(self, token, start=None, end=None):
+        return Var(token, start, end)
+
+    def bin_op(self, left, op, right):
+        return BinOp(left, op, right)
+
+    def unary_op(self, op, expr, start=None):
+        return UnaryOp(op, expr, start)
+
+
+class HashConsingNodeFactory(NodeFactory):
+    """Builds each distinct expression only once.
+
+    Structurally equal Num, Var, BinOp and UnaryOp nodes are one shared
+    node, which turns the trees into DAGs. Expression nodes must then
+    be treated as immutable, and a pass can memoise its results per
+    node (by identity). A shared node has no single source span, so
+    the factory can only be used by a Parser with spans=False; a
+    shared node keeps the tokens of the first occurrence it was built
+    for.
+
+    Children are always canonical nodes themselves, so compound nodes
+    are keyed by the identity of their children; the table keeps them
+    alive. One factory can be passed to several parsers to share
+    nodes across programs.
+    """
+    shares_nodes = True
+
+    def __init__(self):
+        self.table = {}
+
+    def num(self, token, start=None, end=None):
+        key = (Num, token.type, token.value)
+        node = self.table.get(key)
+        if node is None:
+            node = self.table[key] = Num(token, start, end)
+        return node
+
+    def var(self, token, start=None, end=None):
+        key = (Var, token.value)
+        node = self.table.get(key)
+        if node is None:
+            node = self.table[key] = Var(token, start, end)
+        return node
+
+    def bin_op(self, left, op, right):
+        key = (BinOp, id(left), op.type, id(right))
+        node = self.table.get(key)
+        if node is None:
+            node = self.table[key] = BinOp(left, op, right)
+        return node
+
+    def unary_op(self, op, expr, start=None):
+        key = (UnaryOp, op.type, id(expr))
+        node = self.table.get(key)
+        if node is None:
+            node = self.table[key] = UnaryOp(op, expr, start)
+        return node
+
+
+# Version of the trees built by the parsers. Bump it whenever the AST
+# classes or the shape of the trees change: it is part of the key of
+# every parse_cache entry.
+PARSER_VERSION = 4
+
+# Binding power of the binary operators, used by the precedence climbing
+# expression parser. A new precedence level is a new entry here.
+BINARY_PRECEDENCE = {
+    PLUS: 1,
+    MINUS: 1,
+    MUL: 2,
+    INTEGER_DIV: 2,
+    FLOAT_DIV: 2,
+}
+
+
+class ParserError(Exception):
+    """A syntax error at `token`, which starts at offset `position`.
+
+    `expected` is the token type the parser was looking for, if any.
+    """
+    def __init__(self, token, position=None, expected=None):
+        self.token = token
+        self.position = position
+        self.expected = expected
+        message = 'Invalid syntax'
+        if position is not None:
+            message += ' at position %d' % position
+        if expected is not None:
+            message += ': expected %s, got %s' % (expected, token.type)
+        else:
+            message += ': unexpected %s' % token.type
+        super(ParserError, self).__init__(message)
+
+
+class _NoOffsets(object):
+    """Stands in for the lexer as the source of token offsets in a
+    Parser that records no spans."""
+    def __init__(self):
+        # instance rather than class attributes: faster to read
+        self.token_start = self.token_end = None
 
 
 class Parser(object):
-    def __init__(self, lexer):
+    def __init__(self, lexer, precedence_climbing=False, lazy_procedures=False,
+                 node_factory=None, spans=True):
+        if lazy_procedures and not isinstance(lexer, TokenCursor):
+            # procedure bodies are parsed later from their token span
+            lexer = TokenCursor(lexer.tokenize_all(), spans)
+        # anything with a get_next_token() method: a Lexer, a StreamLexer
+        # or a TokenCursor over a pre-tokenized TokenArray
         self.lexer = lexer
+        # with spans=False the nodes get no source spans (their start
+        # and end are None) and no token offsets are read for them
+        self.spans = spans
+        # where the rules read the offsets of the last token from
+        self.offsets = lexer if spans else _NoOffsets()
+        self.precedence_climbing = precedence_climbing
+        self.lazy_procedures = lazy_procedures
+        # builds the expression nodes; a HashConsingNodeFactory makes
+        # the trees DAGs
+        self.node_factory = node_factory or NodeFactory()
+        if spans and self.node_factory.shares_nodes:
+            raise ValueError(
+                '%s shares nodes between occurrences, which cannot all '
+                'have their own span: pass spans=False'
+                % type(self.node_factory).__name__)
         # set current token to the first token taken from the input
         self.current_token = self.lexer.get_next_token()
+        if precedence_climbing:
+            # table-driven expression parser; builds the same trees as
+            # the expr -> term -> factor recursion
+            self.expr = self.precedence_expr
 
-    def error(self):
-        raise Exception('Invalid syntax')
+    def error(self, expected=None):
+        # lexers and token cursors record where the current token starts
+        position = getattr(self.lexer, 'token_start', None)
+        raise ParserError(self.current_token, position, expected)
 
     def eat(self, token_type):
         # compare the current token type with the passed token
@@ -319,17 +1276,19 @@ class Parser(object):
         if self.current_token.type == token_type:
             self.current_token = self.lexer.get_next_token()
         else:
-            self.error()
+            self.error(token_type)
 
     def program(self):
         """program : PROGRAM variable SEMI block DOT"""
+        start = self.offsets.token_start
         self.eat(PROGRAM)
         var_node = self.variable()
         prog_name = var_node.value
         self.eat(SEMI)
         block_node = self.block()
-        program_node = Program(prog_name, block_node)
+        end = self.offsets.token_end
         self.eat(DOT)
+        program_node = Program(prog_name, block_node, start, end)
         return program_node
 
     def block(self):
@@ -355,6 +1314,7 @@ class Parser(object):
                     self.eat(SEMI)
 
             elif self.current_token.type == PROCEDURE:
+                start = self.offsets.token_start
                 self.eat(PROCEDURE)
                 proc_name = self.current_token.value
                 self.eat(ID)
@@ -368,8 +1328,12 @@ class Parser(object):
                     self.eat(RPAREN)
 
                 self.eat(SEMI)
-                block_node = self.block()
-                proc_decl = ProcedureDecl(proc_name, params, block_node)
+                if self.lazy_procedures:
+                    block_node, end = self.skip_block()
+                else:
+                    block_node = self.block()
+                    end = block_node.end
+                proc_decl = ProcedureDecl(proc_name, params, block_node, start, end)
                 declarations.append(proc_decl)
                 self.eat(SEMI)
             else:
@@ -377,22 +1341,84 @@ class Parser(object):
 
         return declarations
 
+    def skip_block(self):
+        """Skip over a procedure body.
+
+        Return a function that parses it, and the end offset of the body.
+
+        Only the BEGIN/END nesting of the tokens is followed: the body
+        ends with the END that closes the compound statement of the
+        block itself, after those of any nested procedures. The body is
+        parsed, and its syntax errors raised, when the function is
+        called. A body that runs into EOF is parsed right away instead,
+        to report the error where the eager parser would.
+        """
+        cursor = self.lexer
+        types = cursor.types
+        start = cursor.index - 1  # index of self.current_token
+        begin, end = TOKEN_CODES[BEGIN], TOKEN_CODES[END]
+        procedure, eof = TOKEN_CODES[PROCEDURE], TOKEN_CODES[EOF]
+        blocks = 1  # blocks opened and not closed yet
+        depth = 0  # BEGIN ... END nesting
+        index = start
+        while True:
+            code = types[index]
+            if code == begin:
+                depth += 1
+            elif code == end:
+                depth -= 1
+                if depth == 0:
+                    blocks -= 1
+                    if blocks == 0:
+                        break
+            elif code == procedure:
+                blocks += 1
+            elif code == eof:
+                block_node = self.block()
+                return block_node, block_node.end
+            index += 1
+
+        stop = index + 1  # the token after the body
+        cursor.index = stop
+        self.current_token = cursor.get_next_token()
+
+        tokens = cursor.tokens
+        precedence_climbing = self.precedence_climbing
+        node_factory = self.node_factory
+        spans = self.spans
+
+        def parse_block():
+            body_cursor = TokenCursor(tokens, spans)
+            body_cursor.index = start
+            parser = Parser(
+                body_cursor, precedence_climbing, lazy_procedures=True,
+                node_factory=node_factory, spans=spans,
+            )
+            block_node = parser.block()
+            if body_cursor.index - 1 != stop:
+                parser.error(SEMI)
+            return block_node
+
+        return parse_block, tokens.ends[index] if spans else None
+
     def formal_parameters(self):
         """ formal_parameters : ID (COMMA ID)* COLON type_spec """
+        offsets = self.offsets
         param_nodes = []
 
-        param_tokens = [self.current_token]
+        param_vars = [Var(self.current_token, offsets.token_start, offsets.token_end)]
         self.eat(ID)
         while self.current_token.type == COMMA:
             self.eat(COMMA)
-            param_tokens.append(self.current_token)
+            param_vars.append(
+                Var(self.current_token, offsets.token_start, offsets.token_end))
             self.eat(ID)
 
         self.eat(COLON)
         type_node = self.type_spec()
 
-        for param_token in param_tokens:
-            param_node = Param(Var(param_token), type_node)
+        for param_var in param_vars:
+            param_node = Param(param_var, type_node)
             param_nodes.append(param_node)
 
         return param_nodes
@@ -417,12 +1443,16 @@ class Parser(object):
 
     def variable_declaration(self):
         """variable_declaration : ID (COMMA ID)* COLON type_spec"""
-        var_nodes = [Var(self.current_token)]  # first ID
+        offsets = self.offsets
+        var_nodes = [
+            Var(self.current_token, offsets.token_start, offsets.token_end)
+        ]  # first ID
         self.eat(ID)
 
         while self.current_token.type == COMMA:
             self.eat(COMMA)
-            var_nodes.append(Var(self.current_token))
+            var_nodes.append(
+                Var(self.current_token, offsets.token_start, offsets.token_end))
             self.eat(ID)
 
         self.eat(COLON)
@@ -439,22 +1469,25 @@ class Parser(object):
                      | REAL
         """
         token = self.current_token
+        start, end = self.offsets.token_start, self.offsets.token_end
         if self.current_token.type == INTEGER:
             self.eat(INTEGER)
         else:
             self.eat(REAL)
-        node = Type(token)
+        node = Type(token, start, end)
         return node
 
     def compound_statement(self):
         """
         compound_statement: BEGIN statement_list END
         """
+        start = self.offsets.token_start
         self.eat(BEGIN)
         nodes = self.statement_list()
+        end = self.offsets.token_end
         self.eat(END)
 
-        root = Compound()
+        root = Compound(start, end)
         for node in nodes:
             root.children.append(node)
 
@@ -504,13 +1537,17 @@ class Parser(object):
         """
         variable : ID
         """
-        node = Var(self.current_token)
+        offsets = self.offsets
+        node = self.node_factory.var(
+            self.current_token, offsets.token_start, offsets.token_end)
         self.eat(ID)
         return node
 
     def empty(self):
         """An empty production"""
-        return NoOp()
+        # an empty span where the next token starts
+        position = self.offsets.token_start
+        return NoOp(position, position)
 
     def expr(self):
         """
@@ -525,7 +1562,7 @@ class Parser(object):
             elif token.type == MINUS:
                 self.eat(MINUS)
 
-            node = BinOp(left=node, op=token, right=self.term())
+            node = self.node_factory.bin_op(node, token, self.term())
 
         return node
 
@@ -542,7 +1579,7 @@ class Parser(object):
             elif token.type == FLOAT_DIV:
                 self.eat(FLOAT_DIV)
 
-            node = BinOp(left=node, op=token, right=self.factor())
+            node = self.node_factory.bin_op(node, token, self.factor())
 
         return node
 
@@ -556,28 +1593,89 @@ class Parser(object):
         """
         token = self.current_token
         if token.type == PLUS:
+            start = self.offsets.token_start
             self.eat(PLUS)
-            node = UnaryOp(token, self.factor())
+            node = self.node_factory.unary_op(token, self.factor(), start)
             return node
         elif token.type == MINUS:
+            start = self.offsets.token_start
             self.eat(MINUS)
-            node = UnaryOp(token, self.factor())
+            node = self.node_factory.unary_op(token, self.factor(), start)
             return node
         elif token.type == INTEGER_CONST:
+            start, end = self.offsets.token_start, self.offsets.token_end
             self.eat(INTEGER_CONST)
-            return Num(token)
+            return self.node_factory.num(token, start, end)
         elif token.type == REAL_CONST:
+            start, end = self.offsets.token_start, self.offsets.token_end
             self.eat(REAL_CONST)
-            return Num(token)
+            return self.node_factory.num(token, start, end)
         elif token.type == LPAREN:
+            start = self.offsets.token_start
             self.eat(LPAREN)
             node = self.expr()
+            end = self.offsets.token_end
             self.eat(RPAREN)
+            if self.spans:
+                # parentheses build no node of their own: the span of
+                # the expression is widened to cover them, so that the
+                # spans of enclosing nodes stay balanced
+                node.start = start
+                node.end = end
             return node
         else:
             node = self.variable()
             return node
 
+    def precedence_expr(self, min_precedence=1):
+        """Precedence climbing counterpart of expr.
+
+        Parses operands (with their unary prefixes) inline and combines
+        them with the binary operators whose BINARY_PRECEDENCE is at
+        least min_precedence, left-associatively. Costs one call per
+        operator instead of a chain of expr/term/factor calls per operand.
+        """
+        lexer = self.lexer
+        offsets = self.offsets
+        precedence_of = BINARY_PRECEDENCE.get
+        node_factory = self.node_factory
+
+        # operand : (PLUS | MINUS)* (INTEGER_CONST | REAL_CONST
+        #                            | LPAREN expr RPAREN | variable)
+        unary_ops = None
+        token = self.current_token
+        while token.type == PLUS or token.type == MINUS:
+            if unary_ops is None:
+                unary_ops = []
+            unary_ops.append((token, offsets.token_start))
+            token = self.current_token = lexer.get_next_token()
+        if token.type == INTEGER_CONST or token.type == REAL_CONST:
+            node = node_factory.num(token, offsets.token_start, offsets.token_end)
+            self.current_token = lexer.get_next_token()
+        elif token.type == LPAREN:
+            start = offsets.token_start
+            self.current_token = lexer.get_next_token()
+            node = self.precedence_expr()
+            end = offsets.token_end
+            self.eat(RPAREN)
+            if self.spans:
+                node.start = start
+                node.end = end
+        else:
+            node = self.variable()
+        if unary_ops is not None:
+            for op, start in reversed(unary_ops):
+                node = node_factory.unary_op(op, node, start)
+
+        token = self.current_token
+        precedence = precedence_of(token.type)
+        while precedence is not None and precedence >= min_precedence:
+            self.current_token = lexer.get_next_token()
+            node = node_factory.bin_op(node, token, self.precedence_expr(precedence + 1))
+            token = self.current_token
+            precedence = precedence_of(token.type)
+        return node
+
     def parse(self):
         """
         program : PROGRAM variable SEMI block DOT
@@ -630,6 +1728,362 @@ class Parser(object):
         return node
 
 
+class RecoveringParser(Parser):
+    """Parser that reports every syntax error instead of only the first.
+
+    On a syntax error it records the ParserError, skips tokens up to
+    the next synchronisation point (SEMI, END, PROCEDURE or EOF) and
+    carries on, in panic-mode style. A missing BEGIN, END, SEMI or DOT
+    is recorded and parsing continues as if it were there. Statements
+    that fail to parse become NoOp nodes in the tree.
+
+    Lexical errors are not recovered from; they propagate as usual.
+    """
+    SYNC_TOKENS = (SEMI, END, PROCEDURE, EOF)
+
+    def __init__(self, lexer):
+        super(RecoveringParser, self).__init__(lexer)
+        self.errors = []
+
+    def synchronize(self, error):
+        """Record error and skip to the next synchronisation token."""
+        self.errors.append(error)
+        while self.current_token.type not in self.SYNC_TOKENS:
+            self.current_token = self.lexer.get_next_token()
+
+    def expect(self, token_type):
+        """Eat a token_type token, or record it as missing."""
+        try:
+            self.eat(token_type)
+        except ParserError as e:
+            self.errors.append(e)
+
+    def program(self):
+        """program : PROGRAM variable SEMI block DOT"""
+        prog_name = None
+        start = self.offsets.token_start
+        try:
+            self.eat(PROGRAM)
+            prog_name = self.variable().value
+            self.eat(SEMI)
+        except ParserError as e:
+            self.synchronize(e)
+            if self.current_token.type == SEMI:
+                self.eat(SEMI)
+        block_node = self.block()
+        end = self.offsets.token_end if self.current_token.type == DOT else block_node.end
+        self.expect(DOT)
+        program_node = Program(prog_name, block_node, start, end)
+        return program_node
+
+    def declarations(self):
+        """declarations : (VAR (variable_declaration SEMI)+)*
+                        | (PROCEDURE ID (LPAREN formal_parameter_list RPAREN)? SEMI block SEMI)*
+                        | empty
+        """
+        declarations = []
+
+        while True:
+            if self.current_token.type == VAR:
+                self.eat(VAR)
+                while self.current_token.type == ID:
+                    try:
+                        declarations.extend(self.variable_declaration())
+                        self.eat(SEMI)
+                    except ParserError as e:
+                        self.synchronize(e)
+                        if self.current_token.type == SEMI:
+                            self.eat(SEMI)
+
+            elif self.current_token.type == PROCEDURE:
+                start = self.offsets.token_start
+                self.eat(PROCEDURE)
+                proc_name = None
+                params = []
+                try:
+                    name = self.current_token.value
+                    self.eat(ID)
+                    proc_name = name
+                    if self.current_token.type == LPAREN:
+                        self.eat(LPAREN)
+                        params = self.formal_parameter_list()
+                        self.eat(RPAREN)
+                    self.eat(SEMI)
+                except ParserError as e:
+                    self.synchronize(e)
+                    if self.current_token.type == SEMI:
+                        self.eat(SEMI)
+                block_node = self.block()
+                proc_decl = ProcedureDecl(
+                    proc_name, params, block_node, start, block_node.end)
+                declarations.append(proc_decl)
+                self.expect(SEMI)
+            else:
+                break
+
+        return declarations
+
+    def compound_statement(self):
+        """compound_statement: BEGIN statement_list END"""
+        start = self.offsets.token_start
+        self.expect(BEGIN)
+        nodes = self.statement_list()
+        end = self.offsets.token_end if self.current_token.type == END else None
+        self.expect(END)
+
+        root = Compound(start, end)
+        for node in nodes:
+            root.children.append(node)
+
+        return root
+
+    def statement_list(self):
+        """statement_list : statement
+                          | statement SEMI statement_list
+        """
+        results = [self.recovering_statement()]
+
+        while self.current_token.type not in (END, PROCEDURE, DOT, EOF):
+            if self.current_token.type == SEMI:
+                self.eat(SEMI)
+                results.append(self.recovering_statement())
+            else:
+                # junk after a complete statement, e.g. 'a := 1 2'
+                try:
+                    self.error(SEMI)
+                except ParserError as e:
+                    self.synchronize(e)
+
+        return results
+
+    def recovering_statement(self):
+        """Parse a statement; on a syntax error return a NoOp."""
+        start = self.offsets.token_start
+        try:
+            return self.statement()
+        except ParserError as e:
+            self.synchronize(e)
+            # covers the tokens that were skipped
+            return NoOp(start, self.offsets.token_start)
+
+    def parse(self):
+        """Parse the whole program.
+
+        Return (tree, errors): the (partial) AST and the list of
+        ParserErrors found, in source order. errors is empty for a
+        valid program.
+        """
+        node = self.program()
+        if self.current_token.type != EOF:
+            try:
+                self.error(EOF)
+            except ParserError as e:
+                self.errors.append(e)
+
+        return node, self.errors
+
+
+class StackParser(Parser):
+    """Parser whose nesting depth is limited only by memory.
+
+    Every recursive grammar rule is a generator: instead of calling a
+    sub-rule it yields the sub-rule's generator and is sent back its
+    result. parse() drives these generators from an explicit stack, so
+    deeply nested parentheses, unary operators, BEGIN ... END blocks or
+    procedures never grow the Python call stack. The rules mirror the
+    ones in Parser and build the same AST.
+    """
+    def __init__(self, lexer, node_factory=None, spans=True):
+        super(StackParser, self).__init__(
+            lexer, node_factory=node_factory, spans=spans)
+
+    def run(self, rule):
+        """Run a rule generator and the sub-rules it yields to completion."""
+        stack = [rule]
+        value = None
+        while stack:
+            try:
+                sub_rule = stack[-1].send(value)
+            except StopIteration as stop:
+                stack.pop()
+                value = stop.value
+            else:
+                stack.append(sub_rule)
+                value = None
+        return value
+
+    def program(self):
+        """program : PROGRAM variable SEMI block DOT"""
+        start = self.offsets.token_start
+        self.eat(PROGRAM)
+        var_node = self.variable()
+        prog_name = var_node.value
+        self.eat(SEMI)
+        block_node = yield self.block()
+        end = self.offsets.token_end
+        self.eat(DOT)
+        program_node = Program(prog_name, block_node, start, end)
+        return program_node
+
+    def block(self):
+        """block : declarations compound_statement"""
+        declaration_nodes = yield self.declarations()
+        compound_statement_node = yield self.compound_statement()
+        node = Block(declaration_nodes, compound_statement_node)
+        return node
+
+    def declarations(self):
+        """declarations : (VAR (variable_declaration SEMI)+)*
+                        | (PROCEDURE ID (LPAREN formal_parameter_list RPAREN)? SEMI block SEMI)*
+                        | empty
+        """
+        declarations = []
+
+        while True:
+            if self.current_token.type == VAR:
+                self.eat(VAR)
+                while self.current_token.type == ID:
+                    var_decl = self.variable_declaration()
+                    declarations.extend(var_decl)
+                    self.eat(SEMI)
+
+            elif self.current_token.type == PROCEDURE:
+                start = self.offsets.token_start
+                self.eat(PROCEDURE)
+                proc_name = self.current_token.value
+                self.eat(ID)
+                params = []
+
+                if self.current_token.type == LPAREN:
+                    self.eat(LPAREN)
+                    params = self.formal_parameter_list()
+                    self.eat(RPAREN)
+
+                self.eat(SEMI)
+                block_node = yield self.block()
+                proc_decl = ProcedureDecl(
+                    proc_name, params, block_node, start, block_node.end)
+                declarations.append(proc_decl)
+                self.eat(SEMI)
+            else:
+                break
+
+        return declarations
+
+    def compound_statement(self):
+        """compound_statement: BEGIN statement_list END"""
+        start = self.offsets.token_start
+        self.eat(BEGIN)
+        nodes = yield self.statement_list()
+        end = self.offsets.token_end
+        self.eat(END)
+
+        root = Compound(start, end)
+        for node in nodes:
+            root.children.append(node)
+
+        return root
+
+    def statement_list(self):
+        """statement_list : statement
+                          | statement SEMI statement_list
+        """
+        node = yield self.statement()
+
+        results = [node]
+
+        while self.current_token.type == SEMI:
+            self.eat(SEMI)
+            node = yield self.statement()
+            results.append(node)
+
+        return results
+
+    def statement(self):
+        """statement : compound_statement
+                     | assignment_statement
+                     | empty
+        """
+        if self.current_token.type == BEGIN:
+            node = yield self.compound_statement()
+        elif self.current_token.type == ID:
+            node = yield self.assignment_statement()
+        else:
+            node = self.empty()
+        return node
+
+    def assignment_statement(self):
+        """assignment_statement : variable ASSIGN expr"""
+        left = self.variable()
+        token = self.current_token
+        self.eat(ASSIGN)
+        right = yield self.expr()
+        node = Assign(left, token, right)
+        return node
+
+    def expr(self):
+        """expr : term ((PLUS | MINUS) term)*"""
+        node = yield self.term()
+
+        while self.current_token.type in (PLUS, MINUS):
+            token = self.current_token
+            self.eat(token.type)
+            right = yield self.term()
+            node = self.node_factory.bin_op(node, token, right)
+
+        return node
+
+    def term(self):
+        """term : factor ((MUL | INTEGER_DIV | FLOAT_DIV) factor)*"""
+        node = yield self.factor()
+
+        while self.current_token.type in (MUL, INTEGER_DIV, FLOAT_DIV):
+            token = self.current_token
+            self.eat(token.type)
+            right = yield self.factor()
+            node = self.node_factory.bin_op(node, token, right)
+
+        return node
+
+    def factor(self):
+        """factor : PLUS factor
+                  | MINUS factor
+                  | INTEGER_CONST
+                  | REAL_CONST
+                  | LPAREN expr RPAREN
+                  | variable
+        """
+        token = self.current_token
+        start = self.offsets.token_start
+        if token.type in (PLUS, MINUS):
+            self.eat(token.type)
+            node = yield self.factor()
+            return self.node_factory.unary_op(token, node, start)
+        elif token.type in (INTEGER_CONST, REAL_CONST):
+            end = self.offsets.token_end
+            self.eat(token.type)
+            return self.node_factory.num(token, start, end)
+        elif token.type == LPAREN:
+            self.eat(LPAREN)
+            node = yield self.expr()
+            end = self.offsets.token_end
+            self.eat(RPAREN)
+            if self.spans:
+                node.start = start
+                node.end = end
+            return node
+        else:
+            node = self.variable()
+            return node
+
+    def parse(self):
+        node = self.run(self.program())
+        if self.current_token.type != EOF:
+            self.error()
+
+        return node
+
+
 ###############################################################################
 #                                                                             #
 #  AST visitors (walkers)                                                     #
@@ -637,15 +2091,138 @@ class Parser(object):
 ###############################################################################
 
 class NodeVisitor(object):
+    # node class -> the visit_ function for it, or generic_visit. Every
+    # visitor class gets its own table, filled in on the first visit to
+    # each node class, so methods must be in place on the class by then
+    # (a visit_ method set on an instance is not seen).
+    _visit_methods = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super(NodeVisitor, cls).__init_subclass__(**kwargs)
+        cls._visit_methods = {}
+
     def visit(self, node):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
+        try:
+            method = self._visit_methods[type(node)]
+        except KeyError:
+            method = self._visit_method(type(node))
+        return method(self, node)
+
+    @classmethod
+    def _visit_method(cls, node_class):
+        method = getattr(cls, 'visit_' + node_class.__name__, cls.generic_visit)
+        cls._visit_methods[node_class] = method
+        return method
 
     def generic_visit(self, node):
         raise Exception('No visit_{} method'.format(type(node).__name__))
 
 
+# Function returning the child nodes of a node, in field order, for each
+# node class name (FlatAST views share the names, see flat_ast.py); None
+# for the classes without children. This is the one table of the tree
+# shape: flat_ast.node_children() and the tree walkers all go through it.
+NODE_CHILDREN = {
+    'Program': lambda node: (node.block,),
+    'Block': lambda node: node.declarations + [node.compound_statement],
+    'VarDecl': attrgetter('var_node', 'type_node'),
+    'Param': attrgetter('var_node', 'type_node'),
+    'ProcedureDecl': lambda node: node.params + [node.block_node],
+    'Compound': attrgetter('children'),
+    'Assign': attrgetter('left', 'right'),
+    'BinOp': attrgetter('left', 'right'),
+    'UnaryOp': lambda node: (node.expr,),
+    'Num': None,
+    'Var': None,
+    'Type': None,
+    'NoOp': None,
+}
+
+
+class NodeWalker(NodeVisitor):
+    """Walks a tree with an explicit stack instead of recursive visit()
+    calls, so trees of any depth can be walked. Each node costs more
+    than a recursive visit(), so it is meant for deep or generated
+    trees: see StackSemanticAnalyzer and StackInterpreter.
+
+    A walker defines hooks per node class, both optional:
+
+    enter_<Class>(node)
+        runs before the children of node are walked. It may return the
+        children to walk, in order, instead of the default NODE_CHILDREN
+        of the node; an empty sequence skips them.
+    leave_<Class>(node, results)
+        runs after the children were walked; results is the list of
+        their results. What it returns is the result of node, None when
+        there is no leave hook.
+
+    visit(tree) walks the tree and returns the result of its root.
+    Node classes that are neither in NODE_CHILDREN nor have a hook go
+    to generic_visit(), in place of an enter hook.
+    """
+    # node class -> (enter, children, leave) functions, any of them None;
+    # a table per walker class, like NodeVisitor._visit_methods
+    _walk_methods = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super(NodeWalker, cls).__init_subclass__(**kwargs)
+        cls._walk_methods = {}
+
+    @classmethod
+    def _walk_method(cls, node_class):
+        name = node_class.__name__
+        enter = getattr(cls, 'enter_' + name, None)
+        leave = getattr(cls, 'leave_' + name, None)
+        if enter is None and leave is None and name not in NODE_CHILDREN:
+            enter = cls.generic_visit
+        methods = cls._walk_methods[node_class] = (
+            enter, NODE_CHILDREN.get(name), leave
+        )
+        return methods
+
+    def generic_visit(self, node):
+        raise Exception(
+            'No enter_{0} or leave_{0} method'.format(type(node).__name__)
+        )
+
+    def visit(self, node):
+        table = self._walk_methods
+        # A (node, out) frame enters a node and appends its result to the
+        # list out; a (node, results, out, leave) frame comes back to it
+        # once the results of its children are in.
+        top = []
+        stack = [(node, top)]
+        push = stack.append
+        pop = stack.pop
+        while stack:
+            frame = pop()
+            if len(frame) == 4:
+                node, results, out, leave = frame
+                out.append(leave(self, node, results))
+                continue
+            node, out = frame
+            try:
+                enter, children, leave = table[type(node)]
+            except KeyError:
+                enter, children, leave = self._walk_method(type(node))
+            kids = None
+            if enter is not None:
+                kids = enter(self, node)
+            if kids is None and children is not None:
+                kids = children(node)
+            if not kids:
+                out.append(leave(self, node, []) if leave is not None else None)
+                continue
+            results = []
+            if leave is None:
+                out.append(None)
+            else:
+                push((node, results, out, leave))
+            for child in reversed(kids):
+                push((child, results))
+        return top[0]
+
+
 ###############################################################################
 #                                                                             #
 #  SYMBOLS, TABLES, SEMANTIC ANALYSIS                                         #
@@ -702,12 +2279,64 @@ class ProcedureSymbol(Symbol):
     __repr__ = __str__
 
 
+# Trace event kinds
+TRACE_ENTER  = 'ENTER'
+TRACE_LEAVE  = 'LEAVE'
+TRACE_INSERT = 'INSERT'
+TRACE_LOOKUP = 'LOOKUP'
+
+# A scope was entered or left, or a symbol name inserted into or looked
+# up in a scope (name is None for TRACE_ENTER and TRACE_LEAVE)
+TraceEvent = namedtuple('TraceEvent', ('kind', 'scope', 'name'))
+
+
+class Tracer(object):
+    """Sink for the TraceEvents of the semantic analysis.
+
+    Symbol tables and analyzers take an optional tracer, and trace
+    nothing without one: they do not even create the events.
+    """
+    def emit(self, event):
+        raise NotImplementedError
+
+
+class RecordingTracer(Tracer):
+    """Keeps the events in a list."""
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+
+class PrintTracer(Tracer):
+    """Prints the events to file (default: sys.stdout) in the format of
+    the tutorial, with the contents of every scope when it is left."""
+    def __init__(self, file=None):
+        self.file = file
+
+    def emit(self, event):
+        kind, scope, name = event
+        if kind == TRACE_LOOKUP:
+            line = 'Lookup: %s. (Scope name: %s)' % (name, scope.scope_name)
+        elif kind == TRACE_INSERT:
+            line = 'Insert: %s' % name
+        elif kind == TRACE_ENTER:
+            line = 'ENTER scope: %s' % scope.scope_name
+        else:
+            print(scope, file=self.file)
+            line = 'LEAVE scope: %s' % scope.scope_name
+        print(line, file=self.file)
+
+
 class ScopedSymbolTable(object):
-    def __init__(self, scope_name, scope_level, enclosing_scope=None):
+    def __init__(self, scope_name, scope_level, enclosing_scope=None,
+                 tracer=None):
         self._symbols = OrderedDict()
         self.scope_name = scope_name
         self.scope_level = scope_level
         self.enclosing_scope = enclosing_scope
+        self.tracer = tracer
 
     def _init_builtins(self):
         self.insert(BuiltinTypeSymbol('INTEGER'))
@@ -737,11 +2366,13 @@ class ScopedSymbolTable(object):
     __repr__ = __str__
 
     def insert(self, symbol):
-        print('Insert: %s' % symbol.name)
+        if self.tracer is not None:
+            self.tracer.emit(TraceEvent(TRACE_INSERT, self, symbol.name))
         self._symbols[symbol.name] = symbol
 
     def lookup(self, name, current_scope_only=False):
-        print('Lookup: %s. (Scope name: %s)' % (name, self.scope_name))
+        if self.tracer is not None:
+            self.tracer.emit(TraceEvent(TRACE_LOOKUP, self, name))
         # 'symbol' is either an instance of the Symbol class or None
         symbol = self._symbols.get(name)
 
@@ -757,56 +2388,41 @@ class ScopedSymbolTable(object):
 
 
 class SemanticAnalyzer(NodeVisitor):
-    def __init__(self):
+    def __init__(self, tracer=None):
         self.current_scope = None
-
-    def visit_Block(self, node):
-        for declaration in node.declarations:
-            self.visit(declaration)
-        self.visit(node.compound_statement)
-
-    def visit_Program(self, node):
-        print('ENTER scope: global')
-        global_scope = ScopedSymbolTable(
-            scope_name='global',
-            scope_level=1,
-            enclosing_scope=self.current_scope, # None
+        # a Tracer for the scopes and symbols, or None
+        self.tracer = tracer
+
+    def open_scope(self, scope_name):
+        """Enter a new scope, nested in the current one if any."""
+        enclosing_scope = self.current_scope
+        scope = ScopedSymbolTable(
+            scope_name=scope_name,
+            scope_level=enclosing_scope.scope_level + 1 if enclosing_scope else 1,
+            enclosing_scope=enclosing_scope,
+            tracer=self.tracer,
         )
-        global_scope._init_builtins()
-        self.current_scope = global_scope
+        if self.tracer is not None:
+            self.tracer.emit(TraceEvent(TRACE_ENTER, scope, None))
+        if enclosing_scope is None:
+            scope._init_builtins()
+        self.current_scope = scope
 
-        # visit subtree
-        self.visit(node.block)
-
-        print(global_scope)
+    def close_scope(self):
+        if self.tracer is not None:
+            self.tracer.emit(TraceEvent(TRACE_LEAVE, self.current_scope, None))
 
         self.current_scope = self.current_scope.enclosing_scope
-        print('LEAVE scope: global')
 
-    def visit_Compound(self, node):
-        for child in node.children:
-            self.visit(child)
-
-    def visit_NoOp(self, node):
-        pass
-
-    def visit_BinOp(self, node):
-        self.visit(node.left)
-        self.visit(node.right)
-
-    def visit_ProcedureDecl(self, node):
+    def declare_procedure(self, node):
+        """Insert the symbol of a procedure and enter its scope, with the
+        parameters inserted."""
         proc_name = node.proc_name
         proc_symbol = ProcedureSymbol(proc_name)
         self.current_scope.insert(proc_symbol)
 
-        print('ENTER scope: %s' %  proc_name)
         # Scope for parameters and local variables
-        procedure_scope = ScopedSymbolTable(
-            scope_name=proc_name,
-            scope_level=self.current_scope.scope_level + 1,
-            enclosing_scope=self.current_scope
-        )
-        self.current_scope = procedure_scope
+        self.open_scope(proc_name)
 
         # Insert parameters into the procedure scope
         for param in node.params:
@@ -816,14 +2432,7 @@ class SemanticAnalyzer(NodeVisitor):
             self.current_scope.insert(var_symbol)
             proc_symbol.params.append(var_symbol)
 
-        self.visit(node.block_node)
-
-        print(procedure_scope)
-
-        self.current_scope = self.current_scope.enclosing_scope
-        print('LEAVE scope: %s' %  proc_name)
-
-    def visit_VarDecl(self, node):
+    def declare_variable(self, node):
         type_name = node.type_node.value
         type_symbol = self.current_scope.lookup(type_name)
 
@@ -841,6 +2450,54 @@ class SemanticAnalyzer(NodeVisitor):
 
         self.current_scope.insert(var_symbol)
 
+    def check_variable(self, node):
+        var_name = node.value
+        var_symbol = self.current_scope.lookup(var_name)
+        if var_symbol is None:
+            raise Exception(
+                "Error: Symbol(identifier) not found '%s'" % var_name
+            )
+
+    def visit_Block(self, node):
+        for declaration in node.declarations:
+            self.visit(declaration)
+        self.visit(node.compound_statement)
+
+    def visit_Program(self, node):
+        self.open_scope('global')
+
+        # visit subtree
+        self.visit(node.block)
+
+        self.close_scope()
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_NoOp(self, node):
+        pass
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_Num(self, node):
+        pass
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+
+    def visit_ProcedureDecl(self, node):
+        self.declare_procedure(node)
+
+        self.visit(node.block_node)
+
+        self.close_scope()
+
+    def visit_VarDecl(self, node):
+        self.declare_variable(node)
+
     def visit_Assign(self, node):
         # right-hand side
         self.visit(node.right)
@@ -848,12 +2505,36 @@ class SemanticAnalyzer(NodeVisitor):
         self.visit(node.left)
 
     def visit_Var(self, node):
-        var_name = node.value
-        var_symbol = self.current_scope.lookup(var_name)
-        if var_symbol is None:
-            raise Exception(
-                "Error: Symbol(identifier) not found '%s'" % var_name
-            )
+        self.check_variable(node)
+
+
+class StackSemanticAnalyzer(NodeWalker, SemanticAnalyzer):
+    """The SemanticAnalyzer on a NodeWalker: the same checks, trace and
+    errors, for trees of any depth, at a higher cost per node."""
+    def enter_Program(self, node):
+        self.open_scope('global')
+
+    def leave_Program(self, node, results):
+        self.close_scope()
+
+    def enter_ProcedureDecl(self, node):
+        self.declare_procedure(node)
+        # the parameters are done: walk the body only
+        return (node.block_node,)
+
+    def leave_ProcedureDecl(self, node, results):
+        self.close_scope()
+
+    def enter_VarDecl(self, node):
+        self.declare_variable(node)
+        return ()
+
+    def enter_Assign(self, node):
+        # right-hand side, then left-hand side
+        return (node.right, node.left)
+
+    def enter_Var(self, node):
+        self.check_variable(node)
 
 
 ###############################################################################
@@ -862,6 +2543,42 @@ class SemanticAnalyzer(NodeVisitor):
 #                                                                             #
 ###############################################################################
 
+# Interpreter code, as made by the CodeGenerator: a list of (opcode,
+# argument) instructions, in the post-order of the tree, run on a stack
+# of values by Interpreter.execute()
+(OP_CONST, OP_LOAD, OP_STORE, OP_POS, OP_NEG,
+ OP_ADD, OP_SUB, OP_MUL, OP_INTEGER_DIV, OP_FLOAT_DIV) = range(10)
+
+# Added to a binary opcode, its right operand is not popped off the
+# stack but is the argument, a constant (RIGHT_CONST), or the value of
+# the variable it names (RIGHT_LOAD): one instruction instead of two.
+# Every opcode is below RIGHT_CONST.
+RIGHT_CONST = 10
+RIGHT_LOAD = 20
+
+UNARY_OPCODES = {PLUS: OP_POS, MINUS: OP_NEG}
+BINARY_OPCODES = {
+    PLUS: OP_ADD, MINUS: OP_SUB, MUL: OP_MUL,
+    INTEGER_DIV: OP_INTEGER_DIV, FLOAT_DIV: OP_FLOAT_DIV,
+}
+
+
+def _float_div(left, right):
+    return float(left) / float(right)
+
+
+_OPERATOR_FUNCTIONS = {
+    OP_ADD: add, OP_SUB: sub, OP_MUL: mul,
+    OP_INTEGER_DIV: floordiv, OP_FLOAT_DIV: _float_div,
+}
+# opcode -> function of the left and right operands, for the binary
+# opcodes with or without RIGHT_CONST or RIGHT_LOAD; None for the others
+BINARY_FUNCTIONS = tuple(
+    _OPERATOR_FUNCTIONS.get(opcode % RIGHT_CONST)
+    for opcode in range(RIGHT_LOAD + RIGHT_CONST)
+)
+
+
 class Interpreter(NodeVisitor):
     def __init__(self, tree):
         self.tree = tree
@@ -931,27 +2648,221 @@ class Interpreter(NodeVisitor):
             return ''
         return self.visit(tree)
 
+    def execute(self, code):
+        """Run code from a CodeGenerator, instead of walking the tree."""
+        memory = self.GLOBAL_MEMORY
+        functions = BINARY_FUNCTIONS
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        # the most frequent instructions first
+        for opcode, argument in code:
+            if opcode >= RIGHT_LOAD:
+                stack[-1] = functions[opcode](stack[-1], memory.get(argument))
+            elif opcode >= RIGHT_CONST:
+                stack[-1] = functions[opcode](stack[-1], argument)
+            elif opcode == OP_LOAD:
+                push(memory.get(argument))
+            elif opcode == OP_CONST:
+                push(argument)
+            elif opcode == OP_STORE:
+                memory[argument] = pop()
+            elif opcode >= OP_ADD:
+                right = pop()
+                stack[-1] = functions[opcode](stack[-1], right)
+            elif opcode == OP_NEG:
+                stack[-1] = -stack[-1]
+            else:
+                stack[-1] = +stack[-1]
+
 
-def main():
-    import sys
-    text = open(sys.argv[1], 'r').read()
+class StackInterpreter(NodeWalker, Interpreter):
+    """The Interpreter on a NodeWalker, for trees of any depth, at a
+    higher cost per node."""
+    def enter_VarDecl(self, node):
+        # Do nothing
+        return ()
+
+    def enter_ProcedureDecl(self, node):
+        return ()
+
+    def leave_BinOp(self, node, results):
+        left, right = results
+        if node.op.type == PLUS:
+            return left + right
+        elif node.op.type == MINUS:
+            return left - right
+        elif node.op.type == MUL:
+            return left * right
+        elif node.op.type == INTEGER_DIV:
+            return left // right
+        elif node.op.type == FLOAT_DIV:
+            return float(left) / float(right)
+
+    def leave_Num(self, node, results):
+        return node.value
+
+    def leave_UnaryOp(self, node, results):
+        op = node.op.type
+        if op == PLUS:
+            return +results[0]
+        elif op == MINUS:
+            return -results[0]
+
+    def enter_Assign(self, node):
+        # the value only; the left-hand side is not evaluated
+        return (node.right,)
+
+    def leave_Assign(self, node, results):
+        var_name = node.left.value
+        self.GLOBAL_MEMORY[var_name] = results[0]
+
+    def leave_Var(self, node, results):
+        var_name = node.value
+        var_value = self.GLOBAL_MEMORY.get(var_name)
+        return var_value
+
+
+class CodeGenerator(SemanticAnalyzer):
+    """Checks a program and translates it into Interpreter code in a
+    single walk of the tree.
+
+    The checks are those of the SemanticAnalyzer, which raise the same
+    errors in the same order; visit(tree) returns the code for
+    Interpreter.execute(). Like the Interpreter, it leaves declarations
+    out: procedure bodies are checked, but generate no code.
+
+    Without a tracer, each name is looked up once per scope: a name that
+    was found stays found, as nothing is removed from a scope.
+    """
+    def __init__(self, tracer=None):
+        super(CodeGenerator, self).__init__(tracer)
+        self.code = []
+        # names known to resolve from the current scope
+        self.resolved = set()
+
+    def open_scope(self, scope_name):
+        SemanticAnalyzer.open_scope(self, scope_name)
+        self.resolved = set()
+
+    def close_scope(self):
+        SemanticAnalyzer.close_scope(self)
+        self.resolved = set()
+
+    def check_variable(self, node):
+        """SemanticAnalyzer.check_variable(); returns the name."""
+        name = node.value
+        if name not in self.resolved:
+            SemanticAnalyzer.check_variable(self, node)
+            # traced, every lookup is shown, as by the SemanticAnalyzer
+            if self.tracer is None:
+                self.resolved.add(name)
+        return name
 
-    lexer = Lexer(text)
-    parser = Parser(lexer)
-    tree = parser.parse()
+    def visit_Program(self, node):
+        SemanticAnalyzer.visit_Program(self, node)
+        return self.code
+
+    def visit_ProcedureDecl(self, node):
+        code = self.code
+        self.code = []
+        SemanticAnalyzer.visit_ProcedureDecl(self, node)
+        self.code = code
 
-    semantic_analyzer = SemanticAnalyzer()
+    def visit_Num(self, node):
+        self.code.append((OP_CONST, node.value))
+
+    def visit_Var(self, node):
+        self.code.append((OP_LOAD, self.check_variable(node)))
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+        self.code.append((UNARY_OPCODES[node.op.type], None))
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        right = node.right
+        opcode = BINARY_OPCODES[node.op.type]
+        if type(right) is Num:
+            self.code.append((opcode + RIGHT_CONST, right.value))
+        elif type(right) is Var:
+            self.code.append((opcode + RIGHT_LOAD, self.check_variable(right)))
+        else:
+            self.visit(right)
+            self.code.append((opcode, None))
+
+    def visit_Assign(self, node):
+        self.visit(node.right)
+        # the left-hand side is checked last, as in the SemanticAnalyzer
+        self.code.append((OP_STORE, self.check_variable(node.left)))
+
+
+def main():
+    import argparse
+    import os
+
+    argparser = argparse.ArgumentParser(
+        description='SPI - Simple Pascal Interpreter'
+    )
+    argparser.add_argument('inputfile', help='Pascal source file')
+    argparser.add_argument(
+        '--cache-dir',
+        default=os.environ.get('SPI_CACHE_DIR'),
+        help='cache parsed programs in this directory '
+             '(default: $SPI_CACHE_DIR, caching is off when unset)',
+    )
+    argparser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not use the parse cache',
+    )
+    argparser.add_argument(
+        '--lazy', action='store_true',
+        help='tokenize the whole source up front and parse procedure '
+             'bodies only when the semantic analysis first reaches them. '
+             'The parse cache holds fully parsed trees, so it is not used',
+    )
+    argparser.add_argument(
+        '--trace', action='store_true',
+        help='print the scopes and symbol table operations of the '
+             'semantic analysis',
+    )
+    argparser.add_argument(
+        '--run', action='store_true',
+        help='also run the program, checked and translated in a single '
+             'walk by the CodeGenerator, and print its variables',
+    )
+    args = argparser.parse_args()
+
+    if args.cache_dir and not args.no_cache and not args.lazy:
+        from parse_cache import ParseCache
+        tree = ParseCache(args.cache_dir).parse_file(args.inputfile)
+    else:
+        with open(args.inputfile, 'r') as source:
+            lexer = StreamLexer(source)
+            parser = Parser(lexer, lazy_procedures=args.lazy)
+            tree = parser.parse()
+
+    semantic_analyzer = (CodeGenerator if args.run else SemanticAnalyzer)(
+        tracer=PrintTracer() if args.trace else None
+    )
     try:
-        semantic_analyzer.visit(tree)
+        code = semantic_analyzer.visit(tree)
     except Exception as e:
         print(e)
-
-    # interpreter = Interpreter(tree)
-    # result = interpreter.interpret()
-    # print('')
-    # print('Run-time GLOBAL_MEMORY contents:')
-    # for k, v in sorted(interpreter.GLOBAL_MEMORY.items()):
-    #     print('%s = %s' % (k, v))
+        return
+
+    if args.run:
+        interpreter = Interpreter(tree)
+        try:
+            interpreter.execute(code)
+        except Exception as e:
+            # such as arithmetic on a variable that was never set
+            print(e)
+            return
+        print('')
+        print('Run-time GLOBAL_MEMORY contents:')
+        for k, v in sorted(interpreter.GLOBAL_MEMORY.items()):
+            print('%s = %s' % (k, v))
 
 
 if __name__ == '__main__':
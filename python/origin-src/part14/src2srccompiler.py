@@ -5,7 +5,7 @@ from collections import OrderedDict
 from spi import (
     Lexer,
     Parser,
-    NodeVisitor,
+    NodeWalker,
     BuiltinTypeSymbol,
     VarSymbol,
     ProcedureSymbol
@@ -67,27 +67,17 @@ class ScopedSymbolTable(object):
             return self.enclosing_scope.lookup(name)
 
 
-class SourceToSourceCompiler(NodeVisitor):
+class SourceToSourceCompiler(NodeWalker):
     def __init__(self):
         self.current_scope = None
         self.output = None
 
-    def visit_Block(self, node):
-        results = []
-        for declaration in node.declarations:
-            result = self.visit(declaration)
-            results.append(result)
-        results.append('\nbegin')
-        result = self.visit(node.compound_statement)
-        result = '   ' + result
-        results.append(result)
-        results.append('end')
+    def leave_Block(self, node, results):
+        # the declarations, then the compound statement
+        results[-1:] = ['\nbegin', '   ' + results[-1], 'end']
         return '\n'.join(results)
 
-    def visit_Program(self, node):
-        program_name = node.name
-        result_str = 'program %s0;\n' % program_name
-
+    def enter_Program(self, node):
         global_scope = ScopedSymbolTable(
             scope_name='global',
             scope_level=1,
@@ -96,40 +86,34 @@ class SourceToSourceCompiler(NodeVisitor):
         global_scope._init_builtins()
         self.current_scope = global_scope
 
-        # visit subtree
-        result_str += self.visit(node.block)
+    def leave_Program(self, node, results):
+        program_name = node.name
+        result_str = 'program %s0;\n' % program_name
+        result_str += results[0]
         result_str += '.'
         result_str += ' {END OF %s}' % program_name
         self.output = result_str
 
         self.current_scope = self.current_scope.enclosing_scope
 
-    def visit_Compound(self, node):
-        results = []
-        for child in node.children:
-            result = self.visit(child)
-            if result is None:
-                continue
-            results.append(result)
-        return '\n'.join(results)
-
-    def visit_NoOp(self, node):
-        pass
+    def leave_Compound(self, node, results):
+        return '\n'.join(result for result in results if result is not None)
 
-    def visit_BinOp(self, node):
-        t1 = self.visit(node.left)
-        t2 = self.visit(node.right)
+    def leave_BinOp(self, node, results):
+        t1, t2 = results
         return '%s %s %s' % (t1, node.op.value, t2)
 
-    def visit_ProcedureDecl(self, node):
+    def leave_UnaryOp(self, node, results):
+        return '%s%s' % (node.op.value, results[0])
+
+    def leave_Num(self, node, results):
+        return str(node.value)
+
+    def enter_ProcedureDecl(self, node):
         proc_name = node.proc_name
         proc_symbol = ProcedureSymbol(proc_name)
         self.current_scope.insert(proc_symbol)
 
-        result_str = 'procedure %s%s' % (
-            proc_name, self.current_scope.scope_level
-        )
-
         # Scope for parameters and local variables
         procedure_scope = ScopedSymbolTable(
             scope_name=proc_name,
@@ -138,10 +122,6 @@ class SourceToSourceCompiler(NodeVisitor):
         )
         self.current_scope = procedure_scope
 
-        if node.params:
-            result_str += '('
-
-        formal_params = []
         # Insert parameters into the procedure scope
         for param in node.params:
             param_type = self.current_scope.lookup(param.type_node.value)
@@ -149,10 +129,25 @@ class SourceToSourceCompiler(NodeVisitor):
             var_symbol = VarSymbol(param_name, param_type)
             self.current_scope.insert(var_symbol)
             proc_symbol.params.append(var_symbol)
-            scope_level = str(self.current_scope.scope_level)
-            formal_params.append(
-                '%s : %s' % (param_name + scope_level, param_type.name)
-            )
+
+        return (node.block_node,)
+
+    def leave_ProcedureDecl(self, node, results):
+        proc_name = node.proc_name
+        procedure_scope = self.current_scope
+        enclosing_scope = procedure_scope.enclosing_scope
+        proc_symbol = enclosing_scope.lookup(proc_name, current_scope_only=True)
+
+        result_str = 'procedure %s%s' % (proc_name, enclosing_scope.scope_level)
+
+        if node.params:
+            result_str += '('
+
+        scope_level = str(procedure_scope.scope_level)
+        formal_params = [
+            '%s : %s' % (var_symbol.name + scope_level, var_symbol.type.name)
+            for var_symbol in proc_symbol.params
+        ]
 
         result_str += '; '.join(formal_params)
         if node.params:
@@ -160,17 +155,17 @@ class SourceToSourceCompiler(NodeVisitor):
         result_str += ';'
         result_str += '\n'
 
-        result_str += self.visit(node.block_node)
+        result_str += results[0]
         result_str += '; {END OF %s}' % proc_name
 
         # indent procedure text
         result_str = '\n'.join('   ' + line for line in result_str.splitlines())
 
-        self.current_scope = self.current_scope.enclosing_scope
+        self.current_scope = enclosing_scope
 
         return result_str
 
-    def visit_VarDecl(self, node):
+    def enter_VarDecl(self, node):
         type_name = node.type_node.value
         type_symbol = self.current_scope.lookup(type_name)
 
@@ -187,15 +182,21 @@ class SourceToSourceCompiler(NodeVisitor):
             )
 
         self.current_scope.insert(var_symbol)
+        return ()
+
+    def leave_VarDecl(self, node, results):
+        var_name = node.var_node.value
         scope_level = str(self.current_scope.scope_level)
-        return '   var %s : %s;' % (var_name + scope_level , type_name)
+        return '   var %s : %s;' % (var_name + scope_level, node.type_node.value)
+
+    def enter_Assign(self, node):
+        return (node.right, node.left)
 
-    def visit_Assign(self, node):
-        t2 = self.visit(node.right)
-        t1 = self.visit(node.left)
+    def leave_Assign(self, node, results):
+        t2, t1 = results
         return '%s %s %s;' % (t1, ':=', t2)
 
-    def visit_Var(self, node):
+    def leave_Var(self, node, results):
         var_name = node.value
         var_symbol = self.current_scope.lookup(var_name)
         if var_symbol is None:
@@ -0,0 +1,1336 @@
+import glob
+import io
+import mmap
+import os
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Lexer constructor arguments selecting each scanning engine
+ENGINES = ({}, {'use_regex': True}, {'use_dfa': True})
+
+
+def pascal_sources():
+    for path in sorted(glob.glob(os.path.join(HERE, '*.pas'))):
+        with open(path) as f:
+            yield path, f.read()
+
+
+def tokenize(lexer):
+    from spi import EOF
+    tokens = []
+    while True:
+        token = lexer.get_next_token()
+        tokens.append((token.type, token.value))
+        if token.type == EOF:
+            return tokens
+
+
+def dump_ast(node, spans=True):
+    """Return a nested tuple describing an AST, for tree comparisons."""
+    from spi import AST, Token
+    if isinstance(node, Token):
+        return ('Token', node.type, node.value)
+    if isinstance(node, list):
+        return [dump_ast(child, spans) for child in node]
+    if not isinstance(node, AST):
+        return node
+    # private slots may back properties, such as the lazily parsed
+    # ProcedureDecl.block_node: read them through their public name
+    fields = sorted(
+        (name.lstrip('_'), dump_ast(getattr(node, name.lstrip('_')), spans))
+        for cls in type(node).__mro__
+        for name in getattr(cls, '__slots__', ())
+        if spans or name not in ('start', 'end')
+    )
+    return (type(node).__name__, fields)
+
+
+class LexerTestCase(unittest.TestCase):
+    def makeLexer(self, text, **kwargs):
+        from spi import Lexer
+        lexer = Lexer(text, **kwargs)
+        return lexer
+
+    def test_tokens(self):
+        from spi import (
+            INTEGER_CONST, REAL_CONST, MUL, INTEGER_DIV, FLOAT_DIV, PLUS, MINUS, LPAREN, RPAREN,
+            ASSIGN, DOT, ID, SEMI, BEGIN, END, PROCEDURE, COLON, COMMA
+        )
+        records = (
+            ('234', INTEGER_CONST, 234),
+            ('3.14', REAL_CONST, 3.14),
+            ('*', MUL, '*'),
+            ('DIV', INTEGER_DIV, 'DIV'),
+            ('/', FLOAT_DIV, '/'),
+            ('+', PLUS, '+'),
+            ('-', MINUS, '-'),
+            ('(', LPAREN, '('),
+            (')', RPAREN, ')'),
+            (':=', ASSIGN, ':='),
+            ('.', DOT, '.'),
+            ('number', ID, 'number'),
+            (';', SEMI, ';'),
+            (':', COLON, ':'),
+            (',', COMMA, ','),
+            ('BEGIN', BEGIN, 'BEGIN'),
+            ('end', END, 'END'),
+            ('PROCEDURE', PROCEDURE, 'PROCEDURE'),
+        )
+        for engine in ENGINES:
+            for text, tok_type, tok_val in records:
+                lexer = self.makeLexer(text, **engine)
+                token = lexer.get_next_token()
+                self.assertEqual(token.type, tok_type)
+                self.assertEqual(token.value, tok_val)
+
+    def test_engines_match_char_engine(self):
+        from bench import generate_program
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(20, 3)))
+        sources.append(('<edge cases>', '3. 12.5x1 a1b2:=:{c}{}(;,)+-*/'))
+        sources.append(('<comments>', 'a(**)b(*x*y)*)c(* { *)d{ (* }e( *f*)'))
+        for name, text in sources:
+            expected = tokenize(self.makeLexer(text))
+            for engine in ENGINES[1:]:
+                actual = tokenize(self.makeLexer(text, **engine))
+                self.assertEqual(actual, expected, (name, engine))
+
+    def test_long_lexemes(self):
+        from spi import ID, INTEGER_CONST, REAL_CONST
+        name = 'x' * 5000 + '1'
+        digits = '9' * 500
+        lexer = self.makeLexer('%s %s %s.%s;' % (name, digits, digits, digits))
+        token = lexer.get_next_token()
+        self.assertEqual((token.type, token.value), (ID, name))
+        token = lexer.get_next_token()
+        self.assertEqual((token.type, token.value), (INTEGER_CONST, int(digits)))
+        token = lexer.get_next_token()
+        self.assertEqual(token.type, REAL_CONST)
+        self.assertEqual(token.value, float(digits + '.' + digits))
+        self.assertEqual(lexer.current_char, ';')
+
+    def test_keywords_are_case_insensitive(self):
+        from spi import ID, BEGIN, INTEGER_DIV, PROCEDURE
+        for engine in ENGINES:
+            lexer = self.makeLexer('bEgIn Div procedure Procedures', **engine)
+            tokens = [lexer.get_next_token() for _ in range(4)]
+            self.assertEqual(
+                [(token.type, token.value) for token in tokens],
+                [(BEGIN, 'BEGIN'), (INTEGER_DIV, 'DIV'),
+                 (PROCEDURE, 'PROCEDURE'), (ID, 'Procedures')],
+            )
+
+    def test_identifiers_are_interned(self):
+        name = ''.join(['count', 'er'])
+        for engine in ENGINES:
+            lexer = self.makeLexer('counter := counter', **engine)
+            first = lexer.get_next_token()
+            lexer.get_next_token()
+            self.assertIs(first.value, lexer.get_next_token().value)
+            self.assertIs(first.value, sys.intern(name))
+        values = self.makeLexer('counter := counter').tokenize_all().values
+        self.assertIs(values[0], values[2])
+
+    def test_fixed_tokens_are_shared(self):
+        for engine in ENGINES:
+            lexer = self.makeLexer('a := b; c := (b + 1);', **engine)
+            tokens = [lexer.get_next_token() for _ in range(12)]
+            self.assertIs(tokens[1], tokens[5])  # :=
+            self.assertIs(tokens[3], tokens[11])  # ;
+            self.assertIsNot(tokens[2], tokens[7])  # b
+            self.assertIs(lexer.get_next_token(), lexer.get_next_token())  # EOF
+            with self.assertRaises(AttributeError):
+                tokens[0].line = 1
+            # shared tokens cannot be changed for all their users
+            with self.assertRaises(AttributeError):
+                tokens[1].value = '='
+            with self.assertRaises(AttributeError):
+                del tokens[1].type
+            self.assertEqual((tokens[1].type, tokens[1].value), ('ASSIGN', ':='))
+
+    def test_unterminated_comment(self):
+        from spi import StreamLexer
+        for text, start in (('a { b', 2), ('a (* b *', 2), ('a (*)', 2)):
+            lexers = [self.makeLexer(text, **engine) for engine in ENGINES]
+            lexers.append(StreamLexer(io.StringIO(text), chunk_size=2))
+            for lexer in lexers:
+                lexer.get_next_token()
+                with self.assertRaises(Exception) as cm:
+                    lexer.get_next_token()
+                self.assertEqual(
+                    str(cm.exception),
+                    'Unterminated comment at position %d' % start,
+                )
+            with self.assertRaises(Exception):
+                self.makeLexer(text).tokenize_all()
+
+    def test_invalid_character(self):
+        for engine in ENGINES:
+            lexer = self.makeLexer('a := 1 ? 2', **engine)
+            for _ in range(3):
+                lexer.get_next_token()
+            with self.assertRaises(Exception):
+                lexer.get_next_token()
+            self.assertEqual(lexer.pos, 7)
+
+
+class LexgenTestCase(unittest.TestCase):
+    def test_longest_match_and_priority(self):
+        from lexgen import generate
+        tables = generate((
+            ('IF', r'if'),
+            ('ID', r'\a\w*'),
+            ('NUM', r'\d+(\.\d+)?'),
+            ('OP', r'[+\-]|\*\*?'),
+        ))
+        for text, expected in (
+            ('if', ('IF', 2)),
+            ('iffy', ('ID', 4)),
+            ('x\u00e9\u0661 ', ('ID', 3)),
+            ('12.5.', ('NUM', 4)),
+            ('12.', ('NUM', 2)),
+            ('**', ('OP', 2)),
+            ('-', ('OP', 1)),
+            ('?', (None, 0)),
+        ):
+            self.assertEqual(tables.match(text, 0), expected, text)
+
+    def test_bad_pattern(self):
+        from lexgen import generate, LexgenError
+        for pattern in ('(ab', 'a)', '*a', '[ab'):
+            with self.assertRaises(LexgenError):
+                generate((('X', pattern),))
+
+    def test_regex_and_literal(self):
+        import re
+        from lexgen import generate, regex, literal, LexgenError
+        for pattern, texts in (
+            (r'\a\w*', ('x1', 'x\u00e9\u0661', '_a', '1a', 'a_b')),
+            (r'\d+(\.\d+)?', ('12.5.', '12.', '.5')),
+            (r'[^*)]+|\*\*?', ('ab*', ')', '***', '+.[')),
+            (r'\[\]\.', ('[].', '[]x')),
+        ):
+            tables = generate((('X', pattern),))
+            compiled = re.compile(regex(pattern))
+            for text in texts:
+                name, end = tables.match(text, 0)
+                m = compiled.match(text)
+                self.assertEqual(m.end() if m else 0, end if name else 0, (pattern, text))
+        self.assertEqual(regex('a(b|c)'), 'a(?:b|c)')
+        with self.assertRaises(LexgenError):
+            regex(r'[\w]')
+        self.assertEqual([literal(p) for p in (':=', r'\(', 'a|b', 'a*', r'\d')],
+                         [':=', '(', None, None, None])
+
+    def test_token_table(self):
+        from lexgen import literal
+        from spi import TOKEN_TABLE, FIXED_TOKENS, _MASTER_RE, EOF
+        kinds = [kind for kind, _ in TOKEN_TABLE
+                 if kind not in ('SKIP', 'UNTERMINATED_COMMENT')]
+        # the fixed lexemes and the regex engine come from the table
+        self.assertEqual(
+            dict((lexeme, token.type) for lexeme, token in FIXED_TOKENS.items()),
+            dict((literal(pattern), kind) for kind, pattern in TOKEN_TABLE
+                 if kind in kinds and literal(pattern) is not None),
+        )
+        self.assertEqual(sorted(_MASTER_RE.groupindex), sorted(kinds + [EOF]))
+
+
+class BytesLexerTestCase(unittest.TestCase):
+    def test_same_tokens_as_lexer(self):
+        from bench import generate_program
+        from spi import Lexer, BytesLexer
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(5, 2)))
+        sources.append(('<edge cases>', '3. 12.5x1 a1b2:=:{c}{}(;,)+-*/'))
+        sources.append(('<comments>', 'a(**)b(*x*y)*)c(* { *)d{ (* }e( *f*)'))
+        for name, text in sources:
+            expected = tokenize(Lexer(text))
+            data = text.encode('ascii')
+            for source in (data, bytearray(data), memoryview(data)):
+                self.assertEqual(tokenize(BytesLexer(source)), expected, name)
+            tokens = BytesLexer(data).tokenize_all()
+            self.assertEqual(list(tokens.starts), list(Lexer(text).tokenize_all().starts))
+
+    def test_errors(self):
+        from spi import BytesLexer
+        for data, message in (
+            (b'a := 1 ? 2', 'Invalid character at position 7'),
+            (b'a := 1 \xc3\xa9', 'Invalid character at position 7'),
+            (b'a (* b *', 'Unterminated comment at position 2'),
+            (b'a { b', 'Unterminated comment at position 2'),
+        ):
+            with self.assertRaises(Exception) as cm:
+                tokenize(BytesLexer(data))
+            self.assertEqual(str(cm.exception), message)
+
+
+class TokenArrayTestCase(unittest.TestCase):
+    def test_tokenize_all(self):
+        from bench import generate_program
+        from spi import Lexer, StreamLexer, TOKEN_TYPES
+        text = generate_program(5, 2)
+        expected = tokenize(Lexer(text))
+        for lexer in (Lexer(text), StreamLexer(io.StringIO(text), chunk_size=5)):
+            tokens = lexer.tokenize_all()
+            self.assertEqual(tokens.types.typecode, 'B')
+            self.assertEqual(
+                [(TOKEN_TYPES[code], value)
+                 for code, value in zip(tokens.types, tokens.values)],
+                expected,
+            )
+            for start, (_, value) in zip(tokens.starts, expected):
+                if isinstance(value, str):
+                    self.assertEqual(text[start:start + len(value)].upper(),
+                                     value.upper())
+
+    def test_token_spans(self):
+        from bench import generate_program
+        from spi import Lexer, StreamLexer, BytesLexer, collect_tokens
+        text = generate_program(5, 2) + '  { trailing comment }\n'
+        expected = Lexer(text).tokenize_all()
+        spellings = [text[start:end] for start, end in zip(expected.starts, expected.ends)]
+        self.assertEqual(spellings[:4], ['PROGRAM', 'Generated', ';', 'VAR'])
+        self.assertEqual(spellings[-1], '')
+        self.assertEqual(expected.starts[-1], len(text))
+        lexers = [Lexer(text, **engine) for engine in ENGINES]
+        lexers.append(StreamLexer(io.StringIO(text), chunk_size=5))
+        lexers.append(BytesLexer(text.encode('ascii')))
+        for lexer in lexers:
+            tokens = collect_tokens(lexer)
+            self.assertEqual(list(tokens.starts), list(expected.starts))
+            self.assertEqual(list(tokens.ends), list(expected.ends))
+
+    def test_cursor(self):
+        from spi import Lexer, TokenCursor, ID, ASSIGN, SEMI, EOF
+        cursor = TokenCursor(Lexer('a := b;').tokenize_all())
+        self.assertEqual(cursor.peek(3).type, SEMI)
+        self.assertEqual(cursor.peek_type(10), EOF)
+        self.assertEqual(
+            [cursor.get_next_token().type for _ in range(6)],
+            [ID, ASSIGN, ID, SEMI, EOF, EOF],
+        )
+
+    def test_parser_over_cursor(self):
+        from bench import generate_program
+        from spi import Lexer, Parser, TokenCursor
+        for name, text in list(pascal_sources()) + [
+            ('<generated>', generate_program(5, 2))
+        ]:
+            expected = dump_ast(Parser(Lexer(text)).parse())
+            cursor = TokenCursor(Lexer(text).tokenize_all())
+            self.assertEqual(dump_ast(Parser(cursor).parse()), expected, name)
+
+
+class ParallelLexerTestCase(unittest.TestCase):
+    def test_split_points(self):
+        from parallel_lexer import split_points
+        text = 'a := 1; { long comment here } b := 2; (* more *) c := 3'
+        for parts in range(2, 20):
+            for point in split_points(text, parts):
+                self.assertTrue(text[point].isspace())
+                self.assertFalse(0 <= point - text.find('{') < 21)
+                self.assertFalse(0 <= point - text.find('(*') < 10)
+        self.assertEqual(split_points('a { b c d', 3), [])
+
+    def test_parallel_tokenize(self):
+        from bench import generate_commented_program
+        from parallel_lexer import parallel_tokenize
+        from spi import Lexer, Parser, TokenCursor
+        text = generate_commented_program(5, comment_size=50)
+        expected = Lexer(text).tokenize_all()
+        tokens = parallel_tokenize(text, workers=4, min_chunk_size=100)
+        self.assertEqual(list(tokens.types), list(expected.types))
+        self.assertEqual(tokens.values, expected.values)
+        self.assertEqual(list(tokens.starts), list(expected.starts))
+        self.assertEqual(list(tokens.ends), list(expected.ends))
+        self.assertEqual(
+            dump_ast(Parser(TokenCursor(tokens)).parse()),
+            dump_ast(Parser(Lexer(text)).parse()),
+        )
+
+    def test_error_position(self):
+        from parallel_lexer import parallel_tokenize
+        text = 'a := 1;\n' * 50 + 'b := ?'
+        with self.assertRaises(Exception) as cm:
+            parallel_tokenize(text, workers=4, min_chunk_size=10)
+        self.assertEqual(
+            str(cm.exception), 'Invalid character at position %d' % (len(text) - 1)
+        )
+
+
+class IncrementalLexerTestCase(unittest.TestCase):
+    def assertRelexed(self, text, offset, deleted, inserted):
+        from incremental_lexer import relex
+        from spi import Lexer
+        tokens = Lexer(text).tokenize_all()
+        new_text, new_tokens, changed = relex(text, tokens, offset, deleted, inserted)
+        self.assertEqual(new_text, text[:offset] + inserted + text[offset + deleted:])
+        expected = Lexer(new_text).tokenize_all()
+        self.assertEqual(list(new_tokens.types), list(expected.types))
+        self.assertEqual(new_tokens.values, expected.values)
+        self.assertEqual(list(new_tokens.starts), list(expected.starts))
+        self.assertEqual(list(new_tokens.ends), list(expected.ends))
+        return changed
+
+    def test_local_edit(self):
+        from bench import generate_program
+        text = generate_program(20, 3)
+        offset = text.index('Proc10(') + len('Proc10')
+        first, old_stop, new_stop = self.assertRelexed(text, offset, 0, '1')
+        self.assertEqual((old_stop - first, new_stop - first), (1, 1))
+        offset = text.index('k := 10', offset)
+        first, old_stop, new_stop = self.assertRelexed(text, offset, 1, 'kk; a')
+        self.assertEqual((old_stop - first, new_stop - first), (2, 4))
+
+    def test_edits(self):
+        from incremental_lexer import relex
+        from spi import Lexer
+        text = 'a := b1 + 3.5; { c } (* d *) e:f, 10 DIV g.'
+        tokens = Lexer(text).tokenize_all()
+        for offset in range(len(text) + 1):
+            for deleted in range(0, min(4, len(text) - offset) + 1):
+                for inserted in ('', ' ', 'x', '9', '.', '=', ':', '}', '{ z }', '(*'):
+                    new_text = text[:offset] + inserted + text[offset + deleted:]
+                    try:
+                        Lexer(new_text).tokenize_all()
+                    except Exception:
+                        with self.assertRaises(Exception):
+                            relex(text, tokens, offset, deleted, inserted)
+                    else:
+                        self.assertRelexed(text, offset, deleted, inserted)
+
+
+class ParserTestCase(unittest.TestCase):
+    def test_precedence_climbing_builds_same_tree(self):
+        from bench import generate_program, generate_expression_program
+        from spi import Lexer, Parser
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(5, 2)))
+        sources.append(('<expressions>', generate_expression_program(50, 12)))
+        for name, text in sources:
+            expected = dump_ast(Parser(Lexer(text)).parse())
+            parser = Parser(Lexer(text), precedence_climbing=True)
+            self.assertEqual(dump_ast(parser.parse()), expected, name)
+
+    def test_stack_parser_builds_same_tree(self):
+        from bench import generate_program, generate_expression_program
+        from spi import Lexer, Parser, StackParser
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(5, 2)))
+        sources.append(('<expressions>', generate_expression_program(50, 12)))
+        for name, text in sources:
+            expected = dump_ast(Parser(Lexer(text)).parse())
+            self.assertEqual(dump_ast(StackParser(Lexer(text)).parse()), expected, name)
+
+    def test_node_spans(self):
+        from spi import Lexer, Parser, LineIndex
+        text = (
+            'PROGRAM Spans;\n'
+            'VAR x : INTEGER;\n'
+            'PROCEDURE P(a : REAL);\n'
+            'BEGIN END;\n'
+            'BEGIN\n'
+            '   x := -(1 + 2) * x;\n'
+            '   ;\n'
+            'END.  '
+        )
+        tree = Parser(Lexer(text)).parse()
+        self.assertEqual(text[tree.start:tree.end], text.rstrip())
+        var_decl, proc_decl = tree.block.declarations
+        self.assertEqual(text[var_decl.start:var_decl.end], 'x : INTEGER')
+        self.assertEqual(text[proc_decl.start:proc_decl.end],
+                         'PROCEDURE P(a : REAL);\nBEGIN END')
+        param = proc_decl.params[0]
+        self.assertEqual(text[param.start:param.end], 'a : REAL')
+        compound = tree.block.compound_statement
+        self.assertEqual(text[tree.block.start:tree.block.end], text[var_decl.start:compound.end])
+        assign, empty, last = compound.children
+        self.assertEqual(text[assign.start:assign.end], 'x := -(1 + 2) * x')
+        self.assertEqual(text[assign.right.left.start:assign.right.left.end], '-(1 + 2)')
+        # parentheses are part of the span of the expression they enclose
+        self.assertEqual(text[assign.right.left.expr.start:assign.right.left.expr.end],
+                         '(1 + 2)')
+        self.assertEqual(text[assign.right.left.expr.left.start:assign.right.left.expr.left.end],
+                         '1')
+        self.assertEqual(empty.start, empty.end)
+
+        lines = LineIndex(text)
+        self.assertEqual(lines.line_col(tree.start), (1, 1))
+        self.assertEqual(lines.line_col(assign.start), (6, 4))
+        self.assertEqual(lines.line_col(assign.right.right.start), (6, 20))
+        self.assertEqual(lines.line_col(tree.end), (8, 5))
+
+    def test_without_spans(self):
+        from bench import ast_nodes
+        from spi import Lexer, Parser, ParserError, TokenCursor
+        for name, text in pascal_sources():
+            expected = dump_ast(Parser(Lexer(text)).parse(), spans=False)
+            tokens = Lexer(text).tokenize_all()
+            for parser in (
+                Parser(Lexer(text), spans=False),
+                Parser(TokenCursor(tokens, spans=False), spans=False),
+                Parser(TokenCursor(tokens, spans=False), spans=False,
+                       lazy_procedures=True),
+            ):
+                tree = parser.parse()
+                self.assertEqual(dump_ast(tree, spans=False), expected, name)
+                starts = {node.start for node in ast_nodes(tree)}
+                self.assertEqual(starts, {None}, name)
+
+        text = 'PROGRAM Test; BEGIN a := (1 + 2 END.'
+        with self.assertRaises(ParserError) as spanned:
+            Parser(TokenCursor(Lexer(text).tokenize_all())).parse()
+        with self.assertRaises(ParserError) as plain:
+            Parser(TokenCursor(Lexer(text).tokenize_all(), spans=False),
+                   spans=False).parse()
+        self.assertEqual(plain.exception.position, text.index('END'))
+        self.assertEqual(plain.exception.position, spanned.exception.position)
+
+    def test_stack_parser_deep_nesting(self):
+        from spi import Lexer, Parser, StackParser, Compound, UnaryOp, Num
+        depth = sys.getrecursionlimit() * 10
+        text = 'PROGRAM Deep; BEGIN a := %s1%s + %s2; %s END.' % (
+            '(' * depth, ')' * depth, '-' * depth, 'BEGIN ' * depth + 'END ' * depth)
+        with self.assertRaises(RecursionError):
+            Parser(Lexer(text)).parse()
+        tree = StackParser(Lexer(text)).parse()
+        assign, node = tree.block.compound_statement.children
+        self.assertIsInstance(assign.right.left, Num)
+        unary = assign.right.right
+        for _ in range(depth):
+            self.assertIsInstance(unary, UnaryOp)
+            unary = unary.expr
+        self.assertEqual(unary.value, 2)
+        for _ in range(depth):
+            self.assertIsInstance(node, Compound)
+            node = node.children[0]
+
+    def test_nodes_have_slots(self):
+        from spi import Lexer, Parser
+        tree = Parser(Lexer('PROGRAM P; VAR a : INTEGER; BEGIN a := -(1 + a) END.')).parse()
+        decl, = tree.block.declarations
+        assign, = tree.block.compound_statement.children
+        nodes = [tree, tree.block, decl, decl.var_node, decl.type_node, assign,
+                 assign.left, assign.right, assign.right.expr,
+                 assign.right.expr.left, assign.right.expr.right]
+        for node in nodes:
+            self.assertFalse(hasattr(node, '__dict__'), type(node).__name__)
+        # the old attribute names are still there
+        self.assertIs(assign.token, assign.op)
+        self.assertIs(assign.right.token, assign.right.op)
+        self.assertIs(assign.right.expr.token, assign.right.expr.op)
+        self.assertEqual(assign.right.expr.left.value, 1)
+        self.assertEqual(assign.left.value, 'a')
+        self.assertEqual(decl.type_node.value, 'INTEGER')
+
+    def test_lazy_procedures_build_same_tree(self):
+        from bench import generate_program
+        from spi import Lexer, Parser
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(5, 2)))
+        for name, text in sources:
+            expected = dump_ast(Parser(Lexer(text)).parse())
+            for climbing in (False, True):
+                parser = Parser(
+                    Lexer(text), precedence_climbing=climbing, lazy_procedures=True)
+                self.assertEqual(dump_ast(parser.parse()), expected, name)
+
+    def test_lazy_procedures_parse_on_first_access(self):
+        from spi import Lexer, Parser, Block, ProcedureDecl
+        text = """\
+PROGRAM Lazy;
+PROCEDURE Outer;
+   PROCEDURE Inner;
+   BEGIN BEGIN a := 1 END END;
+BEGIN END;
+PROCEDURE Broken;
+BEGIN a := 1 + END;
+BEGIN END.
+"""
+        tree = Parser(Lexer(text), lazy_procedures=True).parse()
+        outer, broken = tree.block.declarations
+        self.assertNotIsInstance(outer._block_node, Block)
+        self.assertIsInstance(outer.block_node, Block)
+        self.assertIs(outer.block_node, outer.block_node)
+        inner, = outer.block_node.declarations
+        self.assertIsInstance(inner, ProcedureDecl)
+        self.assertEqual(inner.proc_name, 'Inner')
+        self.assertEqual(len(inner.block_node.compound_statement.children), 1)
+        with self.assertRaises(Exception) as cm:
+            broken.block_node
+        self.assertEqual(cm.exception.position, text.index('END;\nBEGIN END.'))
+
+    def test_lazy_procedures_check_every_body(self):
+        from spi import (
+            Lexer, Parser, SemanticAnalyzer, StackSemanticAnalyzer, CodeGenerator,
+        )
+        with open(os.path.join(HERE, 'dupiderror.pas')) as f:
+            duplicate = f.read()
+        undeclared = """
+PROGRAM Lazy;
+VAR x : INTEGER;
+PROCEDURE Unused;
+BEGIN
+   zzz := x
+END;
+BEGIN END.
+"""
+        # the analyzers force and check every lazily parsed body, used
+        # or not, with the same errors as for an eager tree
+        for text, message in (
+            (duplicate, "Error: Duplicate identifier 'a' found"),
+            (undeclared, "Error: Symbol(identifier) not found 'zzz'"),
+        ):
+            for analyzer_class in (SemanticAnalyzer, StackSemanticAnalyzer, CodeGenerator):
+                tree = Parser(Lexer(text), lazy_procedures=True).parse()
+                with self.assertRaises(Exception) as cm:
+                    analyzer_class().visit(tree)
+                self.assertEqual(str(cm.exception), message)
+
+    def test_lazy_procedures_unterminated_body(self):
+        from spi import Lexer, Parser
+        text = 'PROGRAM Lazy; PROCEDURE P; BEGIN BEGIN END; BEGIN END.'
+        with self.assertRaises(Exception) as cm:
+            Parser(Lexer(text), lazy_procedures=True).parse()
+        with self.assertRaises(Exception) as eager:
+            Parser(Lexer(text)).parse()
+        self.assertEqual(str(cm.exception), str(eager.exception))
+
+    def test_hash_consing_builds_same_tree(self):
+        from bench import generate_program, generate_expression_program
+        from spi import Lexer, Parser, StackParser, HashConsingNodeFactory
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(5, 2)))
+        sources.append(('<expressions>', generate_expression_program(20, 12)))
+        for name, text in sources:
+            # spans included: shared nodes are built without any
+            expected = dump_ast(Parser(Lexer(text), spans=False).parse())
+            for parser in (
+                Parser(Lexer(text), node_factory=HashConsingNodeFactory(),
+                       spans=False),
+                Parser(Lexer(text), precedence_climbing=True,
+                       node_factory=HashConsingNodeFactory(), spans=False),
+                Parser(Lexer(text), lazy_procedures=True,
+                       node_factory=HashConsingNodeFactory(), spans=False),
+                StackParser(Lexer(text), node_factory=HashConsingNodeFactory(),
+                            spans=False),
+            ):
+                self.assertEqual(dump_ast(parser.parse()), expected, name)
+
+    def test_hash_consing_without_spans(self):
+        from spi import Lexer, Parser, StackParser, NodeFactory, HashConsingNodeFactory
+        # the two a + 1 would be one node, which cannot have both spans
+        text = 'PROGRAM T; VAR a:INTEGER; BEGIN a := a + 1; a := a + 1 END.'
+        for parser_class in (Parser, StackParser):
+            with self.assertRaises(ValueError):
+                parser_class(Lexer(text), node_factory=HashConsingNodeFactory())
+        tree = Parser(Lexer(text), node_factory=NodeFactory()).parse()
+        self.assertEqual(dump_ast(tree), dump_ast(Parser(Lexer(text)).parse()))
+        first, second = tree.block.compound_statement.children
+        self.assertEqual(text[first.right.start:first.right.end], 'a + 1')
+        self.assertEqual(second.start, text.rindex('a := a + 1'))
+        self.assertEqual(text[second.right.start:second.right.end], 'a + 1')
+
+    def test_hash_consing_shares_nodes(self):
+        from spi import Lexer, Parser, HashConsingNodeFactory
+        text = 'PROGRAM P; BEGIN a := 10 * b + 1; c := -(10 * b) + 1.0; d := 10 * c END.'
+        tree = Parser(Lexer(text), node_factory=HashConsingNodeFactory(),
+                      spans=False).parse()
+        first, second, third = tree.block.compound_statement.children
+        self.assertIs(first.right.left, second.right.left.expr)  # 10 * b
+        self.assertIsNot(first.right.right, second.right.right)  # 1 and 1.0
+        self.assertIs(first.right.left.left, third.right.left)  # 10
+        self.assertIsNot(first.right.left, third.right)  # 10 * b and 10 * c
+        self.assertIs(second.left, third.right.right)  # c
+
+    def test_recovering_parser_valid_program(self):
+        from bench import generate_program
+        from spi import Lexer, Parser, RecoveringParser
+        for name, text in list(pascal_sources()) + [
+            ('<generated>', generate_program(5, 2))
+        ]:
+            tree, errors = RecoveringParser(Lexer(text)).parse()
+            self.assertEqual(errors, [])
+            self.assertEqual(dump_ast(tree), dump_ast(Parser(Lexer(text)).parse()))
+
+    def test_recovering_parser_reports_all_errors(self):
+        from spi import Lexer, RecoveringParser, TokenCursor, Assign, NoOp
+        text = """\
+PROGRAM Test;
+VAR a : INTEGER;
+    b : ;
+    c, : REAL;
+PROCEDURE P(x INTEGER);
+BEGIN
+   a := 10 * ;
+   b := (1 + 2;
+   c := 3
+END;
+BEGIN
+   a := 1 2;
+   b := a
+END.
+"""
+        expected = [
+            (text.index('b : ;') + 4, 'REAL', 'SEMI'),
+            (text.index(', :') + 2, 'ID', 'COLON'),
+            (text.index('x INTEGER') + 2, 'COLON', 'INTEGER'),
+            (text.index('* ;') + 2, 'ID', 'SEMI'),
+            (text.index('2;') + 1, 'RPAREN', 'SEMI'),
+            (text.index('1 2') + 2, 'SEMI', 'INTEGER_CONST'),
+        ]
+        for lexer in (Lexer(text), TokenCursor(Lexer(text).tokenize_all())):
+            tree, errors = RecoveringParser(lexer).parse()
+            self.assertEqual(
+                [(e.position, e.expected, e.token.type) for e in errors], expected
+            )
+            procedure = tree.block.declarations[-1]
+            self.assertEqual(procedure.proc_name, 'P')
+            self.assertEqual(
+                [type(node) for node in procedure.block_node.compound_statement.children],
+                [NoOp, NoOp, Assign],
+            )
+            self.assertEqual(len(tree.block.compound_statement.children), 2)
+
+    def test_recovering_parser_missing_end(self):
+        from spi import Lexer, RecoveringParser, END
+        tree, errors = RecoveringParser(Lexer('PROGRAM T; BEGIN a := 1 .')).parse()
+        self.assertEqual([(e.expected, e.token.type) for e in errors], [(END, 'DOT')])
+        self.assertEqual(len(tree.block.compound_statement.children), 1)
+
+    def test_syntax_errors(self):
+        from spi import Lexer, Parser, StackParser
+        for expr in ('10 *', '1 (1 + 2)', '(1 + 2', '- ;', '1 + + '):
+            text = 'PROGRAM Test; BEGIN a := %s END.' % expr
+            with self.assertRaises(Exception):
+                Parser(Lexer(text)).parse()
+            with self.assertRaises(Exception):
+                Parser(Lexer(text), precedence_climbing=True).parse()
+            with self.assertRaises(Exception):
+                StackParser(Lexer(text)).parse()
+
+
+class StreamLexerTestCase(unittest.TestCase):
+    def test_chunk_boundaries(self):
+        from bench import generate_program
+        from spi import Lexer, StreamLexer
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(5, 2)))
+        for name, text in sources:
+            expected = tokenize(Lexer(text))
+            for chunk_size in (1, 2, 3, 7, 64, 4096):
+                lexer = StreamLexer(io.StringIO(text), chunk_size=chunk_size)
+                self.assertEqual(tokenize(lexer), expected, (name, chunk_size))
+                self.assertLessEqual(len(lexer.text), chunk_size + 64)
+
+    def test_mmap_source(self):
+        from spi import Lexer, StreamLexer
+        text = 'a := 3.14; { \u00e9t\u00e9 } bb := a DIV 2.'
+        with tempfile.TemporaryFile() as f:
+            f.write(text.encode('utf-8'))
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                lexer = StreamLexer(m, chunk_size=3)
+                self.assertEqual(tokenize(lexer), tokenize(Lexer(text)))
+
+    def test_tokenize_all(self):
+        from bench import generate_program
+        from spi import Lexer, StreamLexer
+        text = generate_program(3, 2)
+        expected = Lexer(text).tokenize_all()
+        for source in (io.StringIO(text), io.BytesIO(text.encode('utf-8'))):
+            lexer = StreamLexer(source, chunk_size=7)
+            for _ in range(5):
+                lexer.get_next_token()
+            # the rest of the stream, at its offsets in the whole source
+            tokens = lexer.tokenize_all()
+            for name in ('types', 'values', 'starts', 'ends'):
+                self.assertEqual(
+                    list(getattr(tokens, name)), list(getattr(expected, name))[5:])
+
+    def test_invalid_character(self):
+        from spi import StreamLexer
+        lexer = StreamLexer(io.StringIO('a := 1 ? 2'), chunk_size=2)
+        for _ in range(3):
+            lexer.get_next_token()
+        with self.assertRaises(Exception):
+            lexer.get_next_token()
+        self.assertEqual(lexer.offset + lexer.pos, 7)
+
+
+class ParseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def write_source(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_hit_skips_parsing(self):
+        from unittest import mock
+        from parse_cache import ParseCache
+        from spi import Lexer, Parser
+        cache = ParseCache(os.path.join(self.directory, 'cache'))
+        for name, text in pascal_sources():
+            path = self.write_source('source.pas', text)
+            expected = dump_ast(Parser(Lexer(text)).parse())
+            self.assertEqual(dump_ast(cache.parse_file(path)), expected, name)
+            with mock.patch('parse_cache.Parser') as parser:
+                tree = cache.parse_file(path)
+            parser.assert_not_called()
+            self.assertEqual(dump_ast(tree), expected, name)
+
+    def test_miss_on_change(self):
+        from unittest import mock
+        from parse_cache import ParseCache
+        cache = ParseCache(os.path.join(self.directory, 'cache'))
+        path = self.write_source('source.pas', 'PROGRAM A; BEGIN END.')
+        key = cache.file_key(path)
+        cache.parse_file(path)
+        self.assertIsNotNone(cache.get(key))
+        self.write_source('source.pas', 'PROGRAM B; BEGIN END.')
+        self.assertNotEqual(cache.file_key(path), key)
+        self.assertEqual(cache.parse_file(path).name, 'B')
+        from spi import PARSER_VERSION
+        with mock.patch('parse_cache.PARSER_VERSION', PARSER_VERSION + 1):
+            self.assertIsNone(cache.get(cache.file_key(path)))
+
+    def test_source_read_once(self):
+        from unittest import mock
+        from parse_cache import ParseCache
+        cache = ParseCache(os.path.join(self.directory, 'cache'))
+        path = self.write_source('source.pas', 'PROGRAM A; BEGIN END.')
+        key = cache.file_key(path)
+        get = cache.get
+
+        def rewrite(key):
+            # the file changes after it was hashed, before it is parsed
+            self.write_source('source.pas', 'PROGRAM B; BEGIN END.')
+            return get(key)
+
+        with mock.patch.object(cache, 'get', rewrite):
+            self.assertEqual(cache.parse_file(path).name, 'A')
+        self.assertEqual(cache.get(key).name, 'A')
+        self.assertEqual(cache.parse_file(path).name, 'B')
+
+    def test_eviction(self):
+        from parse_cache import ParseCache
+        cache = ParseCache(os.path.join(self.directory, 'cache'))
+        paths = [
+            self.write_source('%d.pas' % i, 'PROGRAM P%d; BEGIN END.' % i)
+            for i in range(3)
+        ]
+        keys = [cache.file_key(path) for path in paths]
+        cache.parse_file(paths[0])
+        entry_size = os.path.getsize(cache.entry_path(keys[0]))
+        cache.max_size = 2 * entry_size + entry_size // 2
+        cache.parse_file(paths[1])
+        # entries are ordered by mtime; make the first one the most recent
+        os.utime(cache.entry_path(keys[1]), (0, 0))
+        self.assertIsNotNone(cache.get(keys[0]))
+        cache.parse_file(paths[2])
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_untrusted_entries(self):
+        import pickle
+        from unittest import mock
+        from parse_cache import ParseCache
+        cache = ParseCache(os.path.join(self.directory, 'cache'))
+        if hasattr(os, 'getuid'):
+            self.assertEqual(os.stat(cache.directory).st_mode & 0o777, 0o700)
+        path = self.write_source('source.pas', 'PROGRAM A; BEGIN END.')
+        key = cache.file_key(path)
+        # a planted pickle is never unpickled
+        with open(cache.entry_path(key), 'wb') as f:
+            pickle.dump(mock.sentinel.payload, f)
+        with mock.patch('pickle.load') as load, mock.patch('pickle.loads') as loads:
+            self.assertIsNone(cache.get(key))
+        load.assert_not_called()
+        loads.assert_not_called()
+        self.assertEqual(cache.parse_file(path).name, 'A')
+        self.assertIsNotNone(cache.get(key))
+        if hasattr(os, 'getuid'):
+            # nor is an entry owned by another user
+            with mock.patch('os.getuid', return_value=os.getuid() + 1):
+                self.assertIsNone(cache.get(key))
+
+
+class FlatASTTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        from bench import generate_program, generate_expression_program
+        from flat_ast import from_ast, to_ast
+        from spi import Lexer, Parser
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(5, 2)))
+        sources.append(('<expressions>', generate_expression_program(20, 12)))
+        for name, text in sources:
+            tree = Parser(Lexer(text)).parse()
+            flat = from_ast(tree)
+            self.assertEqual(dump_ast(to_ast(flat)), dump_ast(tree), name)
+            lazy_tree = Parser(Lexer(text), lazy_procedures=True).parse()
+            self.assertEqual(dump_ast(to_ast(from_ast(lazy_tree))), dump_ast(tree), name)
+
+    def test_constants_are_pooled(self):
+        from flat_ast import from_ast, KINDS
+        from spi import Lexer, Parser, Var
+        text = 'PROGRAM P; BEGIN a := a + 1; b := a + 1 END.'
+        flat = from_ast(Parser(Lexer(text)).parse())
+        values = [token.value for token in flat.constants if not isinstance(token, str)]
+        self.assertEqual(sorted(map(str, values)), ['+', '1', ':=', 'a', 'b'])
+        self.assertEqual(flat.kind(flat.root).__name__, 'Program')
+        var_count = sum(1 for kind in flat.kinds if KINDS[kind] is Var)
+        self.assertEqual(var_count, 4)
+
+    def test_missing_names(self):
+        from ast_format import dumps, loads
+        from flat_ast import from_ast, to_ast
+        from spi import Lexer, RecoveringParser
+        tree, errors = RecoveringParser(Lexer('PROGRAM ; BEGIN a := 1 END.')).parse()
+        self.assertTrue(errors)
+        self.assertIsNone(tree.name)
+        flat = from_ast(tree)
+        self.assertIsNone(flat.tree().name)
+        self.assertEqual(dump_ast(to_ast(flat)), dump_ast(tree))
+        self.assertEqual(dump_ast(loads(dumps(tree))), dump_ast(tree))
+
+        text = 'PROGRAM P; PROCEDURE ; BEGIN END; BEGIN a := 1 END.'
+        tree, errors = RecoveringParser(Lexer(text)).parse()
+        self.assertTrue(errors)
+        flat = from_ast(tree)
+        self.assertIsNone(flat.tree().block.declarations[0].proc_name)
+        self.assertEqual(dump_ast(to_ast(flat)), dump_ast(tree))
+        self.assertEqual(dump_ast(loads(dumps(flat))), dump_ast(tree))
+
+    def test_deep_tree(self):
+        from flat_ast import from_ast, to_ast
+        from spi import Lexer, StackParser
+        depth = sys.getrecursionlimit() * 2
+        text = 'PROGRAM Deep; BEGIN a := %s1 END.' % ('-' * depth)
+        flat = from_ast(StackParser(Lexer(text)).parse())
+        self.assertEqual(len(flat), depth + 6)
+        self.assertEqual(len(from_ast(to_ast(flat))), len(flat))
+
+    def test_visitors_walk_flat_tree(self):
+        from flat_ast import from_ast
+        from spi import Lexer, Parser, Interpreter, SemanticAnalyzer, PrintTracer
+        for name, text in pascal_sources():
+            tree = Parser(Lexer(text)).parse()
+            outputs = []
+            for root in (tree, from_ast(tree).tree()):
+                output = io.StringIO()
+                try:
+                    SemanticAnalyzer(PrintTracer(output)).visit(root)
+                except Exception as e:
+                    print(e, file=output)
+                outputs.append(output.getvalue())
+            self.assertEqual(outputs[0], outputs[1], name)
+
+        text = """\
+PROGRAM Flat;
+VAR a, b : INTEGER; y : REAL;
+PROCEDURE P(x : INTEGER); BEGIN END;
+BEGIN a := 2; b := -(10 * a + 10 * a DIV 4); y := 20 / 7 + 3.14 END.
+"""
+        tree = Parser(Lexer(text)).parse()
+        expected = Interpreter(tree)
+        expected.interpret()
+        interpreter = Interpreter(from_ast(tree).tree())
+        interpreter.interpret()
+        self.assertEqual(interpreter.GLOBAL_MEMORY, expected.GLOBAL_MEMORY)
+
+
+class ASTFormatTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        from ast_format import dumps, loads
+        from bench import generate_program
+        from spi import Lexer, Parser
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_program(5, 2)))
+        sources.append(
+            ('<literals>', 'PROGRAM L; BEGIN a := %d + 0.1 - 3.5 END.' % 2 ** 70))
+        for name, text in sources:
+            tree = Parser(Lexer(text)).parse()
+            data = dumps(tree)
+            self.assertEqual(dump_ast(loads(data)), dump_ast(tree), name)
+            self.assertEqual(dump_ast(loads(bytearray(data))), dump_ast(tree), name)
+            lazy_tree = Parser(Lexer(text), lazy_procedures=True).parse()
+            self.assertEqual(dumps(lazy_tree), data, name)
+
+    def test_negative_constant(self):
+        from ast_format import dumps, loads
+        from spi import Assign, Num, Var, Token, FIXED_TOKENS, INTEGER_CONST, ID
+        tree = Assign(
+            Var(Token(ID, 'a')), FIXED_TOKENS[':='], Num(Token(INTEGER_CONST, -300)))
+        self.assertEqual(dump_ast(loads(dumps(tree))), dump_ast(tree))
+
+    def test_spans(self):
+        from ast_format import dumps, loads
+        from spi import Assign, Num, Var, Token, FIXED_TOKENS, INTEGER_CONST, ID
+        # offsets at 0, missing ones and spans wider than their children
+        tree = Assign(
+            Var(Token(ID, 'a'), 0, 1), FIXED_TOKENS[':='],
+            Num(Token(INTEGER_CONST, 1), None, 6))
+        tree.start = None
+        tree.end = 7
+        self.assertEqual(dump_ast(loads(dumps(tree))), dump_ast(tree))
+        tree.left.start, tree.right.start, tree.start = 3, 5, 0
+        self.assertEqual(dump_ast(loads(dumps(tree))), dump_ast(tree))
+
+        from spi import Lexer, Parser
+        text = 'PROGRAM P; BEGIN a := ' + ' + '.join(['(b - 1)'] * 100) + ' END.'
+        tree = Parser(Lexer(text)).parse()
+        self.assertEqual(dump_ast(loads(dumps(tree))), dump_ast(tree))
+        # the spans take no more room than missing ones, a byte per offset
+        spans_off = Parser(Lexer(text), spans=False).parse()
+        self.assertLessEqual(len(dumps(tree)), len(dumps(spans_off)))
+
+    def test_files(self):
+        from ast_format import dump, load
+        from spi import Lexer, Parser
+        for name, text in pascal_sources():
+            tree = Parser(Lexer(text)).parse()
+            with tempfile.TemporaryFile() as f:
+                dump(tree, f)
+                f.seek(0)
+                self.assertEqual(dump_ast(load(f)), dump_ast(tree), name)
+                f.seek(0)
+                stream = io.BytesIO(f.read())
+            self.assertEqual(dump_ast(load(stream)), dump_ast(tree), name)
+
+    def test_strings_are_shared(self):
+        from ast_format import dumps, loads
+        from spi import Lexer, Parser
+        text = 'PROGRAM P; BEGIN counter := counter + counter END.'
+        data = dumps(Parser(Lexer(text)).parse())
+        self.assertEqual(data.count(b'counter'), 1)
+        assign, = loads(data).block.compound_statement.children
+        self.assertIs(assign.left.token, assign.right.left.token)
+        self.assertIs(assign.right.left.token, assign.right.right.token)
+
+    def test_bad_data(self):
+        from ast_format import dumps, loads, load, ASTFormatError, FORMAT_VERSION
+        from spi import Lexer, Parser
+        data = dumps(Parser(Lexer('PROGRAM P; BEGIN a := 1 + 2 END.')).parse())
+        header = len(b'SPIA')
+        newer = data[:header] + bytes([FORMAT_VERSION + 1]) + data[header + 1:]
+        for bad in (
+            b'', b'XXXX' + data[header:], newer,
+            data[:-1], data + b'\0', data[:len(data) // 2],
+        ):
+            with self.assertRaises(ASTFormatError):
+                loads(bad)
+        with tempfile.TemporaryFile() as f:
+            with self.assertRaises(ASTFormatError):
+                load(f)
+
+
+class NodeVisitorTestCase(unittest.TestCase):
+    def test_dispatch_tables(self):
+        from spi import NodeVisitor, Num, Var, Token, INTEGER_CONST, ID
+
+        class Visitor(NodeVisitor):
+            def visit_Num(self, node):
+                return 'num'
+
+            def generic_visit(self, node):
+                return 'generic'
+
+        class SubVisitor(Visitor):
+            def visit_Var(self, node):
+                return 'var'
+
+        num = Num(Token(INTEGER_CONST, 1))
+        var = Var(Token(ID, 'a'))
+        self.assertEqual([Visitor().visit(num), Visitor().visit(var)], ['num', 'generic'])
+        self.assertEqual([SubVisitor().visit(num), SubVisitor().visit(var)], ['num', 'var'])
+        # each visitor class has its own table
+        self.assertEqual(Visitor().visit(var), 'generic')
+        self.assertIsNot(Visitor._visit_methods, SubVisitor._visit_methods)
+        with self.assertRaises(Exception) as cm:
+            NodeVisitor().visit(num)
+        self.assertEqual(str(cm.exception), 'No visit_Num method')
+
+    def test_semantic_analyzer_expressions(self):
+        from spi import Lexer, Parser, SemanticAnalyzer
+        text = 'PROGRAM P; VAR a : REAL; BEGIN a := -(1 + a) * 2.5 END.'
+        tree = Parser(Lexer(text)).parse()
+        SemanticAnalyzer().visit(tree)
+        text = 'PROGRAM P; VAR a : REAL; BEGIN a := -(1 + b) END.'
+        tree = Parser(Lexer(text)).parse()
+        with self.assertRaises(Exception) as cm:
+            SemanticAnalyzer().visit(tree)
+        self.assertEqual(str(cm.exception), "Error: Symbol(identifier) not found 'b'")
+
+
+class TracerTestCase(unittest.TestCase):
+    def test_events(self):
+        import contextlib
+        from spi import (
+            Lexer, Parser, SemanticAnalyzer, RecordingTracer,
+            TRACE_ENTER, TRACE_LEAVE, TRACE_INSERT, TRACE_LOOKUP,
+        )
+        text = 'PROGRAM T; VAR a : INTEGER; PROCEDURE P; BEGIN a := 1 END; BEGIN END.'
+        tree = Parser(Lexer(text)).parse()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            SemanticAnalyzer().visit(tree)
+            tracer = RecordingTracer()
+            SemanticAnalyzer(tracer).visit(tree)
+        # tracing is off by default, and no tracer prints
+        self.assertEqual(output.getvalue(), '')
+        events = [
+            (event.kind, event.scope.scope_name, event.name)
+            for event in tracer.events
+        ]
+        self.assertEqual(events, [
+            (TRACE_ENTER, 'global', None),
+            (TRACE_INSERT, 'global', 'INTEGER'),
+            (TRACE_INSERT, 'global', 'REAL'),
+            (TRACE_LOOKUP, 'global', 'INTEGER'),
+            (TRACE_LOOKUP, 'global', 'a'),
+            (TRACE_INSERT, 'global', 'a'),
+            (TRACE_INSERT, 'global', 'P'),
+            (TRACE_ENTER, 'P', None),
+            (TRACE_LOOKUP, 'P', 'a'),
+            (TRACE_LOOKUP, 'global', 'a'),
+            (TRACE_LEAVE, 'P', None),
+            (TRACE_LEAVE, 'global', None),
+        ])
+
+    def test_print_tracer(self):
+        from spi import Lexer, Parser, SemanticAnalyzer, PrintTracer
+        text = 'PROGRAM T; VAR a : INTEGER; BEGIN a := 1 END.'
+        tree = Parser(Lexer(text)).parse()
+        output = io.StringIO()
+        SemanticAnalyzer(PrintTracer(output)).visit(tree)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[:6], [
+            'ENTER scope: global',
+            'Insert: INTEGER',
+            'Insert: REAL',
+            'Lookup: INTEGER. (Scope name: global)',
+            'Lookup: a. (Scope name: global)',
+            'Insert: a',
+        ])
+        self.assertIn('Scope name     : global', lines)
+        self.assertIn('      a: <VarSymbol(name=\'a\', type=\'INTEGER\')>', lines)
+        self.assertEqual(lines[-1], 'LEAVE scope: global')
+
+
+class NodeWalkerTestCase(unittest.TestCase):
+    def test_hooks(self):
+        from spi import Lexer, Parser, NodeWalker
+        events = []
+        test = self
+
+        class Walker(NodeWalker):
+            def enter_BinOp(self, node):
+                events.append('enter ' + node.op.value)
+
+            def leave_BinOp(self, node, results):
+                events.append('leave ' + node.op.value)
+                return '(%s %s %s)' % (results[0], node.op.value, results[1])
+
+            def leave_Num(self, node, results):
+                return str(node.value)
+
+            def enter_Assign(self, node):
+                return (node.right,)
+
+            def leave_Assign(self, node, results):
+                return results[0]
+
+            def leave_Compound(self, node, results):
+                return results
+
+            def enter_Var(self, node):
+                test.fail('the left-hand side is not walked')
+
+        tree = Parser(Lexer('PROGRAM W; BEGIN a := 1 + 2 * 3; b := 4 END.')).parse()
+        compound = tree.block.compound_statement
+        self.assertEqual(Walker().visit(compound), ['(1 + (2 * 3))', '4'])
+        self.assertEqual(events, ['enter +', 'enter *', 'leave *', 'leave +'])
+        # nodes without hooks are walked through
+        self.assertIsNone(Walker().visit(tree))
+        with self.assertRaises(Exception) as cm:
+            NodeWalker().visit(object())
+        self.assertEqual(str(cm.exception), 'No enter_object or leave_object method')
+
+    def test_deep_tree(self):
+        from spi import Lexer, StackParser, StackInterpreter, StackSemanticAnalyzer
+        from src2srccompiler import SourceToSourceCompiler
+        depth = sys.getrecursionlimit() * 10
+        text = 'PROGRAM Deep; VAR a : INTEGER; BEGIN a := %s1%s; %s END.' % (
+            '-' * depth, ' + 1' * depth, 'BEGIN ' * depth + 'END ' * depth)
+        tree = StackParser(Lexer(text)).parse()
+        interpreter = StackInterpreter(tree)
+        interpreter.interpret()
+        self.assertEqual(interpreter.GLOBAL_MEMORY['a'], 1 + depth)
+        StackSemanticAnalyzer().visit(tree)
+        compiler = SourceToSourceCompiler()
+        compiler.visit(tree)
+        self.assertIn('<a1:INTEGER> := %s1' % ('-' * depth), compiler.output)
+
+    def test_stack_passes(self):
+        from spi import (
+            Lexer, Parser, Interpreter, SemanticAnalyzer, StackInterpreter,
+            StackSemanticAnalyzer, PrintTracer,
+        )
+        from bench import generate_statement_program
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_statement_program(50)))
+        for name, text in sources:
+            tree = Parser(Lexer(text)).parse()
+            outputs = []
+            for analyzer_class in (SemanticAnalyzer, StackSemanticAnalyzer):
+                output = io.StringIO()
+                try:
+                    analyzer_class(PrintTracer(output)).visit(tree)
+                except Exception as e:
+                    print(e, file=output)
+                outputs.append(output.getvalue())
+            self.assertEqual(outputs[0], outputs[1], name)
+        expected = Interpreter(tree)
+        expected.interpret()
+        interpreter = StackInterpreter(tree)
+        interpreter.interpret()
+        self.assertEqual(interpreter.GLOBAL_MEMORY, expected.GLOBAL_MEMORY)
+
+
+class InterpreterTestCase(unittest.TestCase):
+    def makeInterpreter(self, text):
+        from spi import Lexer, Parser, Interpreter
+        lexer = Lexer(text)
+        parser = Parser(lexer)
+        tree = parser.parse()
+        interpreter = Interpreter(tree)
+        return interpreter
+
+    def test_program(self):
+        text = """\
+PROGRAM Part14;
+VAR
+   number : INTEGER;
+   a, b   : INTEGER;
+   y      : REAL;
+
+PROCEDURE P1(x : INTEGER; r : REAL);
+VAR k : INTEGER;
+BEGIN {P1}
+   k := x
+END;  {P1}
+
+BEGIN {Part14}
+   number := 2;
+   a := number ;
+   b := 10 * a + 10 * number DIV 4;
+   y := 20 / 7 + 3.14
+END.  {Part14}
+"""
+        interpreter = self.makeInterpreter(text)
+        interpreter.interpret()
+
+        globals = interpreter.GLOBAL_MEMORY
+        self.assertEqual(len(globals.keys()), 4)
+        self.assertEqual(globals['number'], 2)
+        self.assertEqual(globals['a'], 2)
+        self.assertEqual(globals['b'], 25)
+        self.assertAlmostEqual(globals['y'], float(20) / 7 + 3.14)  # 5.9971...
+
+    def test_hash_consed_program(self):
+        from spi import Lexer, Parser, Interpreter, HashConsingNodeFactory
+        text = """\
+PROGRAM Dag;
+VAR a, b, c : INTEGER;
+BEGIN
+   a := 2;
+   b := 10 * a + 10 * a DIV 4;
+   a := 10 * a + 10 * a DIV 4;
+   c := -(10 * a) + -(10 * a)
+END.
+"""
+        parser = Parser(Lexer(text), node_factory=HashConsingNodeFactory(),
+                        spans=False)
+        interpreter = Interpreter(parser.parse())
+        interpreter.interpret()
+        self.assertEqual(interpreter.GLOBAL_MEMORY, {'a': 25, 'b': 25, 'c': -500})
+
+    def test_code_generator(self):
+        from spi import (
+            Lexer, Parser, Interpreter, SemanticAnalyzer, CodeGenerator, PrintTracer,
+        )
+        from bench import generate_statement_program
+        sources = list(pascal_sources())
+        sources.append(('<generated>', generate_statement_program(50)))
+        sources.append(('<undeclared>', 'PROGRAM U; BEGIN a := +(1 - -2) / 4 END.'))
+        # b is only declared in the scope of P
+        sources.append(('<scopes>', """
+PROGRAM S; VAR a : INTEGER;
+PROCEDURE P; VAR b : INTEGER; BEGIN b := a * b END;
+BEGIN a := 1; a := a + b END.
+"""))
+        for name, text in sources:
+            tree = Parser(Lexer(text)).parse()
+            results = []
+            for analyzer_class in (SemanticAnalyzer, CodeGenerator):
+                trace = io.StringIO()
+                try:
+                    analyzer_class(PrintTracer(trace)).visit(tree)
+                except Exception as e:
+                    error = str(e)
+                else:
+                    error = None
+                try:
+                    code = analyzer_class().visit(tree)
+                except Exception as e:
+                    code = None
+                    untraced_error = str(e)
+                else:
+                    untraced_error = None
+                results.append((trace.getvalue(), error, untraced_error))
+            # the same trace and the same errors as the SemanticAnalyzer
+            self.assertEqual(results[0], results[1], name)
+            if code is None:
+                continue
+            expected = Interpreter(tree)
+            interpreter = Interpreter(tree)
+            try:
+                expected.interpret()
+            except TypeError as e:
+                # such as arithmetic on a variable that was never set
+                with self.assertRaises(TypeError) as cm:
+                    interpreter.execute(code)
+                self.assertEqual(str(cm.exception), str(e), name)
+            else:
+                interpreter.execute(code)
+            self.assertEqual(interpreter.GLOBAL_MEMORY, expected.GLOBAL_MEMORY, name)
+        self.assertEqual(results[1][2], "Error: Symbol(identifier) not found 'b'")
+
+    def test_expression_invalid_syntax(self):
+        with self.assertRaises(Exception):
+            self.makeInterpreter(
+            """
+            PROGRAM Test;
+            VAR
+                a : INTEGER;
+            BEGIN
+               a := 10 * ;  {Invalid syntax}
+            END.
+            """
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
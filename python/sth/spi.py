@@ -1,3 +1,6 @@
+import sys
+from itertools import product
+
 INTEGER         = "INTEGER"
 REAL            = "REAL"
 INTEGER_CONST   = "INTEGER_CONST"
@@ -66,6 +69,15 @@ RESERVED_KEYWORDS = {
         "END": Token("END", "END")
 }
 
+# 关键字不区分大小写：预先生成每个关键字所有大小写拼写到token的映射
+# 查找标识符时不需要先调用upper()生成一个新的字符串
+KEYWORD_SPELLINGS = dict(
+        (spelling, token)
+        for keyword, token in RESERVED_KEYWORDS.items()
+        for spelling in map(
+                ''.join, product(*zip(keyword.lower(), keyword.upper())))
+)
+
 
 class Lexer(object):
     def __init__(self, text):
@@ -86,6 +98,15 @@ class Lexer(object):
         else:
             self.current_char = self.text[self.pos]
 
+    def advance_to(self, pos):
+        # 将pos直接移动到指定位置
+        # 并设置current_char
+        self.pos = pos
+        if pos > len(self.text) - 1:
+            self.current_char = None
+        else:
+            self.current_char = self.text[pos]
+
     def peek(self):
         # look forward
         peek_pos = self.pos + 1
@@ -106,36 +127,38 @@ class Lexer(object):
     def number(self):
         # 将字符串解析为数字
         # 并返回数值
-        result = ""
-        while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
-            self.advance()
-        if self.current_char == '.':  # 浮点数常量
-            result += self.current_char
-            self.advance()
-            while (
-                    self.current_char is not None
-                    and self.current_char.isdigit()
-            ):
-                result += self.current_char
-                self.advance()
-            token = Token("REAL_CONST", float(result))
+        # 先找到数字的结尾，再对self.text做一次切片
+        # 避免逐个字符拼接字符串
+        text = self.text
+        start = end = self.pos
+        length = len(text)
+        while end < length and text[end].isdigit():
+            end += 1
+        if end < length and text[end] == '.':  # 浮点数常量
+            end += 1
+            while end < length and text[end].isdigit():
+                end += 1
+            token = Token("REAL_CONST", float(text[start:end]))
         else:
-            token = Token("INTEGER_CONST", int(result))
+            token = Token("INTEGER_CONST", int(text[start:end]))
 
+        self.advance_to(end)
         return token
 
     def _id(self):
-        result = ""
+        text = self.text
+        start = end = self.pos
+        length = len(text)
         # isalnum表示为字母或者数字
-        while self.current_char is not None and self.current_char.isalnum():
-            result += self.current_char
-            self.advance()
+        while end < length and text[end].isalnum():
+            end += 1
+        self.advance_to(end)
+        result = text[start:end]
 
-        # 从RESERVED_KEYWORDS中查找
+        # 从KEYWORD_SPELLINGS中查找
         # 找到了就将其对应的token取出
-        # 否则使用默认的token
-        token = RESERVED_KEYWORDS.get(result, Token(ID, result))
+        # 否则使用默认的token，标识符用sys.intern驻留
+        token = KEYWORD_SPELLINGS.get(result) or Token(ID, sys.intern(result))
         return token
 
     def get_next_token(self):
@@ -60,12 +60,16 @@ class Lexer(object):
     def integer(self):
         # 将字符串解析为数字
         # 并返回数值
-        result = ""
-        while self.current_char is not None and self.current_char.isdigit():
-            result += self.current_char
-            self.advance()
-
-        return int(result)
+        # 先找到数字的结尾，再对self.text做一次切片
+        text = self.text
+        start = end = self.pos
+        length = len(text)
+        while end < length and text[end].isdigit():
+            end += 1
+
+        self.pos = end
+        self.current_char = text[end] if end < length else None
+        return int(text[start:end])
 
     def get_next_token(self):
         """